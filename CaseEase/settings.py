@@ -60,7 +60,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
-    'accounts.middleware.RoleBasedRedirectMiddleware',
+    # Role checks by URL name; see accounts.roles.
+    'accounts.middleware.RoleBasedAccessMiddleware',
 ]
 
 import os
@@ -83,6 +84,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'accounts.context_processors.role',
             ],
         },
     },
@@ -151,7 +153,69 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_ROOT = BASE_DIR / "staticfiles" 
 
+# Case evidence and chat attachments are stored once per distinct content
+# and hard linked under their names; see cases.storage.
+STORAGES = {
+    'default': {'BACKEND': 'cases.storage.DedupStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Case lists are paginated by cursor; ?page_size= may override the default up to the max.
+CASE_LIST_PAGE_SIZE = 24
+CASE_LIST_MAX_PAGE_SIZE = 100
+
+# Dashboard figures are cached per role and user and dropped whenever a case
+# they count changes; the timeout (seconds) only bounds how long an entry a
+# missed invalidation left behind can live. The cache must be shared by all
+# web and worker processes (database, Redis or Memcached; see the README):
+# with the default local-memory cache the figures aren't cached at all.
+DASHBOARD_CACHE_ALIAS = 'default'
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Profile images are shown as thumbnails rendered by background tasks;
+# see accounts.thumbnails.
+THUMBNAIL_FORMAT = 'webp'
+
+# Media is served by cases.views.protected_media after an access check. In
+# production let the front-end server send the bytes: 'x-accel-redirect'
+# for nginx, with an internal location aliasing MEDIA_ROOT, e.g.
+#     location /protected-media/ { internal; alias /srv/caseease/media/; }
+# or 'x-sendfile' for Apache's mod_xsendfile. None streams from Django.
+CASE_MEDIA_SENDFILE = None
+CASE_MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Live case events reach viewers on the other server processes through a
+# broker; see cases.events. None picks cases.events.DatabaseBroker when
+# WEB_CONCURRENCY asks for more than one web process, and the in-process
+# LocalBroker otherwise. Processes relaying through the database poll it
+# this many seconds apart while they have viewers.
+CASE_EVENTS_BROKER = None
+CASE_EVENTS_POLL_INTERVAL = 1
+
+# Side effects a response doesn't wait for are queued as background tasks
+# and run by `manage.py run_tasks`, which must be running for notifications,
+# reindexing and thumbnails to happen (see the README); see cases.tasks.
+# Eager mode runs them in the process that queued them instead, when its
+# transaction commits, for development without a worker.
+CASE_TASKS_EAGER = False
+
+# Case changes are written to a notification outbox and sent as one digest
+# per recipient by a background task, this many seconds after the first;
+# see cases.notifications. Digests are emailed to the recipient's address
+# through Django's email settings (EMAIL_HOST and friends); with DEBUG on
+# they are printed by the console email backend instead.
+CASE_NOTIFICATION_BACKENDS = ['cases.notifications.EmailBackend']
+CASE_NOTIFICATION_DIGEST_DELAY = 60
+if DEBUG:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Auto-assignment gives each approved case to the handler with the fewest
+# open cases for their weight, skipping handlers at their cap. This cap
+# applies to handlers without a HandlerCapacity of their own; None means
+# no cap. See cases.assignment.
+CASE_ASSIGNMENT_MAX_OPEN = None
@@ -14,12 +14,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.generic import TemplateView
 from django.contrib.auth import views as auth_views
+from cases.views import protected_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -27,9 +29,6 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('cases/', include('cases.urls')),
 
+    # Uploaded media, behind the same checks in development and production.
+    re_path(r'^%s(?P<name>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), protected_media, name='media'),
 ]
-
-
-#for serving uploaded media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
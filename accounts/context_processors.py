@@ -0,0 +1,7 @@
+from .roles import request_role
+
+
+def role(request):
+    """``user_role``: the signed-in user's role from accounts.roles, without querying their groups."""
+    user = getattr(request, 'user', None)
+    return {'user_role': request_role(request) if user is not None and user.is_authenticated else None}
@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Render the missing thumbnails of every profile image, e.g. after a deploy or a new size."
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.exclude(profile_image='').exclude(profile_image__isnull=True)
+        rendered, failed = generate_thumbnails(users.iterator(), log=self.stderr.write)
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} thumbnail(s); {failed} image(s) failed."))
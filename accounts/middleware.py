@@ -1,50 +1,35 @@
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import redirect
-from django.urls import reverse
 
-class RoleBasedAccessMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-        self.restricted_paths = {
-            '/accounts/admin-dashboard/': 'admin',
-            '/accounts/handler-dashboard/': 'handler',
-            '/accounts/dashboard/': 'user',
-        }
-
-    def __call__(self, request):
-        path = request.path
-        user = request.user
-
-        # Redirect authenticated users from login page based on role
-        if user.is_authenticated and path == reverse('login'):
-            if user.role == 'admin':
-                return redirect('admin_dashboard')
-            elif user.role == 'handler':
-                return redirect('handler_dashboard')
-            elif user.role == 'user':
-                return redirect('user_dashboard')
+from .roles import ROUTE_ROLES, dashboard, request_role
 
-        # Restrict access based on role
-        for restricted_path, required_role in self.restricted_paths.items():
-            if path.startswith(restricted_path):
-                if not user.is_authenticated:
-                    return redirect('login')
-                if user.role != required_role:
-                    return redirect('unauthorized')
-
-        return self.get_response(request)
 
+class RoleBasedAccessMiddleware:
+    """
+    Keeps each role to its own pages (accounts.roles.ROUTE_ROLES) and sends
+    signed-in users from the login page to their dashboard. Runs once the
+    URL is resolved, so the check is a lookup by URL name.
+    """
 
-class RoleBasedRedirectMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if request.user.is_authenticated and request.path == '/accounts/login/':
-            if request.user.role == 'admin':
-                return redirect('admin_dashboard')
-            elif request.user.role == 'user':
-                return redirect('user_dashboard')
-            elif request.user.role == 'handler':
-                return redirect('handler_dashboard')
-        
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = request.resolver_match.url_name
+        user = request.user
+        if user.is_authenticated:
+            # Resolved for every request, so views and templates get it for free.
+            role = request_role(request)
+            if name == 'login':
+                return redirect(dashboard(user))
+        required = ROUTE_ROLES.get(name)
+        if required is None:
+            return None
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if role not in required:
+            return redirect('unauthorized')
+        return None
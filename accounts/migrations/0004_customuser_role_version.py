@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_customuser_phone_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='role_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -13,6 +13,8 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
     profile_image = models.ImageField(upload_to='profile_images/', null=True, blank=True)
     phone_number = models.CharField(max_length=15, null=True, blank=True) 
+    # Bumped when the user's groups change, so cached roles know they're stale; see accounts.roles.
+    role_version = models.PositiveIntegerField(default=0, editable=False)
 
 
     def __str__(self):
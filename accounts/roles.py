@@ -0,0 +1,113 @@
+"""
+Roles, and which pages each may open.
+
+A user's effective role is 'admin' for superusers and users whose role is
+admin, 'handler' for users whose role is handler or who are in the handler
+group, and 'user' otherwise. The group membership takes a query, so the role
+is worked out once per session, at login or on the session's first request,
+and kept in the session with a stamp of what it was derived from: the
+user's role, superuser flag and role_version, which changing their groups
+bumps. The user row is loaded on every request anyway, so checking the stamp
+is free, and a change of groups applies to every session of the user from
+their next request.
+
+ROUTE_ROLES maps URL names to the roles allowed there.
+RoleBasedAccessMiddleware (accounts.middleware) looks the resolved URL name
+up in it, one dict lookup per request. Views that answer JSON check for
+themselves so they can answer 403 JSON, and what a user may do with a
+particular case stays with the case views.
+"""
+from django.db.models import F
+
+
+ADMIN = 'admin'
+HANDLER = 'handler'
+USER = 'user'
+HANDLER_GROUP = 'handler'
+
+DASHBOARDS = {
+    ADMIN: 'admin_dashboard',
+    HANDLER: 'handler_dashboard',
+    USER: 'user_dashboard',
+}
+
+SESSION_KEY = '_effective_role'
+
+
+def route_roles(allowed):
+    """{url name: frozenset of roles} from {role: url names}."""
+    routes = {}
+    for role, names in allowed.items():
+        for name in names:
+            routes.setdefault(name, set()).add(role)
+    return {name: frozenset(roles) for name, roles in routes.items()}
+
+
+ROUTE_ROLES = route_roles({
+    ADMIN: [
+        'admin_dashboard', 'all_cases', 'pending_cases', 'approved_cases', 'admin_assigned_cases',
+        'closed_cases', 'view_handlers', 'add_handler', 'remove_handler', 'view_users', 'remove_user',
+        'assign_handler_inline',
+    ],
+    HANDLER: [
+        'handler_dashboard', 'handler_all_cases', 'handler_assigned_cases', 'handler_ongoing_cases',
+        'handler_closed_cases', 'start_operating', 'update_status',
+    ],
+    USER: [
+        'user_dashboard', 'user_all_cases', 'user_pending_cases', 'user_ongoing_cases', 'user_closed_cases',
+    ],
+})
+
+
+def compute_role(user):
+    if user.is_superuser or user.role == ADMIN:
+        return ADMIN
+    if user.role == HANDLER or user.groups.filter(name=HANDLER_GROUP).exists():
+        return HANDLER
+    return USER
+
+
+def role_stamp(user):
+    return f'{user.role}:{int(user.is_superuser)}:{user.role_version}'
+
+
+def effective_role(user, session=None):
+    """
+    ``user``'s role, None if anonymous. Remembered on the user object and,
+    given the ``session``, in the session while its stamp matches.
+    """
+    if not user.is_authenticated:
+        return None
+    role = getattr(user, '_effective_role', None)
+    if role is not None:
+        return role
+    stamp = role_stamp(user)
+    cached = session.get(SESSION_KEY) if session is not None else None
+    if cached and cached[1] == stamp:
+        role = cached[0]
+    else:
+        role = compute_role(user)
+        if session is not None:
+            session[SESSION_KEY] = [role, stamp]
+    user._effective_role = role
+    return role
+
+
+def request_role(request):
+    return effective_role(request.user, request.session)
+
+
+def dashboard(user, session=None):
+    """The URL name of ``user``'s dashboard."""
+    return DASHBOARDS[effective_role(user, session)]
+
+
+def groups_changed(users, user_ids):
+    """Make the cached roles of ``user_ids`` stale; ``users`` are instances in memory to update too."""
+    from django.contrib.auth import get_user_model
+
+    get_user_model().objects.filter(pk__in=user_ids).update(role_version=F('role_version') + 1)
+    for user in users:
+        # Keep a later save() of the instance from writing the old version back.
+        user.role_version += 1
+        user.__dict__.pop('_effective_role', None)
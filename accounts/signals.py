@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .roles import effective_role, groups_changed
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def stale_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        groups_changed([instance], [instance.pk])
+    elif action == 'pre_clear':
+        # A group losing all its users: pk_set isn't given, so look them up before they go.
+        groups_changed([], list(instance.user_set.values_list('pk', flat=True)))
+    else:
+        groups_changed([], pk_set)
+
+
+@receiver(user_logged_in)
+def remember_role(sender, request, user, **kwargs):
+    # Worked out while logging in, so the session's requests don't have to.
+    user.__dict__.pop('_effective_role', None)
+    effective_role(user, request.session)
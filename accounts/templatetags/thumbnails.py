@@ -0,0 +1,11 @@
+from django import template
+
+from accounts.thumbnails import thumbnail_url
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(image, size='avatar'):
+    """``{{ user.profile_image|thumbnail:'profile' }}``: the URL of the image at one of thumbnails.SIZES."""
+    return thumbnail_url(image, size)
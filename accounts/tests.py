@@ -1,3 +1,250 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from cases.models import Case, Task
+from cases.tasks import run_pending
+from cases.tests import QueryBudgetTestCase, url_names
+from . import thumbnails, urls as account_urls
+from .templatetags.thumbnails import thumbnail
+
+
+class AccountQueryBudgetTests(QueryBudgetTestCase):
+    BUDGETS = {
+        # Auth
+        'login': (1, 1),
+        'logout': (4, 3),
+        'register': (1, 1),
+        'unauthorized': (2, 2),
+        # Dashboards
+        'admin_dashboard': (7, 2),
+        'handler_dashboard': (3, 2),
+        'user_dashboard': (3, 2),
+        # Admin case management
+        'all_cases': (6, 80),
+        'pending_cases': (3, 80),
+        'approved_cases': (5, 100),
+        'admin_assigned_cases': (3, 80),
+        'closed_cases': (3, 80),
+        'pending_cases_approve': (20, 10),
+        'bulk_approve_cases': (16, 90),
+        'bulk_assign_cases': (16, 90),
+        # Reads a row per handler, whose number grow() raises too.
+        'auto_assign_cases': (16, 130),
+        # Streams a query per chunk of cases; see cases.tests.ExportTests.
+        'export_cases': None,
+        # Handler case views
+        'handler_all_cases': (4, 80),
+        'handler_assigned_cases': (3, 80),
+        'handler_ongoing_cases': (3, 80),
+        'handler_closed_cases': (3, 80),
+        'start_operating': (19, 10),
+        'update_status': (20, 10),
+        # User case views
+        'user_all_cases': (4, 80),
+        'user_pending_cases': (3, 80),
+        'user_ongoing_cases': (3, 80),
+        'user_closed_cases': (3, 80),
+        # Handler and user management
+        'view_handlers': (3, 80),
+        'add_handler': (2, 2),
+        'remove_handler': (3, 3),
+        'view_users': (3, 80),
+        'remove_user': (3, 3),
+        # Profiles
+        'view_profile': (3, 2),
+        'view_user_profile': (3, 2),
+        'view_handler_profile': (3, 2),
+    }
+
+    def test_every_url_has_a_budget(self):
+        self.assertLessEqual(url_names(account_urls), set(self.BUDGETS))
+
+    def test_auth_views(self):
+        self.check_scaling({
+            'login': lambda: self.measure(None, 'get', reverse('login')),
+            'register': lambda: self.measure(None, 'get', reverse('register')),
+            'unauthorized': lambda: self.measure(self.user, 'get', reverse('unauthorized')),
+            'logout': lambda: self.measure(self.user, 'get', reverse('logout')),
+        })
+
+    def test_admin_views(self):
+        # The approved list only loads the handler choices when it has cases.
+        Case.objects.create(title='Approved', description='d', created_by=self.user, status='Approved')
+        self.check_scaling({
+            name: (lambda name=name: self.measure(self.admin, 'get', reverse(name)))
+            for name in [
+                'admin_dashboard', 'all_cases', 'pending_cases', 'approved_cases',
+                'admin_assigned_cases', 'closed_cases', 'view_handlers', 'add_handler',
+                'view_users', 'view_profile',
+            ]
+        } | {
+            'remove_handler': lambda: self.measure(self.admin, 'get', reverse('remove_handler', args=[self.handler.pk])),
+            'remove_user': lambda: self.measure(self.admin, 'get', reverse('remove_user', args=[self.user.pk])),
+        })
+
+    def test_handler_views(self):
+        self.check_scaling({
+            name: (lambda name=name: self.measure(self.handler, 'get', reverse(name)))
+            for name in [
+                'handler_dashboard', 'handler_all_cases', 'handler_assigned_cases',
+                'handler_ongoing_cases', 'handler_closed_cases', 'view_handler_profile',
+            ]
+        })
+
+    def test_user_views(self):
+        self.check_scaling({
+            name: (lambda name=name: self.measure(self.user, 'get', reverse(name)))
+            for name in [
+                'user_dashboard', 'user_all_cases', 'user_pending_cases',
+                'user_ongoing_cases', 'user_closed_cases', 'view_user_profile',
+            ]
+        })
+
+    def test_status_changes(self):
+        def new_case(status):
+            return Case.objects.create(
+                title='Workflow', description='d', created_by=self.user,
+                assigned_to=self.handler, status=status,
+            )
+
+        self.check_scaling({
+            'pending_cases_approve': lambda: self.measure(
+                self.admin, 'post', reverse('pending_cases'), {'case_id': new_case('Pending').pk},
+            ),
+            'start_operating': lambda: self.measure(
+                self.handler, 'post', reverse('start_operating', args=[new_case('Assigned').pk]),
+            ),
+            'update_status': lambda: self.measure(
+                self.handler, 'post', reverse('update_status', args=[new_case('In Progress').pk]),
+                {'status': 'Resolved'},
+            ),
+            # A fixed number of queries however many cases are sent.
+            'bulk_approve_cases': lambda: self.measure(
+                self.admin, 'post', reverse('bulk_approve_cases'),
+                {'case_ids': [new_case('Pending').pk for _ in range(20)]},
+            ),
+            'bulk_assign_cases': lambda: self.measure(
+                self.admin, 'post', reverse('bulk_assign_cases'),
+                {'case_ids': [new_case('Approved').pk for _ in range(20)], 'assigned_to': self.handler.pk},
+            ),
+            'auto_assign_cases': lambda: self.measure(
+                self.admin, 'post', reverse('auto_assign_cases'),
+                {'case_ids': [new_case('Approved').pk for _ in range(20)]},
+            ),
+        })
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='reporter', password='pw')
+
+    def image(self, color, name='me.png', size=(300, 200)):
+        data = io.BytesIO()
+        Image.new('RGB', size, color).save(data, 'PNG')
+        return SimpleUploadedFile(name, data.getvalue(), content_type='image/png')
+
+    def test_renders_a_square_thumbnail_per_size(self):
+        thumbnails.replace_profile_image(self.user, self.image('red'))
+        run_pending()
+        name = self.user.profile_image.name
+        version = thumbnails.source_version(name)
+        for size, pixels in thumbnails.SIZES.items():
+            target = thumbnails.thumbnail_name(name, size, version)
+            self.assertEqual(thumbnail(self.user.profile_image, size), default_storage.url(target))
+            with Image.open(default_storage.path(target)) as rendered:
+                self.assertEqual((rendered.format, rendered.size), ('WEBP', (pixels, pixels)))
+
+    def test_a_missing_thumbnail_is_queued_not_rendered(self):
+        self.user.profile_image = self.image('red')
+        self.user.save()
+        # The request doesn't render the image, and only the first one queues it.
+        self.assertEqual(thumbnail(self.user.profile_image, 'avatar'), self.user.profile_image.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(thumbnail(self.user.profile_image, 'avatar'), self.user.profile_image.url)
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(os.path.exists(default_storage.path(thumbnails.THUMBNAIL_DIR)))
+        self.assertEqual(Task.objects.filter(dedup_key=f'thumbnails:{self.user.profile_image.name}').count(), 1)
+        run_pending()
+        self.assertNotEqual(thumbnail(self.user.profile_image, 'avatar'), self.user.profile_image.url)
+
+    def test_replacing_the_image_drops_the_old_thumbnails(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('view_user_profile'), {
+            'username': 'reporter', 'email': '', 'profile_image': self.image('red'),
+        })
+        run_pending()
+        self.user.refresh_from_db()
+        old = default_storage.path(thumbnails.thumbnail_dir(self.user.profile_image.name))
+        self.assertTrue(os.listdir(old))
+        self.client.post(reverse('view_user_profile'), {
+            'username': 'reporter', 'email': '', 'profile_image': self.image('blue'),
+        })
+        self.assertTrue(os.path.exists(old))
+        run_pending()
+        self.user.refresh_from_db()
+        self.assertFalse(os.path.exists(old))
+        self.assertIn('/media/thumbnails/', self.client.get(reverse('view_user_profile')).content.decode())
+
+    def test_falls_back_to_the_original(self):
+        self.user.profile_image = SimpleUploadedFile('broken.png', b'not an image')
+        self.user.save()
+        self.assertEqual(thumbnail(self.user.profile_image, 'avatar'), self.user.profile_image.url)
+
+    def test_generate_thumbnails(self):
+        self.user.profile_image = self.image('green')
+        self.user.save()
+        out = io.StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn(f'Rendered {len(thumbnails.SIZES)} thumbnail(s)', out.getvalue())
+        call_command('generate_thumbnails', stdout=out)
+        self.assertIn('Rendered 0 thumbnail(s)', out.getvalue())
+
+
+class RoleAccessTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.handler_group = Group.objects.get_or_create(name='handler')[0]
+        self.handler = User.objects.create_user(username='handler', password='pw')
+        self.handler.groups.add(self.handler_group)
+        self.user = User.objects.create_user(username='reporter', password='pw')
+
+    def test_routes_are_kept_to_their_roles(self):
+        response = self.client.get(reverse('all_cases'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('all_cases')}", fetch_redirect_response=False)
+        self.client.force_login(self.handler)
+        self.assertRedirects(self.client.get(reverse('all_cases')), reverse('unauthorized'), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('handler_dashboard')).status_code, 200)
+        self.assertRedirects(self.client.get(reverse('login')), reverse('handler_dashboard'), fetch_redirect_response=False)
+
+    def test_the_role_costs_no_queries_after_login(self):
+        self.client.force_login(self.handler)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('handler_dashboard'))
+            self.client.get(reverse('view_handler_profile'))
+        self.assertFalse([query for query in queries.captured_queries if 'auth_group' in query['sql']])
+
+    def test_group_changes_apply_to_open_sessions(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('handler_dashboard')).status_code, 302)
+        self.handler_group.user_set.add(self.user)
+        self.assertEqual(self.client.get(reverse('handler_dashboard')).status_code, 200)
+        self.user.refresh_from_db()
+        self.user.groups.clear()
+        self.assertEqual(self.client.get(reverse('handler_dashboard')).status_code, 302)
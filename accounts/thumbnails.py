@@ -0,0 +1,154 @@
+"""
+Fixed-size thumbnails of profile images.
+
+Templates show profile images at avatar size through the ``thumbnail``
+filter (accounts.templatetags.thumbnails), which serves a square WebP (or
+JPEG, see THUMBNAIL_FORMAT) cut to the size instead of the original
+upload. Thumbnails are files under MEDIA_ROOT/thumbnails, one directory
+per source name, each named by the size and the source's file size and
+modification time. Naming them costs a stat, not a read of the image, and
+they never go stale: a changed source gets new names.
+
+Rendering is never done on the request thread. Replacing a profile image
+(replace_profile_image()) queues a background task (cases.tasks) that
+deletes the old image's thumbnails and renders the new one's. A thumbnail
+still missing when a page asks for it is queued the same way, once per
+QUEUED_TIMEOUT (the cache remembers it), and until the worker has rendered
+it the filter falls back to the original; generate_thumbnails renders them
+all ahead of time.
+"""
+import hashlib
+import os
+import shutil
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from cases.tasks import enqueue, task
+
+
+# Pixel sizes, twice the CSS size the templates show them at for high-density screens.
+SIZES = {
+    'avatar': 96,
+    'profile': 140,
+}
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+QUALITY = 80
+THUMBNAIL_DIR = 'thumbnails'
+# Seconds before a page asks again for a thumbnail it has queued; bounds
+# the wait on a task that failed for good.
+QUEUED_TIMEOUT = 600
+
+
+def thumbnail_format():
+    return getattr(settings, 'THUMBNAIL_FORMAT', 'webp')
+
+
+def source_version(name):
+    """What tells versions of a stored image apart: its size and modification time, from one stat."""
+    stat = os.stat(default_storage.path(name))
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def thumbnail_dir(name):
+    key = hashlib.sha256(name.encode()).hexdigest()
+    return f'{THUMBNAIL_DIR}/{key[:2]}/{key}'
+
+
+def thumbnail_name(name, size, version, format=None):
+    format = format or thumbnail_format()
+    return f'{thumbnail_dir(name)}/{size}-{version}.{format}'
+
+
+def render_thumbnail(source_path, target_path, pixels, format):
+    """Cut the image at ``source_path`` to a ``pixels`` square at ``target_path``."""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if format == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if format == 'webp' and 'A' in image.getbands() else 'RGB')
+        thumbnail = ImageOps.fit(image, (pixels, pixels), Image.Resampling.LANCZOS)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temporary = f'{target_path}.{os.getpid()}.tmp'
+        thumbnail.save(temporary, FORMATS[format], quality=QUALITY)
+        os.replace(temporary, target_path)
+    return target_path
+
+
+def render(name, size, version=None, format=None):
+    """Render the thumbnail of ``name`` at ``size`` unless it's there; returns whether it rendered one."""
+    version = version or source_version(name)
+    format = format or thumbnail_format()
+    target = thumbnail_name(name, size, version, format)
+    if default_storage.exists(target):
+        return False
+    target_path = render_thumbnail(default_storage.path(name), default_storage.path(target), SIZES[size], format)
+    # Versions of a source that has changed since.
+    directory, filename = os.path.split(target_path)
+    for other in os.listdir(directory):
+        if other.startswith(f'{size}-') and other != filename and not other.endswith('.tmp'):
+            os.unlink(os.path.join(directory, other))
+    return True
+
+
+def thumbnail_url(image, size):
+    """The URL of ``image``'s thumbnail, or of the image itself until a worker has rendered it."""
+    if not image:
+        return ''
+    try:
+        target = thumbnail_name(image.name, size, source_version(image.name))
+    except OSError:
+        return image.url
+    if default_storage.exists(target):
+        return default_storage.url(target)
+    if cache.add(f'thumbnail-queued:{target}', True, QUEUED_TIMEOUT):
+        enqueue(refresh_thumbnails, image.name, dedup_key=f'thumbnails:{image.name}')
+    return image.url
+
+
+def delete_thumbnails(name):
+    """Delete every thumbnail of ``name``."""
+    shutil.rmtree(default_storage.path(thumbnail_dir(name)), ignore_errors=True)
+
+
+def replace_profile_image(user, upload):
+    """Give ``user`` the uploaded image (saved with the user); its thumbnails are made in the background."""
+    old_name = user.profile_image.name if user.profile_image else None
+    user.profile_image = upload
+    user.save()
+    if old_name == user.profile_image.name:
+        old_name = None
+    enqueue(refresh_thumbnails, user.profile_image.name, old_name, dedup_key=f'thumbnails:{user.profile_image.name}')
+
+
+@task(max_attempts=2)
+def refresh_thumbnails(name, old_name=None):
+    """Render ``name``'s thumbnails and delete ``old_name``'s, the image it replaced."""
+    if old_name:
+        delete_thumbnails(old_name)
+    try:
+        version = source_version(name)
+        for size in SIZES:
+            render(name, size, version)
+    except (FileNotFoundError, Image.UnidentifiedImageError):
+        # Gone or not an image after all; the templates show the upload itself.
+        return
+
+
+def generate_thumbnails(users, log=None):
+    """Render the missing thumbnails of ``users``' profile images here and now; returns (rendered, failed)."""
+    rendered = failed = 0
+    format = thumbnail_format()
+    for user in users:
+        if not user.profile_image:
+            continue
+        try:
+            version = source_version(user.profile_image.name)
+            for size in SIZES:
+                rendered += render(user.profile_image.name, size, version, format)
+        except (OSError, Image.UnidentifiedImageError) as error:
+            failed += 1
+            if log:
+                log(f"{user.username}: {error}")
+    return rendered, failed
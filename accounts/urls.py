@@ -17,9 +17,13 @@ urlpatterns = [
     # -------------------- Admin - Case Management --------------------
     path('cases/', views.AllCasesView.as_view(), name='all_cases'),
     path('cases/pending/', views.PendingCasesView.as_view(), name='pending_cases'),
+    path('cases/pending/approve/', views.BulkApproveCasesView.as_view(), name='bulk_approve_cases'),
     path('cases/approved/', views.ApprovedCasesView.as_view(), name='approved_cases'),
+    path('cases/approved/assign/', views.BulkAssignCasesView.as_view(), name='bulk_assign_cases'),
+    path('cases/approved/auto-assign/', views.AutoAssignCasesView.as_view(), name='auto_assign_cases'),
     path('cases/assigned/', views.AdminAssignedCasesView.as_view(), name='admin_assigned_cases'),
     path('cases/closed/', views.ClosedCasesView.as_view(), name='closed_cases'),
+    path('cases/export/', views.CaseExportView.as_view(), name='export_cases'),
 
     # -------------------- Handler - Case Views --------------------
     path('handler-dashboard/', views.HandlerDashboardView.as_view(), name='handler_dashboard'),
@@ -8,16 +8,28 @@ from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.decorators import method_decorator
 from django.contrib import messages
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth.models import Group
-from django.db.models import Q
 from .forms import UserRegisterForm
+from .roles import dashboard
+from .thumbnails import replace_profile_image
 from cases.models import Case
 from django.urls import reverse
-from cases.models import CaseHistory
+from cases.stats import case_status_counts, get_percent
+from cases.assignment import auto_assign, handler_workloads
+from cases.bulk import bulk_approve, bulk_assign
+from cases.counters import counter_status_counts
+from cases.export import FORMATS, export_filename, export_stream
+from cases.forms import CaseExportForm
+from cases.dashboard_cache import cached_fragment, cached_status_counts, scope_key
+from cases.pagination import KeysetPaginationMixin
+from cases.rollups import daily_series
+from cases.search import search_cases
 from django_fsm import can_proceed
+import datetime
 import json
 from django.utils import timezone
-from django.db.models.functions import TruncDate
+from django.utils.cache import patch_cache_control
 from django.db.models import Count
 
 
@@ -27,16 +39,8 @@ class CustomLoginView(LoginView):
     template_name = 'accounts/login.html'
 
     def get_success_url(self):
-        user = self.request.user
-
-        if user.is_superuser:
-            return reverse('admin_dashboard')
-        
-        if user.groups.filter(name='handler').exists():
-            return reverse('handler_dashboard')
-        
-        # Default for normal users
-        return reverse('user_dashboard')
+        # The role was worked out while logging in; see accounts.roles.
+        return reverse(dashboard(self.request.user, self.request.session))
 
 
 def LogoutUser(request):
@@ -67,145 +71,260 @@ class UserRegisterView(View):
 class AdminDashboardView(TemplateView):
     template_name = 'accounts/admin_dashboard.html'
 
-    def get_percent(self, count, total):
-        return int((count / total) * 100) if total else 0
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         query = self.request.GET.get('q')
         cases = Case.objects.all().order_by('-updated_at')
-        total_cases = cases.count()
-        pending_cases = cases.filter(status='Pending').count()
-        approved_cases = cases.filter(status='Approved').count()
-        assigned_cases = cases.exclude(status__in=['Pending', 'Approved', 'Closed']).count()
-        closed_cases = cases.filter(status='Closed').count()
 
         if query:
-            cases = cases.filter(
-                Q(title__icontains=query) |
-                Q(created_by__username__icontains=query) |
-                Q(assigned_to__username__icontains=query)
-            )
-        
-        today = timezone.now().date()
-        days = 7
-        date_list = [(today - timezone.timedelta(days=x)) for x in range(days-1, -1, -1)]
-        labels = [d.strftime('%Y-%m-%d') for d in date_list]
-
-        cases_by_day = (
-            Case.objects
-            .filter(created_at__date__gte=date_list[0], created_at__date__lte=date_list[-1])
-            .annotate(day=TruncDate('created_at'))
-            .values('day')
-            .annotate(count=Count('id'))
-            .order_by('day')
-        )
-        cases_dict = {c['day'].strftime('%Y-%m-%d'): c['count'] for c in cases_by_day}
-        data = [cases_dict.get(label, 0) for label in labels]
-
-        context['cases_per_day_labels'] = json.dumps(labels) if 'labels' in locals() else '[]'
-        context['cases_per_day_data'] = json.dumps(data) if 'data' in locals() else '[]'
+            cases = search_cases(cases, query)
 
+        # The cards always describe the whole table; only the total follows the search.
+        cards = cached_fragment('admin_cards', scope_key('global'), admin_dashboard_cards)
+        today = timezone.localdate()
+        days = chart_range(self.request)
+        chart = cached_fragment('admin_chart', scope_key('global'), lambda: cases_per_day(today, days), days, today)
 
+        context.update(cards)
         context.update({
             'cases': cases,
-            'total_cases': cases.count(),
-            'pending_cases': pending_cases,
-            'approved_cases': approved_cases,
-            'closed_cases': closed_cases,
-            'assigned_cases': assigned_cases,  
-            'users_count': get_user_model().objects.filter(is_superuser=False, is_staff=False).exclude(groups__name='handler').count(),
-            'handlers_count': get_user_model().objects.filter(groups__name='handler').count(),
-            'pending_percent': self.get_percent(pending_cases, total_cases),
-            'approved_percent': self.get_percent(approved_cases, total_cases),
-            'assigned_percent': self.get_percent(assigned_cases, total_cases),
-            'closed_percent': self.get_percent(closed_cases, total_cases),
-
+            'total_cases': cases.count() if query else cards['total_cases'],
+            'cases_per_day_labels': json.dumps(chart['labels']),
+            'cases_per_day_data': json.dumps(chart['data']),
+            'cases_trend': json.dumps({field: chart[field] for field in ('approved', 'resolved', 'closed')}),
+            'chart_days': days,
+            'chart_ranges': CHART_RANGES,
         })
         return context
 
 
-class AllCasesView(TemplateView):
+def admin_dashboard_cards():
+    counts = counter_status_counts('global')
+    total_cases = counts['total']
+    User = get_user_model()
+    return {
+        'total_cases': total_cases,
+        'pending_cases': counts['pending'],
+        'approved_cases': counts['approved'],
+        'closed_cases': counts['closed'],
+        'assigned_cases': counts['active'],
+        'users_count': User.objects.filter(is_superuser=False, is_staff=False).exclude(groups__name='handler').count(),
+        'handlers_count': User.objects.filter(groups__name='handler').count(),
+        'pending_percent': get_percent(counts['pending'], total_cases),
+        'approved_percent': get_percent(counts['approved'], total_cases),
+        'assigned_percent': get_percent(counts['active'], total_cases),
+        'closed_percent': get_percent(counts['closed'], total_cases),
+    }
+
+
+CHART_RANGES = (7, 30, 90, 365)
+
+
+def chart_range(request):
+    """The ?days= range of the trend chart, one of CHART_RANGES, default 7."""
+    try:
+        days = int(request.GET.get('days', CHART_RANGES[0]))
+    except ValueError:
+        return CHART_RANGES[0]
+    return days if days in CHART_RANGES else CHART_RANGES[0]
+
+
+def cases_per_day(today, days=7):
+    # Read from the daily rollup table: one row per day, whatever the size of the cases table.
+    series = daily_series(today - datetime.timedelta(days=days - 1), today)
+    return {
+        'labels': [day.strftime('%Y-%m-%d') for day in series['days']],
+        'data': series['created'],
+        'approved': series['approved'],
+        'resolved': series['resolved'],
+        'closed': series['closed'],
+    }
+
+
+class AllCasesView(KeysetPaginationMixin, TemplateView):
     template_name = 'accounts/cases/all_cases.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         query = self.request.GET.get('q')
-        cases = Case.objects.all().order_by('-updated_at')
+        cases = Case.objects.for_list()
 
         if query:
-            cases = cases.filter(
-                Q(title__icontains=query) |
-                Q(created_by__username__icontains=query) |
-                Q(assigned_to__username__icontains=query)
-            )
+            cases = search_cases(cases, query, rank=True)
 
-        context.update({
-            'cases': cases,
-            'total_cases': cases.count(),
-            'pending_cases': cases.filter(status='Pending').count(),
-            'approved_cases': cases.filter(status='Approved').count(),
-            'closed_cases': cases.filter(status='Closed').count(),
-            'assigned_cases': cases.exclude(status__in=['Pending', 'Approved', 'Closed']).count(),
-            'users_count': get_user_model().objects.filter(is_superuser=False, is_staff=False).exclude(groups__name='handler').count(),
-            'handlers_count': get_user_model().objects.filter(groups__name='handler').count(),
-        })
+        context.update(self.get_page_context(cases))
+        context.update(cached_fragment('admin_cards', scope_key('global'), admin_dashboard_cards))
+        context['status_choices'] = Case.STATUS_CHOICES
+        if query:
+            counts = case_status_counts(cases)
+            context.update({
+                'total_cases': counts['total'],
+                'pending_cases': counts['pending'],
+                'approved_cases': counts['approved'],
+                'closed_cases': counts['closed'],
+                'assigned_cases': counts['active'],
+            })
         return context
 
 
-class PendingCasesView(View):
+class PendingCasesView(KeysetPaginationMixin, View):
     template_name = 'accounts/cases/pending_cases.html'
 
     def get(self, request):
-        cases = Case.objects.filter(status='Pending')
-        return render(request, self.template_name, {'cases': cases})
+        cases = Case.objects.for_list().filter(status='Pending')
+        return render(request, self.template_name, self.get_page_context(cases))
 
     def post(self, request):
         case_id = request.POST.get('case_id')
         case = get_object_or_404(Case, id=case_id)
         case.status = 'Approved'
-        case.save()
-
-        # Log approval here too
-        CaseHistory.objects.create(
-            case=case,
-            action="Case Approved",
-            performed_by=request.user
-        )
+        case.save(actor=request.user, action="Case Approved")
 
         return redirect('approved_cases')
 
-    
 
-class ApprovedCasesView(ListView):
+class BulkCaseActionView(LoginRequiredMixin, View):
+    """
+    Base for the admin queues' bulk actions. Takes ``case_ids`` (and the
+    action's other fields) as a JSON object or as a form; JSON requests get
+    {'succeeded': [...], 'failed': [{'id', 'error'}]} back, forms a message
+    and a redirect to ``success_url``.
+    """
+    success_url = None
+    done = None  # past tense of the action, for the form message
+    all_if_none = False  # whether no case_ids means the action's whole queue
+
+    def post(self, request):
+        if not request.user.is_superuser:
+            return JsonResponse({'error': "Only admins can change cases in bulk."}, status=403)
+        self.is_json = request.content_type == 'application/json'
+        if self.is_json:
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return self.error("Invalid JSON.")
+            if not isinstance(data, dict):
+                return self.error("Expected a JSON object.")
+            case_ids = data.get('case_ids', [])
+        else:
+            data = request.POST
+            case_ids = request.POST.getlist('case_ids')
+        if not isinstance(case_ids, list) or not (case_ids or self.all_if_none):
+            return self.error("Select at least one case.")
+
+        result = self.apply(data, case_ids)
+        if isinstance(result, str):
+            return self.error(result)
+        if self.is_json:
+            return JsonResponse(result.as_dict())
+        if result.succeeded:
+            messages.success(request, f"{len(result.succeeded)} case(s) {self.done}.")
+        if result.failed:
+            skipped = list(result.failed.items())
+            messages.error(request, f"{len(skipped)} case(s) skipped: " + "; ".join(
+                f"#{case_id}: {error}" for case_id, error in skipped[:10]
+            ))
+        return redirect(self.success_url)
+
+    def error(self, message):
+        if self.is_json:
+            return JsonResponse({'error': message}, status=400)
+        messages.error(self.request, message)
+        return redirect(self.success_url)
+
+    def apply(self, data, case_ids):
+        """Run the action: a BulkResult, or an error message when the request itself is invalid."""
+        raise NotImplementedError
+
+
+class BulkApproveCasesView(BulkCaseActionView):
+    success_url = 'pending_cases'
+    done = 'approved'
+
+    def apply(self, data, case_ids):
+        return bulk_approve(case_ids, self.request.user)
+
+
+class BulkAssignCasesView(BulkCaseActionView):
+    success_url = 'approved_cases'
+    done = 'assigned'
+
+    def apply(self, data, case_ids):
+        handler_id = str(data.get('assigned_to', ''))
+        handler = None
+        if handler_id.isdigit():
+            handler = User.objects.filter(pk=handler_id, groups__name__iexact='handler').first()
+        if handler is None:
+            return "Choose a handler to assign the cases to."
+        return bulk_assign(case_ids, handler, self.request.user)
+
+
+class AutoAssignCasesView(BulkCaseActionView):
+    """Give the selected approved cases, or the whole queue, to the least loaded handlers."""
+    success_url = 'approved_cases'
+    done = 'auto-assigned'
+    all_if_none = True
+
+    def apply(self, data, case_ids):
+        return auto_assign(case_ids or None, self.request.user)
+
+
+class CaseExportView(LoginRequiredMixin, View):
+    """
+    Stream the cases matching the CaseExportForm filters in the query string
+    as CSV or JSON lines, optionally gzipped; see cases.export.
+    """
+
+    def get(self, request):
+        if not request.user.is_superuser:
+            return JsonResponse({'error': "Only admins can export cases."}, status=403)
+        form = CaseExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        options = form.cleaned_data
+        content_type = 'application/gzip' if options['gzip'] else FORMATS[options['format']][0]
+        response = StreamingHttpResponse(
+            export_stream(form.queryset(), options['format'], options['include'], options['gzip']),
+            content_type=content_type,
+        )
+        filename = export_filename(options['format'], options['gzip'])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
+class ApprovedCasesView(KeysetPaginationMixin, ListView):
     template_name = 'accounts/cases/approved_cases.html'
     context_object_name = 'cases'
 
     def get(self, request):
-        cases = Case.objects.filter(status='Approved')
-        handlers = User.objects.filter(groups__name__iexact='handler')
-        
-        return render(request, self.template_name, {
-            'cases': cases,
-            'handlers': handlers,
-        })
+        cases = Case.objects.for_list().filter(status='Approved')
+        handlers = list(User.objects.filter(groups__name__iexact='handler').order_by('pk'))
+        # Shown in the dropdowns so picking a handler isn't guesswork.
+        workloads = handler_workloads([handler.pk for handler in handlers])
+        for handler in handlers:
+            handler.open_cases = workloads[handler.pk]
+
+        context = self.get_page_context(cases)
+        context['handlers'] = handlers
+        return render(request, self.template_name, context)
 
 
 
-class AdminAssignedCasesView(ListView):
+class AdminAssignedCasesView(KeysetPaginationMixin, ListView):
     template_name = 'accounts/cases/assigned_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.exclude(status__in=['Pending', 'Approved', 'Closed'])
+        return Case.objects.for_list().exclude(status__in=['Pending', 'Approved', 'Closed'])
 
 
-class ClosedCasesView(ListView):
+class ClosedCasesView(KeysetPaginationMixin, ListView):
     template_name = 'accounts/cases/closed_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(status='Closed')
+        return Case.objects.for_list().filter(status='Closed')
 
 
 # ========== Handler Views ==========
@@ -213,80 +332,76 @@ class ClosedCasesView(ListView):
 class HandlerDashboardView(LoginRequiredMixin, TemplateView):
     template_name = 'accounts/handler_dashboard.html'
 
-    def get_percent(self, count, total):
-        return int((count / total.count()) * 100) if total else 0
-
     def get_context_data(self, **kwargs):
         handler = self.request.user
         query = self.request.GET.get('q')  # get the search query
 
         all_cases = Case.objects.filter(assigned_to=handler)
-        assigned_cases = all_cases.filter(status='Assigned').count()
-        ongoing_cases = all_cases.exclude(status__in=['Assigned', 'Pending', 'Approved', 'Closed']).count()
-        closed_cases = all_cases.filter(status='Closed').count()
 
         if query:
-            all_cases = all_cases.filter(title__icontains=query)  # filter by title
+            all_cases = search_cases(all_cases, query)
 
+        counts = case_status_counts(all_cases) if query else cached_status_counts('handler', handler.pk)
         context = super().get_context_data(**kwargs)
         context.update({
             'cases': all_cases,
-            'all_count': all_cases.count(),
-            'assigned_count': all_cases.filter(status='Assigned').count(),
-            'ongoing_count': all_cases.exclude(status__in=['Assigned', 'Pending', 'Approved', 'Closed']).count(),
-            'closed_count': all_cases.filter(status='Closed').count(),
-            'assigned_percent': self.get_percent(assigned_cases, all_cases),
-            'ongoing_percent': self.get_percent(ongoing_cases, all_cases),
-            'closed_percent': self.get_percent(closed_cases, all_cases),
+            'all_count': counts['total'],
+            'assigned_count': counts['assigned'],
+            'ongoing_count': counts['ongoing'],
+            'closed_count': counts['closed'],
+            'assigned_percent': get_percent(counts['assigned'], counts['total']),
+            'ongoing_percent': get_percent(counts['ongoing'], counts['total']),
+            'closed_percent': get_percent(counts['closed'], counts['total']),
         })
         return context
 
 
-class HandlerAllCasesView(LoginRequiredMixin, TemplateView):
+class HandlerAllCasesView(LoginRequiredMixin, KeysetPaginationMixin, TemplateView):
     template_name = 'accounts/handlers/all_cases.html'
 
     def get_context_data(self, **kwargs):
         handler = self.request.user
         query = self.request.GET.get('q')  # get the search query
 
-        all_cases = Case.objects.filter(assigned_to=handler)
+        all_cases = Case.objects.for_list().filter(assigned_to=handler)
 
         if query:
-            all_cases = all_cases.filter(title__icontains=query)  # filter by title
+            all_cases = search_cases(all_cases, query, rank=True)
 
+        counts = case_status_counts(all_cases) if query else cached_status_counts('handler', handler.pk)
         context = super().get_context_data(**kwargs)
+        context.update(self.get_page_context(all_cases))
         context.update({
-            'cases': all_cases,
-            'all_count': all_cases.count(),
-            'assigned_count': all_cases.filter(status='Assigned').count(),
-            'ongoing_count': all_cases.exclude(status__in=['Assigned', 'Pending', 'Approved', 'Closed']).count(),
-            'closed_count': all_cases.filter(status='Closed').count(),
+            'all_count': counts['total'],
+            'assigned_count': counts['assigned'],
+            'ongoing_count': counts['ongoing'],
+            'closed_count': counts['closed'],
         })
         return context
 
 
-class HandlerAssignedCasesView(LoginRequiredMixin, ListView):
+class HandlerAssignedCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/handlers/assigned_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(assigned_to=self.request.user, status='Assigned')
+        return Case.objects.for_list().filter(assigned_to=self.request.user, status='Assigned')
 
 
-class HandlerOngoingCasesView(LoginRequiredMixin, ListView):
+class HandlerOngoingCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/handlers/ongoing_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(assigned_to=self.request.user).exclude(status__in=['Assigned', 'Pending', 'Approved', 'Closed'])
+        return Case.objects.for_list().filter(assigned_to=self.request.user).exclude(status__in=['Assigned', 'Pending', 'Approved', 'Closed'])
 
 
-class HandlerClosedCasesView(LoginRequiredMixin, ListView):
+class HandlerClosedCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/handlers/closed_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(assigned_to=self.request.user, status='Closed')
+        return Case.objects.for_list().filter(assigned_to=self.request.user, status='Closed')
 
 
 class StartOperatingView(LoginRequiredMixin, View):
@@ -294,20 +409,7 @@ class StartOperatingView(LoginRequiredMixin, View):
         case = get_object_or_404(Case, pk=pk, assigned_to=request.user)
 
         case.status = 'In Progress'
-        case.save()
-
-        # Log operation start
-        CaseHistory.objects.create(
-            case=case,
-            action="Started Operating",
-            performed_by=request.user
-        )
-        # Log the status update
-        CaseHistory.objects.create(
-            case=case,
-            action="Status Updated to 'In Progress'",
-            performed_by=request.user
-        )
+        case.save(actor=request.user, action="Started Operating: status updated to 'In Progress'")
         return redirect('handler_ongoing_cases')
 
 
@@ -348,12 +450,7 @@ class UpdateStatusView(LoginRequiredMixin, View):
         if transition:
             if can_proceed(transition):
                 transition()     # run the FSM method
-                case.save()      # save the new state
-                CaseHistory.objects.create(
-                    case=case,
-                    action=f"Status updated to '{new_status}' via FSM",
-                    performed_by= request.user
-                )
+                case.save(actor=request.user, action=f"Status updated to '{new_status}' via FSM")
                 messages.success(request, f"Status changed to '{new_status}'.")
             else:
                 messages.error(request, f"Invalid status transition to '{new_status}'.")
@@ -374,69 +471,65 @@ class UserDashboardView(LoginRequiredMixin, TemplateView):
         all_cases = Case.objects.filter(created_by=user)
 
         if query:
-            all_cases = all_cases.filter(
-                Q(title__icontains=query) | 
-                Q(assigned_to__username__icontains=query)
-            )
+            all_cases = search_cases(all_cases, query)
 
+        counts = case_status_counts(all_cases) if query else cached_status_counts('creator', user.pk)
         context = super().get_context_data(**kwargs)
         context.update({
             'cases': all_cases,
-            'all_count': all_cases.count(),
-            'pending_count': all_cases.filter(status='Pending').count(),
-            'ongoing_count': all_cases.exclude(status__in=['Pending','Closed']).count(),
-            'closed_count': all_cases.filter(status='Closed').count(),
+            'all_count': counts['total'],
+            'pending_count': counts['pending'],
+            'ongoing_count': counts['open'],
+            'closed_count': counts['closed'],
         })
         return context
 
 
-class UserAllCasesView(LoginRequiredMixin, TemplateView):
+class UserAllCasesView(LoginRequiredMixin, KeysetPaginationMixin, TemplateView):
     template_name = 'accounts/users/all_cases.html'
 
     def get_context_data(self, **kwargs):
         user = self.request.user
         query = self.request.GET.get('q')  # Get the search input
         
-        all_cases = Case.objects.filter(created_by=user)
+        all_cases = Case.objects.for_list().filter(created_by=user)
 
         if query:
-            all_cases = all_cases.filter(
-                Q(title__icontains=query) | 
-                Q(assigned_to__username__icontains=query)
-            )
+            all_cases = search_cases(all_cases, query, rank=True)
 
+        counts = case_status_counts(all_cases) if query else cached_status_counts('creator', user.pk)
         context = super().get_context_data(**kwargs)
+        context.update(self.get_page_context(all_cases))
         context.update({
-            'cases': all_cases,
-            'all_count': all_cases.count(),
-            'ongoing_count': all_cases.exclude(status='Closed').count(),
-            'closed_count': all_cases.filter(status='Closed').count(),
+            'all_count': counts['total'],
+            'ongoing_count': counts['not_closed'],
+            'closed_count': counts['closed'],
         })
         return context
 
 
-class UserPendingCasesView(LoginRequiredMixin, ListView):
+class UserPendingCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/users/pending_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(created_by=self.request.user, status='Pending')
+        return Case.objects.for_list().filter(created_by=self.request.user, status='Pending')
     
 
-class UserOngoingCasesView(LoginRequiredMixin, ListView):
+class UserOngoingCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/users/ongoing_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(created_by=self.request.user).exclude(status__in=['Pending', 'Closed'])
+        return Case.objects.for_list().filter(created_by=self.request.user).exclude(status__in=['Pending', 'Closed'])
 
 
-class UserClosedCasesView(LoginRequiredMixin, ListView):
+class UserClosedCasesView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'accounts/users/closed_cases.html'
     context_object_name = 'cases'
 
     def get_queryset(self):
-        return Case.objects.filter(created_by=self.request.user, status='Closed')
+        return Case.objects.for_list().filter(created_by=self.request.user, status='Closed')
 
 
 # ========== Admin User & Handler Management ==========
@@ -450,7 +543,7 @@ class HandlerListView(ListView):
             is_superuser=False,
             is_staff=False,
             groups__name='handler'
-        )
+        ).annotate(cases_assigned_count=Count('cases_assigned', distinct=True))
 
 
 class HandlerAddView(View):
@@ -500,7 +593,9 @@ class UserListView(ListView):
     context_object_name = 'users'
 
     def get_queryset(self):
-        return get_user_model().objects.filter(is_superuser=False, is_staff=False).exclude(groups__name='handler')
+        return get_user_model().objects.filter(is_superuser=False, is_staff=False).exclude(groups__name='handler').annotate(
+            cases_created_count=Count('cases_created', distinct=True)
+        )
 
 
 class UserRemoveView(View):
@@ -533,12 +628,7 @@ class ProfileView(TemplateView):
         user = self.request.user
         context['form'] = PasswordChangeForm(user=user)
 
-        if user.is_superuser:
-            context['back_url'] = 'admin_dashboard'
-        elif user.groups.filter(name='handler').exists():
-            context['back_url'] = 'handler_dashboard'
-        else:
-            context['back_url'] = 'user_dashboard'
+        context['back_url'] = dashboard(user, self.request.session)
 
         return context
 
@@ -549,8 +639,9 @@ class ProfileView(TemplateView):
             user.username = request.POST.get('username')
             user.email = request.POST.get('email')
             if request.FILES.get('profile_image'):
-                user.profile_image = request.FILES.get('profile_image')
-            user.save()
+                replace_profile_image(user, request.FILES.get('profile_image'))
+            else:
+                user.save()
             messages.success(request, "Profile updated successfully!")
             return redirect('view_profile')
 
@@ -580,12 +671,7 @@ class HandlerProfileView(TemplateView):
         user = self.request.user
         context['form'] = PasswordChangeForm(user=user)
 
-        if user.is_superuser:
-            context['back_url'] = 'admin_dashboard'
-        elif user.groups.filter(name='handler').exists():
-            context['back_url'] = 'handler_dashboard'
-        else:
-            context['back_url'] = 'user_dashboard'
+        context['back_url'] = dashboard(user, self.request.session)
 
         return context
 
@@ -596,8 +682,9 @@ class HandlerProfileView(TemplateView):
             user.username = request.POST.get('username')
             user.email = request.POST.get('email')
             if request.FILES.get('profile_image'):
-                user.profile_image = request.FILES.get('profile_image')
-            user.save()
+                replace_profile_image(user, request.FILES.get('profile_image'))
+            else:
+                user.save()
             messages.success(request, "Profile updated successfully!")
             return redirect('view_handler_profile')
 
@@ -626,12 +713,7 @@ class UserProfileView(TemplateView):
         user = self.request.user
         context['form'] = PasswordChangeForm(user=user)
 
-        if user.is_superuser:
-            context['back_url'] = 'admin_dashboard'
-        elif user.groups.filter(name='handler').exists():
-            context['back_url'] = 'handler_dashboard'
-        else:
-            context['back_url'] = 'user_dashboard'
+        context['back_url'] = dashboard(user, self.request.session)
 
         return context
 
@@ -642,8 +724,9 @@ class UserProfileView(TemplateView):
             user.username = request.POST.get('username')
             user.email = request.POST.get('email')
             if request.FILES.get('profile_image'):
-                user.profile_image = request.FILES.get('profile_image')
-            user.save()
+                replace_profile_image(user, request.FILES.get('profile_image'))
+            else:
+                user.save()
             messages.success(request, "Profile updated successfully!")
             return redirect('view_user_profile')
 
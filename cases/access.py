@@ -0,0 +1,15 @@
+"""
+Who takes part in a case: its reporter, its handler and superusers.
+
+They are the people CaseDetailView lets message the case, and the only ones
+its chat (get_messages), live events (case_events), archive (case_archive)
+and files (cases.media) are served to.
+Everyone else gets a 404, as for a case that doesn't exist.
+"""
+
+
+def is_participant(user, created_by_id, assigned_to_id):
+    """Whether ``user`` takes part in the case with these reporter and handler ids."""
+    if not user.is_authenticated:
+        return False
+    return user.is_superuser or user.pk in (created_by_id, assigned_to_id)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Case, CaseMessage
+from .models import Case, CaseMessage, HandlerCapacity
 
 # Register your models here.
 
@@ -12,4 +12,9 @@ class CaseAdmin(admin.ModelAdmin):
 class CaseMessageAdmin(admin.ModelAdmin):
     list_display = ('case', 'sender', 'message', 'file', 'timestamp')
     search_fields = ('case__title', 'sender__username', 'message')
-    list_filter = ('timestamp',)
\ No newline at end of file
+    list_filter = ('timestamp',)
+
+@admin.register(HandlerCapacity)
+class HandlerCapacityAdmin(admin.ModelAdmin):
+    list_display = ('handler', 'weight', 'max_open_cases')
+    search_fields = ('handler__username',)
@@ -0,0 +1,210 @@
+"""
+Cold storage for the history and chat of long-closed cases.
+
+archive_cases() moves the CaseHistory and CaseMessage rows of cases closed
+for more than ``days`` days out of the database into one gzip-compressed
+JSON lines file per case under MEDIA_ROOT, and records what it moved in a
+CaseArchive row. The case detail page loads the file on demand through
+load_archive().
+
+A case that gets more history after it was archived, e.g. reopened and
+closed again, is archived again later: its new rows are added to the same
+file. Each line carries the row's id, and load_archive() skips the
+duplicates an interrupted run can leave behind. Chat attachments stay where
+they are; ArchivedAttachment keeps which case each one belongs to. case_transitions() reads
+the files too, so the rollups still rebuild from the whole audit trail.
+"""
+import datetime
+import gzip
+import json
+import os
+import tempfile
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .audit import STATE_FIELDS, history_events, replay_transitions
+from .events import show_sender
+from .models import ArchivedAttachment, Case, CaseArchive, CaseHistory, CaseMessage
+
+
+ARCHIVE_AFTER_DAYS = 365
+BATCH_SIZE = 100
+
+
+def archive_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'CASE_ARCHIVE_DIR', 'case_archive'))
+
+
+def archive_name(case_id):
+    """Relative to archive_root(); cases are spread over directories of 1000."""
+    return os.path.join(f'{case_id // 1000:06d}', f'{case_id}.jsonl.gz')
+
+
+def history_record(entry):
+    return {
+        'kind': 'history',
+        'id': entry.id,
+        'event': entry.event,
+        'changes': entry.changes,
+        'action': entry.action,
+        'performed_by': entry.performed_by.username if entry.performed_by else None,
+        'timestamp': entry.timestamp,
+    }
+
+
+def message_record(message, case):
+    return {
+        'kind': 'message',
+        'id': message.id,
+        # Resolved now, like the live chat does, so the file needs no user lookups.
+        'sender': message.sender.username if show_sender(case, message.sender) else 'Anonymous',
+        'message': message.message,
+        'file': message.file.name or None,
+        'timestamp': message.timestamp,
+    }
+
+
+def read_records(path):
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            return [json.loads(line) for line in archive if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def write_records(path, records):
+    """Replace ``path`` with ``records`` atomically; readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for record in records:
+                archive.write(json.dumps(record, cls=DjangoJSONEncoder).encode('utf-8') + b'\n')
+            archive.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def unique_records(records):
+    """``records`` without the duplicates of an interrupted archive run."""
+    seen = set()
+    for record in records:
+        key = (record['kind'], record['id'])
+        if key not in seen:
+            seen.add(key)
+            yield record
+
+
+def archivable_cases(days=ARCHIVE_AFTER_DAYS, now=None):
+    """Ids of cases closed more than ``days`` days ago that still have rows in the database."""
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=days)
+    return (
+        Case.objects.filter(status='Closed', updated_at__lt=cutoff)
+        .filter(
+            Exists(CaseHistory.objects.filter(case=OuterRef('pk')))
+            | Exists(CaseMessage.objects.filter(case=OuterRef('pk')))
+        )
+        .values_list('pk', flat=True)
+    )
+
+
+def archive_case(case_id):
+    """Move one case's history and messages to its archive file; returns the rows moved."""
+    with transaction.atomic():
+        # Lock the case so its rows can't change between the copy and the delete.
+        case = Case.objects.select_for_update().get(pk=case_id)
+        history = list(CaseHistory.objects.filter(case=case).select_related('performed_by').order_by('timestamp', 'id'))
+        messages = list(
+            CaseMessage.objects.filter(case=case)
+            .select_related('sender').prefetch_related('sender__groups')
+            .order_by('timestamp', 'id')
+        )
+        if not history and not messages:
+            return 0
+
+        path = os.path.join(archive_root(), archive_name(case.pk))
+        records = read_records(path)
+        records += [history_record(entry) for entry in history]
+        records += [message_record(message, case) for message in messages]
+        write_records(path, records)
+
+        # The file is in place before the rows go; if the delete fails the
+        # rows are archived again next time and load_archive() dedupes them.
+        ArchivedAttachment.objects.bulk_create(
+            [ArchivedAttachment(name=message.file.name, case=case) for message in messages if message.file],
+            ignore_conflicts=True,
+        )
+        CaseHistory.objects.filter(pk__in=[entry.pk for entry in history]).delete()
+        CaseMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+        archive, created = CaseArchive.objects.get_or_create(case=case, defaults={'path': archive_name(case.pk), 'archived_at': timezone.now()})
+        archive.history_count += len(history)
+        archive.message_count += len(messages)
+        archive.archived_at = timezone.now()
+        archive.save()
+    return len(history) + len(messages)
+
+
+def archive_cases(days=ARCHIVE_AFTER_DAYS, limit=None, log=None):
+    """Archive every archivable case, or the first ``limit``; returns (cases, rows) archived."""
+    case_ids = list(archivable_cases(days).order_by('pk')[:limit])
+    cases = rows = 0
+    for case_id in case_ids:
+        moved = archive_case(case_id)
+        if moved:
+            cases += 1
+            rows += moved
+            if log and cases % BATCH_SIZE == 0:
+                log(f"Archived {cases} cases, {rows} rows")
+    return cases, rows
+
+
+def load_archive(case):
+    """{'history': [...], 'messages': [...]} from the case's archive file, newest history first."""
+    history, messages = [], []
+    for record in unique_records(read_records(os.path.join(archive_root(), case.archive.path))):
+        (history if record['kind'] == 'history' else messages).append(record)
+    history.sort(key=lambda record: (record['timestamp'], record['id']), reverse=True)
+    messages.sort(key=lambda record: (record['timestamp'], record['id']))
+    return {'history': history, 'messages': messages}
+
+
+def archived_events(case_id, path):
+    """history_events() tuples of one case's archive file."""
+    return [
+        (case_id, record['changes'], parse_datetime(record['timestamp']))
+        for record in unique_records(read_records(os.path.join(archive_root(), path)))
+        if record['kind'] == 'history' and any(field in record['changes'] for field in STATE_FIELDS)
+    ]
+
+
+def case_transitions(case_ids=None):
+    """
+    audit.status_transitions() over the database and the archive files, of
+    every case or of ``case_ids``: an archived case's file is replayed
+    ahead of the rows it got since.
+    """
+    history = CaseHistory.objects.all()
+    archives = CaseArchive.objects.all()
+    if case_ids is not None:
+        history = history.filter(case_id__in=case_ids)
+        archives = archives.filter(case_id__in=case_ids)
+    archived = history.filter(case__archive__isnull=False)
+    yield from replay_transitions(history_events(history.filter(case__archive__isnull=True)))
+
+    since = defaultdict(list)
+    for event in history_events(archived):
+        since[event[0]].append(event)
+    for case_id, path in archives.order_by('case_id').values_list('case_id', 'path'):
+        events = archived_events(case_id, path) + since[case_id]
+        events.sort(key=lambda event: event[2])
+        yield from replay_transitions(events)
@@ -0,0 +1,130 @@
+"""
+Automatic assignment of approved cases to handlers.
+
+Each case goes to the handler with the fewest open cases for their weight
+(a handler of weight 2 is given twice the open cases of one of weight 1),
+ties going to the longest-standing handler, and a handler at their cap gets
+no more. Weights and caps come from HandlerCapacity; handlers without one
+have a weight of 1 and CASE_ASSIGNMENT_MAX_OPEN.
+
+Workloads aren't counted from the cases table: the handler rows of
+CaseStatusCounter (cases.counters) already hold every handler's cases per
+status, kept in step with each case write, and the counter's unique
+(scope, owner_id, status) index answers all handlers' open counts in one
+small query. Choosing is a heap of handlers keyed by weighted load, so
+a batch costs O(cases x log handlers) in memory and no queries per case.
+
+The assignments themselves go through cases.bulk, a batch at a time: one
+UPDATE, one history insert and the usual counter, search and notification
+writes, exactly as if an admin had assigned the cases in bulk. Each batch
+locks the handlers and re-reads their workloads, so two admins
+auto-assigning at once don't both fill the same handler past their cap.
+"""
+import heapq
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.html import escape
+
+from .bulk import BATCH_SIZE, BulkResult, apply_batch, parse_case_ids
+from .models import Case, CaseStatusCounter
+from .utils import batched
+
+
+# What a handler is still working on; resolved cases wait on the reporter.
+OPEN_STATUSES = ('Assigned', 'In Progress', 'Waiting for Info')
+
+
+def default_cap():
+    return getattr(settings, 'CASE_ASSIGNMENT_MAX_OPEN', None)
+
+
+def handler_workloads(handler_ids):
+    """{handler id: open cases} for ``handler_ids``, from the counter table."""
+    rows = (
+        CaseStatusCounter.objects
+        .filter(scope='handler', owner_id__in=handler_ids, status__in=OPEN_STATUSES)
+        .values('owner_id')
+        .annotate(open=Sum('count'))
+        .values_list('owner_id', 'open')
+    )
+    workloads = dict.fromkeys(handler_ids, 0)
+    workloads.update(rows)
+    return workloads
+
+
+def handlers(lock=False):
+    """Every handler, with their HandlerCapacity if they have one."""
+    queryset = (
+        get_user_model().objects
+        .filter(groups__name__iexact='handler')
+        .select_related('assignment_capacity')
+        .order_by('pk')
+    )
+    if lock:
+        # Only the users: the capacity side of the join may be missing.
+        queryset = queryset.select_for_update(of=('self',))
+    return list(queryset)
+
+
+class Pool:
+    """The handlers cases can still go to, least loaded for their weight first."""
+
+    def __init__(self, handlers, workloads):
+        self.heap = []
+        for handler in handlers:
+            capacity = getattr(handler, 'assignment_capacity', None)
+            weight = capacity.weight if capacity else 1
+            cap = capacity.max_open_cases if capacity else default_cap()
+            if weight:
+                self.push(handler, workloads[handler.pk], weight, cap)
+
+    def push(self, handler, load, weight, cap):
+        if cap is None or load < cap:
+            heapq.heappush(self.heap, (load / weight, handler.pk, load, weight, cap, handler))
+
+    def take(self):
+        """The next handler, counting the case they're given; None once everyone is full."""
+        if not self.heap:
+            return None
+        _, _, load, weight, cap, handler = heapq.heappop(self.heap)
+        self.push(handler, load + 1, weight, cap)
+        return handler
+
+
+def auto_assign(values, user):
+    """
+    Assign every case in ``values`` (ids; the whole approved queue, oldest
+    first, if None) to the least loaded handler; returns a BulkResult.
+    """
+    result = BulkResult()
+    if values is None:
+        case_ids = list(
+            Case.objects.filter(status='Approved').order_by('created_at', 'pk').values_list('pk', flat=True)
+        )
+    else:
+        case_ids = parse_case_ids(values, result)
+    chosen = {}
+
+    def check(case):
+        if case.status != 'Approved':
+            return f"Can't auto-assign a case that is {case.status}."
+        handler = pool.take()
+        if handler is None:
+            return "Every handler is at their cap."
+        chosen[case.pk] = handler
+
+    for batch in batched(case_ids, BATCH_SIZE):
+        with transaction.atomic():
+            # Fresh workloads each batch, under a lock on the handlers.
+            team = handlers(lock=True)
+            pool = Pool(team, handler_workloads([handler.pk for handler in team]))
+            apply_batch(
+                batch, user, check,
+                lambda case: {'status': 'Assigned', 'assigned_to_id': chosen[case.pk].pk},
+                lambda case: f"Case assigned to {escape(chosen[case.pk].username)}",
+                result,
+            )
+    return result
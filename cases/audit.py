@@ -0,0 +1,342 @@
+"""
+The case audit trail: one CaseHistory row per change, recording what kind
+of change it was, the fields it changed with their old and new values, and
+who made it.
+
+Case.save() records its own changes, so callers pass the actor and,
+optionally, the wording shown in the history (``case.save(actor=user,
+action="Case Approved")``) instead of writing CaseHistory rows themselves.
+Events that aren't a change to the case, like a file sent in the chat, go
+through record_event(). The rows replace both the free-text CaseHistory
+entries and the full-row HistoricalCase copies of django-simple-history;
+status_transitions() replays them for the rollups, and ``case.history``
+(CaseSnapshots) rebuilds the HistoricalCase records from them for the code
+that reads those.
+"""
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.db.models.fields.files import FieldFile
+from django.utils.dateparse import parse_datetime
+from django.utils.html import escape
+
+from .models import Case, CaseArchive, CaseHistory
+
+
+# Fields whose changes are recorded; timestamps change on every save.
+UNAUDITED_FIELDS = {'id', 'created_at', 'updated_at'}
+# The fields a creation event records, enough to replay a case's states.
+STATE_FIELDS = ('status', 'assigned_to')
+
+
+def audited_fields(model=Case):
+    return [field for field in model._meta.concrete_fields if field.name not in UNAUDITED_FIELDS]
+
+
+def audit_value(value):
+    if isinstance(value, FieldFile):
+        return value.name or None
+    return value
+
+
+def audit_values(case):
+    """{field name: value} of the audited fields, foreign keys as ids."""
+    return {field.name: audit_value(field.value_from_object(case)) for field in audited_fields(type(case))}
+
+
+def diff(old_values, new_values):
+    """{field: [old, new]} for every field that changed."""
+    return {
+        field: [old_values.get(field), value]
+        for field, value in new_values.items()
+        if old_values.get(field) != value
+    }
+
+
+def event_type(changes, created=False):
+    if created:
+        return CaseHistory.CREATED
+    if 'status' in changes and 'assigned_to' in changes:
+        return CaseHistory.ASSIGNMENT if changes['status'][1] == 'Assigned' else CaseHistory.TRANSITION
+    if 'assigned_to' in changes:
+        return CaseHistory.ASSIGNMENT
+    if 'status' in changes:
+        return CaseHistory.TRANSITION
+    return CaseHistory.UPDATE
+
+
+def describe(event, changes, case=None):
+    """The history wording of an event nobody gave one for."""
+    if event == CaseHistory.CREATED:
+        return "Case Registered"
+    if event == CaseHistory.ASSIGNMENT:
+        handler = case.assigned_to if case is not None else None
+        return f"Case assigned to {escape(handler)}" if handler else "Case unassigned"
+    if event == CaseHistory.TRANSITION:
+        return f"Status updated to '{escape(changes['status'][1])}'"
+    return "Case details updated: " + ", ".join(sorted(changes))
+
+
+def change_event(case, old_values, actor=None, action=None):
+    """
+    The unsaved CaseHistory row for saving ``case`` over ``old_values``
+    (None for a new case), or None if nothing changed and there's no
+    ``action`` to log.
+    """
+    new_values = audit_values(case)
+    created = old_values is None
+    if created:
+        changes = {field: [None, new_values[field]] for field in STATE_FIELDS if new_values[field] is not None}
+    else:
+        changes = diff(old_values, new_values)
+    if not changes and not action:
+        return None
+    event = event_type(changes, created)
+    return CaseHistory(
+        case=case,
+        event=event,
+        changes=changes,
+        action=action or describe(event, changes, case),
+        performed_by=actor,
+    )
+
+
+def record_change(case, old_values, actor=None, action=None):
+    """Log the change Case.save() just made; see change_event()."""
+    entry = change_event(case, old_values, actor, action)
+    if entry is not None:
+        entry.save()
+    return entry
+
+
+def record_event(case, event, action, actor=None, changes=None):
+    """Log something that happened to a case other than a change to its fields."""
+    return CaseHistory.objects.create(
+        case=case, event=event, changes=changes or {}, action=action, performed_by=actor,
+    )
+
+
+def history_events(queryset):
+    """(case_id, changes, timestamp) of the rows of ``queryset`` that change a case's state, in order per case."""
+    return (
+        queryset.filter(changes__has_any_keys=list(STATE_FIELDS))
+        .order_by('case_id', 'timestamp', 'id')
+        .values_list('case_id', 'changes', 'timestamp')
+        .iterator(chunk_size=5000)
+    )
+
+
+def replay_transitions(events):
+    """Replay history_events()-style tuples into status_transitions() tuples."""
+    case_id = status = assigned_to_id = None
+    for event_case_id, changes, timestamp in events:
+        if event_case_id != case_id:
+            case_id, status, assigned_to_id = event_case_id, None, None
+        if 'assigned_to' in changes:
+            assigned_to_id = changes['assigned_to'][1]
+        if 'status' in changes:
+            status = changes['status'][1]
+            yield case_id, status, assigned_to_id, timestamp
+
+
+def status_transitions(history_model=CaseHistory):
+    """
+    (case_id, status, assigned_to_id, timestamp) for each state change in
+    the audit trail, in order per case. Older free-text rows without
+    changes are skipped.
+    """
+    return replay_transitions(history_events(history_model.objects.all()))
+
+
+# A view logged its free-text CaseHistory row right after the save that
+# wrote the HistoricalCase snapshot; a row this soon after one describes it.
+SNAPSHOT_MATCH_WINDOW = datetime.timedelta(seconds=10)
+
+
+def fold_snapshots(case_id, snapshots, entries, usernames):
+    """
+    The audit trail of django-simple-history snapshots of one case, made as
+    migration 0018 made it for the database: each snapshot's diff with the
+    one before becomes the changes of the entry its view logged right after
+    it, or of a new entry when none did. ``snapshots`` are dicts with
+    history_type, history_date, history_user_id and the audited fields by
+    name, oldest first; ``entries`` the case's rows without changes, oldest
+    first; ``usernames`` {user id: username}. Returns (updated, new) rows.
+    """
+    fields = [field.name for field in audited_fields()]
+    snapshots = [snapshot for snapshot in snapshots if snapshot['history_type'] != '-']
+    matched, created = [], []
+    previous = None
+    for index, snapshot in enumerate(snapshots):
+        start = snapshot['history_date']
+        end = start + SNAPSHOT_MATCH_WINDOW
+        if index + 1 < len(snapshots):
+            end = min(end, snapshots[index + 1]['history_date'])
+        values = {field: snapshot.get(field) for field in fields}
+        if previous is None:
+            changes = {field: [None, values[field]] for field in STATE_FIELDS if values[field] is not None}
+        else:
+            changes = {field: [previous[field], value] for field, value in values.items() if previous[field] != value}
+        event = event_type(changes, previous is None)
+        previous = values
+        if not changes:
+            continue
+        entry = next(
+            (entry for entry in entries if not entry.changes and start <= entry.timestamp < end),
+            None,
+        )
+        if entry is not None:
+            entry.event, entry.changes = event, changes
+            entry.performed_by_id = entry.performed_by_id or snapshot['history_user_id']
+            matched.append(entry)
+            continue
+        if event == CaseHistory.ASSIGNMENT and changes['assigned_to'][1]:
+            action = f"Case assigned to {escape(usernames.get(changes['assigned_to'][1], ''))}"
+        else:
+            action = describe(event, changes)
+        created.append(CaseHistory(
+            case_id=case_id, event=event, changes=changes, action=action,
+            performed_by_id=snapshot['history_user_id'], timestamp=snapshot['history_date'],
+        ))
+    return matched, created
+
+
+class HistoricalCase:
+    """
+    A case as it was right after one change in its audit trail, with the
+    attributes of django-simple-history's HistoricalCase records: the
+    case's fields, ``instance``, ``history_id``, ``history_date``,
+    ``history_type`` ('+' created, '~' changed), ``history_user`` and
+    ``history_change_reason``.
+    """
+
+    def __init__(self, entry_id, timestamp, changes, action, values, created, user_id=None, username=None):
+        self.history_id = entry_id
+        self.history_date = timestamp
+        self.history_type = '+' if created else '~'
+        self.history_change_reason = action
+        self.history_user_id = user_id
+        self.history_username = username
+        self.changes = changes
+        self.instance = Case(**{
+            field.attname: field.to_python(values[field.name]) for field in audited_fields()
+        })
+        self.instance.pk = values['id']
+        self.prev_record = self.next_record = None
+
+    @property
+    def history_user(self):
+        users = get_user_model().objects
+        if self.history_user_id is not None:
+            return users.filter(pk=self.history_user_id).first()
+        # Archived entries only kept the username.
+        return users.filter(username=self.history_username).first() if self.history_username else None
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['instance'], name)
+
+    def __repr__(self):
+        return f"<HistoricalCase #{self.instance.pk} {self.history_type} {self.history_date}>"
+
+
+class CaseSnapshots:
+    """
+    ``case.history``: the case's states over time, rebuilt from its audit
+    trail (archived entries included) by undoing each entry's changes from
+    the current state back. Newest first, like django-simple-history; code
+    written against HistoricalCase keeps working without the full-row
+    copies it used to store.
+    """
+
+    def __init__(self, case, records=None):
+        self.case = case
+        self._records = records
+
+    def _rows(self):
+        """(id, timestamp, event, changes, action, user id, username), oldest first."""
+        from .archive import load_archive
+
+        rows = [
+            (entry.id, entry.timestamp, entry.event, entry.changes, entry.action, entry.performed_by_id, None)
+            for entry in self.case.custom_history.exclude(changes={}).order_by('timestamp', 'id')
+        ]
+        if CaseArchive.objects.filter(case=self.case).exists():
+            rows += [
+                (
+                    record['id'], parse_datetime(record['timestamp']), record['event'], record['changes'],
+                    record['action'], None, record['performed_by'],
+                )
+                for record in load_archive(self.case)['history'] if record['changes']
+            ]
+        rows.sort(key=lambda row: (row[1], row[0]))
+        return rows
+
+    def _snapshots(self):
+        if self._records is None:
+            values = dict(audit_values(self.case), id=self.case.pk)
+            records = []
+            for entry_id, timestamp, event, changes, action, user_id, username in reversed(self._rows()):
+                if not any(field in values for field in changes):
+                    continue  # e.g. a file sent in the chat
+                records.append(HistoricalCase(
+                    entry_id, timestamp, changes, action, values, event == CaseHistory.CREATED, user_id, username,
+                ))
+                values = dict(values, **{field: change[0] for field, change in changes.items() if field in values})
+            for newer, older in zip(records, records[1:]):
+                newer.prev_record, older.next_record = older, newer
+            self._records = records
+        return self._records
+
+    def all(self):
+        return CaseSnapshots(self.case, self._snapshots())
+
+    def order_by(self, *fields):
+        records = list(self._snapshots())
+        for field in reversed(fields):
+            records.sort(key=lambda record: getattr(record, field.lstrip('-')), reverse=field.startswith('-'))
+        return CaseSnapshots(self.case, records)
+
+    def __iter__(self):
+        return iter(self._snapshots())
+
+    def __len__(self):
+        return len(self._snapshots())
+
+    def __getitem__(self, index):
+        return self._snapshots()[index]
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return bool(self._snapshots())
+
+    def first(self):
+        records = self._snapshots()
+        return records[0] if records else None
+
+    def last(self):
+        records = self._snapshots()
+        return records[-1] if records else None
+
+    def latest(self):
+        """The most recent record, by date."""
+        if not self._snapshots():
+            raise Case.DoesNotExist("The case has no recorded history.")
+        return max(self._snapshots(), key=lambda record: (record.history_date, record.history_id))
+
+    def earliest(self):
+        if not self._snapshots():
+            raise Case.DoesNotExist("The case has no recorded history.")
+        return min(self._snapshots(), key=lambda record: (record.history_date, record.history_id))
+
+    def most_recent(self):
+        """The case as last recorded."""
+        return self.latest().instance
+
+    def as_of(self, date):
+        """The case as it was at ``date``."""
+        records = [record for record in self._snapshots() if record.history_date <= date]
+        if not records:
+            raise Case.DoesNotExist(f"The case had no recorded state at {date}.")
+        return max(records, key=lambda record: (record.history_date, record.history_id)).instance
@@ -0,0 +1,327 @@
+"""
+End-to-end benchmark of the main pages.
+
+Each scenario is one request made as an admin, a handler or a reporting
+user: the dashboards, the case lists, case detail, get-messages,
+registering a case and the status changes. By default requests go through
+the Django test client in this process, which also measures queries per
+request and peak Python memory; writes happen in a transaction that is
+rolled back at the end. With ``base_url`` requests go over HTTP to a
+running server sharing this database instead; only latency is measured
+there, and writes are kept.
+
+Results are plain JSON with sorted keys, so two runs can be diffed.
+"""
+import datetime
+import json
+import math
+import platform
+import resource
+import secrets
+import sys
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .dashboard_cache import invalidate_all
+from .models import Case, CaseHistory, CaseMessage
+
+
+class Scenario:
+    """
+    ``build(runner)`` returns (url, data) for one request; it runs before
+    the request and isn't timed, so it may create the case a write needs.
+    """
+
+    def __init__(self, name, actor, build, method='get', writes=False):
+        self.name = name
+        self.actor = actor
+        self.build = build
+        self.method = method
+        self.writes = writes
+
+
+def page(name):
+    return lambda runner: (reverse(name), None)
+
+
+def fresh_case(runner, status, assigned=True):
+    return Case.objects.create(
+        title='Benchmark case',
+        description='Created by the benchmark runner.',
+        status=status,
+        created_by=runner.actors['user'],
+        assigned_to=runner.actors['handler'] if assigned else None,
+    )
+
+
+SCENARIOS = [
+    # Admin
+    Scenario('admin_dashboard', 'admin', page('admin_dashboard')),
+    Scenario('all_cases', 'admin', page('all_cases')),
+    Scenario('all_cases_search', 'admin', lambda runner: (reverse('all_cases'), {'q': runner.search_term})),
+    Scenario('pending_cases', 'admin', page('pending_cases')),
+    Scenario('approved_cases', 'admin', page('approved_cases')),
+    Scenario('admin_assigned_cases', 'admin', page('admin_assigned_cases')),
+    Scenario('closed_cases', 'admin', page('closed_cases')),
+    Scenario('view_handlers', 'admin', page('view_handlers')),
+    Scenario('view_users', 'admin', page('view_users')),
+    # Handler
+    Scenario('handler_dashboard', 'handler', page('handler_dashboard')),
+    Scenario('handler_all_cases', 'handler', page('handler_all_cases')),
+    Scenario('handler_ongoing_cases', 'handler', page('handler_ongoing_cases')),
+    # User
+    Scenario('user_dashboard', 'user', page('user_dashboard')),
+    Scenario('user_all_cases', 'user', page('user_all_cases')),
+    Scenario('case_detail', 'user', lambda runner: (reverse('case_detail', args=[runner.case.pk]), None)),
+    Scenario('get_messages', 'user', lambda runner: (reverse('get_messages', args=[runner.case.pk]), None)),
+    # Writes
+    Scenario(
+        'register_case', 'user', method='post', writes=True,
+        build=lambda runner: (reverse('register_case'), {
+            'title': 'Benchmark case', 'description': 'Registered by the benchmark runner.',
+        }),
+    ),
+    Scenario(
+        'pending_cases_approve', 'admin', method='post', writes=True,
+        build=lambda runner: (reverse('pending_cases'), {'case_id': fresh_case(runner, 'Pending', False).pk}),
+    ),
+    Scenario(
+        'start_operating', 'handler', method='post', writes=True,
+        build=lambda runner: (reverse('start_operating', args=[fresh_case(runner, 'Assigned').pk]), None),
+    ),
+    Scenario(
+        'update_status', 'handler', method='post', writes=True,
+        build=lambda runner: (
+            reverse('update_status', args=[fresh_case(runner, 'In Progress').pk]), {'status': 'Resolved'},
+        ),
+    ),
+]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(percent / 100 * len(ordered))) - 1]
+
+
+def summarize(values, digits=3):
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 50), digits),
+        'p95': round(percentile(values, 95), digits),
+        'p99': round(percentile(values, 99), digits),
+        'mean': round(sum(values) / len(values), digits),
+        'max': round(max(values), digits),
+    }
+
+
+def max_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage  # bytes on macOS, KiB elsewhere
+
+
+class BenchmarkRunner:
+    def __init__(self, requests=50, warmup=5, base_url=None, include_writes=True, only=None, log=None):
+        self.requests = requests
+        self.warmup = warmup
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.include_writes = include_writes
+        self.only = set(only or ())
+        self.log = log or (lambda message: None)
+
+    def scenarios(self):
+        return [
+            scenario for scenario in SCENARIOS
+            if (self.include_writes or not scenario.writes) and (not self.only or scenario.name in self.only)
+        ]
+
+    def pick_actors(self):
+        """The superuser, and the busiest handler and reporting user."""
+        User = get_user_model()
+        admin = User.objects.filter(is_superuser=True).order_by('pk').first()
+        handler = (
+            User.objects.filter(groups__name='handler')
+            .annotate(n=Count('cases_assigned')).order_by('-n', 'pk').first()
+        )
+        user = (
+            User.objects.filter(role='user', is_superuser=False)
+            .annotate(n=Count('cases_created')).order_by('-n', 'pk').first()
+        )
+        missing = [role for role, person in (('admin', admin), ('handler', handler), ('user', user)) if person is None]
+        if missing:
+            raise ValueError(f"No {', '.join(missing)} account to benchmark as.")
+        self.actors = {'admin': admin, 'handler': handler, 'user': user}
+        self.case = user.cases_created.order_by('-pk').first()
+        if self.case is None:
+            raise ValueError(f"{user.username} has no cases to open.")
+        self.search_term = self.case.title.split()[0]
+
+    def run(self):
+        self.pick_actors()
+        started = datetime.datetime.now(datetime.timezone.utc)
+        if self.base_url:
+            results = self.run_http()
+        else:
+            results = self.run_in_process()
+        return {
+            'meta': {
+                'started': started.isoformat(),
+                'mode': 'http' if self.base_url else 'test-client',
+                'base_url': self.base_url,
+                'requests': self.requests,
+                'warmup': self.warmup,
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'rows': {
+                    'users': get_user_model().objects.count(),
+                    'cases': Case.objects.count(),
+                    'messages': CaseMessage.objects.count(),
+                    'history': CaseHistory.objects.count(),
+                },
+            },
+            'scenarios': results,
+            'process': {'max_rss_kb': max_rss_kb()},
+        }
+
+    # In-process
+
+    def run_in_process(self):
+        clients = {}
+        for role, person in self.actors.items():
+            clients[role] = Client()
+            clients[role].force_login(person)
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            with transaction.atomic():
+                for scenario in self.scenarios():
+                    self.log(f"{scenario.name}...")
+                    results[scenario.name] = self.measure_in_process(scenario, clients[scenario.actor])
+                transaction.set_rollback(True)
+        # Fragments cached from the rolled back writes must not outlive them.
+        invalidate_all()
+        return results
+
+    def measure_in_process(self, scenario, client):
+        def call():
+            url, data = scenario.build(self)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(client, scenario.method)(url, data or {})
+                elapsed = time.perf_counter() - start
+            return url, response.status_code, elapsed, len(queries)
+
+        for _ in range(self.warmup):
+            call()
+        latencies, query_counts, statuses = [], [], Counter()
+        for _ in range(self.requests):
+            url, status, elapsed, queries = call()
+            latencies.append(elapsed * 1000)
+            query_counts.append(queries)
+            statuses[status] += 1
+
+        # Memory is traced on a separate request; tracing slows every allocation.
+        tracemalloc.start()
+        try:
+            call()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'method': scenario.method.upper(),
+            'path': url,
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'latency_ms': summarize(latencies),
+            'queries': summarize(query_counts, digits=1),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    # Over HTTP
+
+    def http_session(self, person):
+        client = Client()
+        client.force_login(person)
+        csrf_token = secrets.token_hex(16)
+        cookies = {
+            settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+            settings.CSRF_COOKIE_NAME: csrf_token,
+        }
+        return {
+            'Cookie': '; '.join(f'{name}={value}' for name, value in cookies.items()),
+            'X-CSRFToken': csrf_token,
+        }
+
+    def run_http(self):
+        sessions = {role: self.http_session(person) for role, person in self.actors.items()}
+        results = {}
+        for scenario in self.scenarios():
+            self.log(f"{scenario.name}...")
+            results[scenario.name] = self.measure_http(scenario, sessions[scenario.actor])
+        return results
+
+    def measure_http(self, scenario, headers):
+        def call():
+            url, data = scenario.build(self)
+            body = None
+            if scenario.method == 'get' and data:
+                url = f"{url}?{urllib.parse.urlencode(data)}"
+            elif scenario.method == 'post':
+                body = urllib.parse.urlencode(data or {}).encode()
+            request = urllib.request.Request(
+                self.base_url + url, data=body, headers=headers, method=scenario.method.upper(),
+            )
+            start = time.perf_counter()
+            try:
+                with NoRedirects.open(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            return url, status, time.perf_counter() - start
+
+        for _ in range(self.warmup):
+            call()
+        latencies, statuses = [], Counter()
+        for _ in range(self.requests):
+            url, status, elapsed = call()
+            latencies.append(elapsed * 1000)
+            statuses[status] += 1
+        return {
+            'method': scenario.method.upper(),
+            'path': url,
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'latency_ms': summarize(latencies),
+            'queries': None,
+            'peak_memory_kb': None,
+        }
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Time the view itself, not the page it redirects to.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+NoRedirects = urllib.request.build_opener(_NoRedirectHandler)
+
+
+def write_results(results, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write('\n')
@@ -0,0 +1,167 @@
+"""
+Approve or assign many cases in one request.
+
+Each batch of BATCH_SIZE cases costs the same handful of queries however
+many cases it holds: one to lock and load them, one UPDATE, one insert for
+the audit trail, and the counter, rollup, search index and notification
+outbox writes Case.save() would otherwise do case by case. Cases that can't
+make the transition are reported, not raised, so one bad id doesn't fail
+the rest.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case as DbCase, F, Value, When
+from django.utils import timezone
+from django.utils.html import escape
+from django_fsm import can_proceed
+
+from .audit import audit_values, change_event
+from .counters import apply_counter_deltas, counter_deltas
+from .dashboard_cache import invalidate_case
+from .events import has_listeners, history_event, hub
+from .models import Case, CaseHistory
+from .notifications import notify_changes
+from .rollups import apply_rollup_deltas, rollup_deltas
+from .search import index_cases
+from .utils import batched
+
+
+BATCH_SIZE = 500
+# The approved queue, and reassigning a case no one has started on yet.
+ASSIGNABLE_STATUSES = ('Approved', 'Assigned')
+
+
+class BulkResult:
+    """The ids that changed and, for the others, why they didn't."""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+
+    def as_dict(self):
+        return {
+            'succeeded': self.succeeded,
+            'failed': [{'id': case_id, 'error': error} for case_id, error in self.failed.items()],
+        }
+
+
+def parse_case_ids(values, result):
+    """Unique integer ids from ``values`` in order; the rest are recorded as failures."""
+    case_ids = []
+    for value in values:
+        try:
+            case_id = int(value)
+        except (TypeError, ValueError):
+            result.failed[str(value)] = "Not a case id."
+            continue
+        if case_id not in case_ids:
+            case_ids.append(case_id)
+    return case_ids
+
+
+def bulk_transition(values, user, check, changes, action):
+    """
+    Apply the field ``changes`` to every case in ``values`` that ``check``
+    returns no error for, logging ``action`` in its history.
+    """
+    result = BulkResult()
+    for batch in batched(parse_case_ids(values, result), BATCH_SIZE):
+        with transaction.atomic():
+            apply_batch(batch, user, check, changes, action, result)
+    return result
+
+
+def update_values(updates):
+    """
+    Field values for a single UPDATE applying each set of changes in
+    ``updates`` to its cases: a field that varies between them becomes a
+    CASE WHEN on the case id.
+    """
+    fields = {}
+    for items, case_ids in updates.items():
+        for field, value in items:
+            fields.setdefault(field, []).append((value, case_ids))
+    values = {}
+    for field, choices in fields.items():
+        if len(choices) == len(updates) and len({value for value, _ in choices}) == 1:
+            values[field] = choices[0][0]
+        else:
+            values[field] = DbCase(
+                *(When(pk__in=case_ids, then=Value(value)) for value, case_ids in choices),
+                default=F(field),
+                output_field=Case._meta.get_field(field),
+            )
+    return values
+
+
+def apply_batch(batch, user, check, changes, action, result):
+    """
+    One batch of bulk_transition(). ``changes`` and ``action`` may be
+    functions of the case instead, for changes that differ between cases.
+    """
+    cases = Case.objects.select_for_update().in_bulk(batch)
+    now = timezone.now()
+    changed, states, audited = [], [], []
+    updates = {}  # {changes as items: ids of the cases they apply to}
+    for case_id in batch:
+        case = cases.get(case_id)
+        error = "Case not found." if case is None else check(case)
+        if error:
+            result.failed[case_id] = error
+            continue
+        old_state = (case.status, case.assigned_to_id, case.created_by_id)
+        audited.append(audit_values(case))
+        case_changes = changes(case) if callable(changes) else changes
+        for field, value in case_changes.items():
+            setattr(case, field, value)
+        case.updated_at = now
+        changed.append(case)
+        updates.setdefault(tuple(case_changes.items()), []).append(case.pk)
+        states.append((old_state, (case.status, case.assigned_to_id, case.created_by_id)))
+    if not changed:
+        return
+
+    case_ids = [case.pk for case in changed]
+    Case.objects.filter(pk__in=case_ids).update(updated_at=now, **update_values(updates))
+    entries = CaseHistory.objects.bulk_create([
+        change_event(case, old_values, user, action(case) if callable(action) else action)
+        for case, old_values in zip(changed, audited)
+    ])
+
+    counters, rollups = Counter(), Counter()
+    for (old_state, new_state), case in zip(states, changed):
+        counters.update(counter_deltas(old_state, new_state))
+        rollups.update(rollup_deltas(old_state, new_state, case.created_at, when=now))
+    apply_counter_deltas(counters)
+    apply_rollup_deltas(rollups)
+    invalidate_case(*(state for pair in states for state in pair))
+    index_cases(case_ids)
+    # The outbox coalesces these into one digest per recipient.
+    notify_changes(zip(changed, entries))
+
+    # bulk_create() doesn't send the post_save that publishes history events.
+    for entry in entries:
+        if has_listeners(entry.case_id):
+            transaction.on_commit(lambda entry=entry: hub.publish(entry.case_id, history_event(entry)))
+    result.succeeded.extend(case_ids)
+
+
+def bulk_approve(values, user):
+    def check(case):
+        if not can_proceed(case.approve):
+            return f"Can't approve a case that is {case.status}."
+
+    return bulk_transition(values, user, check, {'status': 'Approved'}, "Case Approved")
+
+
+def bulk_assign(values, handler, user):
+    def check(case):
+        if case.status not in ASSIGNABLE_STATUSES:
+            return f"Can't assign a case that is {case.status}."
+
+    return bulk_transition(
+        values, user, check,
+        {'status': 'Assigned', 'assigned_to_id': handler.pk},
+        f"Case assigned to {escape(handler.username)}",
+    )
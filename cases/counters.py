@@ -0,0 +1,138 @@
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case as DbCase, Count, F, Q, Value, When
+
+from .models import Case, CaseStatusCounter
+from .stats import STATUS_BUCKETS, derive_buckets
+
+
+# Counter rows touched by a single UPDATE; bulk case writes can touch thousands.
+COUNTER_BATCH_SIZE = 200
+
+
+def counter_keys(status, assigned_to_id, created_by_id):
+    """Counter rows a case with the given state contributes to."""
+    keys = [('global', 0, status)]
+    if assigned_to_id:
+        keys.append(('handler', assigned_to_id, status))
+    if created_by_id:
+        keys.append(('creator', created_by_id, status))
+    return keys
+
+
+def counter_deltas(old_state, new_state):
+    """
+    Counter changes for a case moving from ``old_state`` to ``new_state``.
+    Each state is a (status, assigned_to_id, created_by_id) tuple, or None
+    when the case doesn't exist on that side of the change.
+    """
+    deltas = Counter()
+    if old_state is not None:
+        for key in counter_keys(*old_state):
+            deltas[key] -= 1
+    if new_state is not None:
+        for key in counter_keys(*new_state):
+            deltas[key] += 1
+    return deltas
+
+
+def counter_filter(keys):
+    return reduce(or_, (Q(scope=scope, owner_id=owner_id, status=status) for scope, owner_id, status in keys))
+
+
+def increment_counters(deltas):
+    """Add each delta to its existing counter row in one UPDATE; returns the rows changed."""
+    amount = DbCase(
+        *(When(counter_filter([key]), then=Value(delta)) for key, delta in deltas.items()),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+    return CaseStatusCounter.objects.filter(counter_filter(deltas)).update(count=F('count') + amount)
+
+
+def apply_counter_deltas(deltas):
+    """
+    Apply a mapping of (scope, owner_id, status) -> delta to the counter
+    table, one UPDATE per COUNTER_BATCH_SIZE keys when the rows exist.
+    """
+    keys = [key for key, delta in deltas.items() if delta]
+    with transaction.atomic():
+        for start in range(0, len(keys), COUNTER_BATCH_SIZE):
+            batch = {key: deltas[key] for key in keys[start:start + COUNTER_BATCH_SIZE]}
+            if increment_counters(batch) == len(batch):
+                continue
+            # Some rows don't exist yet: create them at zero, then add to those.
+            existing = set(
+                CaseStatusCounter.objects.filter(counter_filter(batch))
+                .values_list('scope', 'owner_id', 'status')
+            )
+            missing = {key: delta for key, delta in batch.items() if key not in existing}
+            CaseStatusCounter.objects.bulk_create(
+                [CaseStatusCounter(scope=scope, owner_id=owner_id, status=status) for scope, owner_id, status in missing],
+                ignore_conflicts=True,
+            )
+            increment_counters(missing)
+
+
+def counter_status_counts(scope='global', owner_id=0):
+    """Status buckets for one scope, read from the counter table in a single query."""
+    rows = dict(
+        CaseStatusCounter.objects
+        .filter(scope=scope, owner_id=owner_id)
+        .values_list('status', 'count')
+    )
+    counts = {bucket: rows.get(status, 0) for bucket, status in STATUS_BUCKETS.items()}
+    counts['total'] = sum(rows.values())
+    return derive_buckets(counts)
+
+
+def compute_counters():
+    """Recompute every counter row from the cases table."""
+    expected = Counter()
+    per_status = Case.objects.order_by().values('status')
+    for row in per_status.annotate(n=Count('pk')):
+        expected[('global', 0, row['status'])] = row['n']
+    for scope, field in (('handler', 'assigned_to_id'), ('creator', 'created_by_id')):
+        rows = per_status.filter(**{f'{field}__isnull': False}).values(field, 'status').annotate(n=Count('pk'))
+        for row in rows:
+            expected[(scope, row[field], row['status'])] = row['n']
+    return expected
+
+
+def stored_counters():
+    return Counter({
+        (scope, owner_id, status): count
+        for scope, owner_id, status, count in CaseStatusCounter.objects.values_list(
+            'scope', 'owner_id', 'status', 'count'
+        )
+        if count
+    })
+
+
+def verify_counters():
+    """
+    Compare the counter table with the cases table and return the mismatches
+    as {(scope, owner_id, status): (stored, expected)}.
+    """
+    expected = compute_counters()
+    stored = stored_counters()
+    return {
+        key: (stored.get(key, 0), expected.get(key, 0))
+        for key in set(expected) | set(stored)
+        if stored.get(key, 0) != expected.get(key, 0)
+    }
+
+
+@transaction.atomic
+def rebuild_counters():
+    from .dashboard_cache import invalidate_all
+
+    CaseStatusCounter.objects.all().delete()
+    CaseStatusCounter.objects.bulk_create(
+        CaseStatusCounter(scope=scope, owner_id=owner_id, status=status, count=count)
+        for (scope, owner_id, status), count in compute_counters().items()
+    )
+    invalidate_all()
@@ -0,0 +1,124 @@
+"""
+Cache for the computed dashboard fragments: the admin statistics cards and
+chart data, and the handler and user summary counters.
+
+Fragments are cached per scope, named like the counter rows they are built
+from: 'global:0' for what every admin sees, 'handler:<id>' and
+'creator:<id>' for one user's own cases. Every scope has a version that is
+part of its fragment keys. Writes bump the versions of the scopes they
+touch once their transaction commits, so stale fragments are never read
+again and expire after DASHBOARD_CACHE_TIMEOUT seconds.
+
+DASHBOARD_CACHE_ALIAS picks the cache, which every process that serves
+dashboards or writes cases must share: the database, file, memcached or
+redis backends. A version bumped in one process's local-memory cache would
+leave the other processes serving stale fragments until they expire, so
+with the local-memory backend nothing is cached and every fragment is
+computed on each request.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .counters import counter_keys, counter_status_counts
+
+
+DEFAULT_TIMEOUT = 300
+GENERATION_KEY = 'dashboard:generation'
+
+
+def get_cache():
+    """The dashboard cache, or None when it's private to this process."""
+    cache = caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+    return None if isinstance(cache, LocMemCache) else cache
+
+
+def scope_key(scope, owner_id=0):
+    return f'{scope}:{owner_id}'
+
+
+def version_key(scope):
+    return f'dashboard:version:{scope}'
+
+
+def fresh_version():
+    # Versions start from the clock rather than 1, so a version key lost to
+    # eviction can't come back matching fragments cached before it was lost.
+    return time.time_ns()
+
+
+def current_versions(cache, scope):
+    keys = [GENERATION_KEY, version_key(scope)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, fresh_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions[GENERATION_KEY], versions[version_key(scope)]
+
+
+def cached_fragment(name, scope, compute, *parts):
+    """
+    Return the fragment ``name`` of ``scope``, calling ``compute()`` on a
+    miss. ``parts`` are extra key components the value depends on, such as
+    the day a chart ends on.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    generation, version = current_versions(cache, scope)
+    key = ':'.join(['dashboard', name, scope, str(generation), str(version), *map(str, parts)])
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
+
+
+def cached_status_counts(scope='global', owner_id=0):
+    """counter_status_counts(), cached."""
+    return cached_fragment(
+        'status_counts', scope_key(scope, owner_id),
+        lambda: counter_status_counts(scope, owner_id),
+    )
+
+
+def bump(key):
+    cache = get_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, fresh_version(), timeout=None)
+
+
+def invalidate_scopes(scopes):
+    """Drop the fragments of ``scopes`` once the current transaction commits."""
+    scopes = set(scopes)
+
+    def bump_scopes():
+        for scope in scopes:
+            bump(version_key(scope))
+
+    transaction.on_commit(bump_scopes)
+
+
+def invalidate_case(*states):
+    """
+    Drop the fragments showing a case in any of ``states``, each a
+    (status, assigned_to_id, created_by_id) tuple or None.
+    """
+    invalidate_scopes(
+        scope_key(scope, owner_id)
+        for state in states if state is not None
+        for scope, owner_id, status in counter_keys(*state)
+    )
+
+
+def invalidate_all():
+    """Drop every dashboard fragment, e.g. after the counters are rebuilt."""
+    transaction.on_commit(lambda: bump(GENERATION_KEY))
@@ -0,0 +1,259 @@
+"""
+Live case events (new chat messages and history entries) for the case
+detail page.
+
+Events are fanned out in-process by ``hub`` to the Server-Sent Events
+streams of cases.views.case_events, and relayed to the other processes by
+a broker. The default depends on the process count that uvicorn and gunicorn
+take from WEB_CONCURRENCY. With one web process, ``LocalBroker`` keeps
+events in it. With more, ``DatabaseBroker`` relays them through the
+CaseEvent table. CASE_EVENTS_BROKER, the dotted path of a broker class,
+overrides the choice. Set it to DatabaseBroker when cases also change
+outside the ASGI processes, e.g. in a WSGI server or a management command;
+see ``LocalBroker`` for the interface.
+
+Streams only work under the ASGI application (CaseEase.asgi). Under WSGI
+Django would drain the endless stream before sending a byte and hold a
+worker thread for good, so there case_events answers 204, which tells
+EventSource not to reconnect, and the detail page polls get_messages
+instead; see can_stream().
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+SUBSCRIBER_QUEUE_SIZE = 100
+# DatabaseBroker: seconds between polls, and how long relayed events are kept.
+POLL_INTERVAL = 1
+EVENT_RETENTION = datetime.timedelta(minutes=1)
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, hub, case_id):
+        self.hub = hub
+        self.case_id = case_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop. A viewer that stopped reading
+        # loses its oldest events rather than growing without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hub.unsubscribe(self)
+
+
+class CaseEventHub:
+    """Fan-out of case events to the subscribers in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, case_id):
+        """Subscribe the running event loop to a case; use as a context manager."""
+        subscription = Subscription(self, case_id)
+        with self._lock:
+            self._subscribers[case_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.case_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.case_id]
+
+    def has_subscribers(self, case_id):
+        return bool(self._subscribers.get(case_id))
+
+    def subscribed_cases(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def dispatch(self, case_id, event):
+        """Hand an event to the local subscribers. Safe to call from any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(case_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                pass  # the subscriber's loop has shut down
+
+    def publish(self, case_id, event):
+        self.dispatch(case_id, event)
+        broker.publish(case_id, event)
+
+
+class LocalBroker:
+    """
+    Default broker: events never leave the process.
+
+    A cross-process broker sends ``publish()``ed events to the other
+    processes and, once ``start(hub)`` is called, hands the events it
+    receives to ``hub.dispatch(case_id, event)``.
+    """
+
+    def start(self, hub):
+        pass
+
+    def publish(self, case_id, event):
+        pass
+
+
+class DatabaseBroker:
+    """
+    Relays events between processes through the CaseEvent table, on any
+    database. publish() inserts a row. Each process polls for the rows of
+    the cases its viewers follow, every CASE_EVENTS_POLL_INTERVAL seconds,
+    from a thread that stays idle while nobody is subscribed. Rows older
+    than EVENT_RETENTION are pruned by the publishers.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.hub = None
+        self.last_id = None
+        self.pruned_at = 0
+
+    def start(self, hub):
+        self.hub = hub
+        threading.Thread(target=self.run, name='case-events', daemon=True).start()
+
+    def run(self):
+        interval = getattr(settings, 'CASE_EVENTS_POLL_INTERVAL', POLL_INTERVAL)
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll()
+            except DatabaseError:
+                logger.exception("Polling for case events failed")
+                connection.close()
+
+    def poll(self):
+        """Hand the other processes' new events for the subscribed cases to the hub."""
+        from .models import CaseEvent
+
+        case_ids = self.hub.subscribed_cases()
+        if not case_ids:
+            # Whoever subscribes next starts from then, not from a backlog.
+            self.last_id = None
+            return
+        if self.last_id is None:
+            self.last_id = CaseEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            return
+        events = (
+            CaseEvent.objects.filter(id__gt=self.last_id, case_id__in=case_ids)
+            .exclude(origin=self.origin)
+            .order_by('id').values_list('id', 'case_id', 'payload')
+        )
+        for event_id, case_id, payload in events:
+            self.hub.dispatch(case_id, payload)
+            self.last_id = event_id
+
+    def publish(self, case_id, event):
+        from .models import CaseEvent
+
+        try:
+            CaseEvent.objects.create(case_id=case_id, payload=event, origin=self.origin)
+            if time.monotonic() - self.pruned_at > EVENT_RETENTION.total_seconds():
+                self.pruned_at = time.monotonic()
+                CaseEvent.objects.filter(created_at__lt=timezone.now() - EVENT_RETENTION).delete()
+        except DatabaseError:
+            # Runs after the change committed; viewers elsewhere miss one live update.
+            logger.exception("Relaying an event of case #%s failed", case_id)
+
+
+def web_processes():
+    """How many web server processes there are, as uvicorn and gunicorn read it from WEB_CONCURRENCY."""
+    try:
+        return int(os.environ.get('WEB_CONCURRENCY', 1))
+    except ValueError:
+        return 1
+
+
+def load_broker():
+    broker_path = getattr(settings, 'CASE_EVENTS_BROKER', None)
+    if broker_path:
+        broker_class = import_string(broker_path)
+    else:
+        broker_class = DatabaseBroker if web_processes() > 1 else LocalBroker
+    return broker_class()
+
+
+hub = CaseEventHub()
+broker = load_broker()
+broker.start(hub)
+
+
+def can_stream(request):
+    """Whether ``request`` came through the ASGI application, the only one that can hold a stream open."""
+    return isinstance(request, ASGIRequest)
+
+
+def has_listeners(case_id):
+    """Whether an event for this case could reach anyone; skip building it otherwise."""
+    return hub.has_subscribers(case_id) or not isinstance(broker, LocalBroker)
+
+
+def show_sender(case, user):
+    """Mirror of the case detail template: creators of anonymous cases stay anonymous."""
+    if not case.is_anonymous or user.is_superuser:
+        return True
+    return any(group.name == 'handler' for group in user.groups.all())
+
+
+def message_event(message):
+    case = message.case
+    sender = message.sender
+    return {
+        'type': 'message',
+        'id': message.id,
+        'sender_id': sender.id,
+        'user': sender.username if show_sender(case, sender) else 'Anonymous',
+        'text': message.message,
+        'file_url': message.file.url if message.file else '',
+        'file_name': message.file.name.replace('chat_files/', '') if message.file else '',
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def history_event(record):
+    return {
+        'type': 'history',
+        'id': record.id,
+        'event': record.event,
+        'action': record.action,
+        'performed_by': record.performed_by.username if record.performed_by else 'Anonymous',
+        'timestamp': record.timestamp.isoformat(),
+    }
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,266 @@
+"""
+Streaming exports of cases, optionally with their chat and history.
+
+export_stream() yields the export as bytes, a buffer at a time, so a view
+can hand it to a StreamingHttpResponse and a command can write it to a
+file without either holding more than one chunk of cases in memory: the
+cases come from a server-side cursor (QuerySet.iterator(), which is a
+plain chunked fetch on SQLite), and the messages and history of each chunk
+of CHUNK_SIZE cases are loaded with one query each.
+
+Messages and history moved to the archive (cases.archive) are exported
+with the rows still in the database: the archive files of each chunk's
+archived cases are read once, and their records merged in by time.
+
+CSV has one row per case, its messages and history as JSON arrays in
+their own columns; JSON lines has one object per case with the same keys.
+Either can be gzip-compressed on the fly.
+"""
+import csv
+import datetime
+import json
+import os
+import zlib
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .archive import archive_root, read_records, unique_records
+from .models import Case, CaseArchive, CaseHistory, CaseMessage
+from .utils import batched
+
+
+CHUNK_SIZE = 1000
+BUFFER_SIZE = 64 * 1024
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+CASE_FIELDS = (
+    'id', 'title', 'description', 'status', 'location', 'incident_date',
+    'is_anonymous', 'suspect_name', 'witnesses', 'progress_notes',
+    'uploaded_file', 'report_file', 'created_by', 'assigned_to',
+    'created_at', 'updated_at',
+)
+INCLUDES = ('messages', 'history')
+
+
+def export_queryset(statuses=(), handler=None, created_from=None, created_to=None):
+    """The cases to export, oldest first; the dates are inclusive local days."""
+    cases = Case.objects.for_export().order_by('pk')
+    if statuses:
+        cases = cases.filter(status__in=statuses)
+    if handler is not None:
+        cases = cases.filter(assigned_to=handler)
+    # Day bounds rather than created_at__date, which can't use the index.
+    if created_from:
+        cases = cases.filter(created_at__gte=day_start(created_from))
+    if created_to:
+        cases = cases.filter(created_at__lt=day_start(created_to + datetime.timedelta(days=1)))
+    return cases
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def case_record(case):
+    return {
+        'id': case.id,
+        'title': case.title,
+        'description': case.description,
+        'status': case.status,
+        'location': case.location,
+        'incident_date': case.incident_date,
+        'is_anonymous': case.is_anonymous,
+        'suspect_name': case.suspect_name,
+        'witnesses': case.witnesses,
+        'progress_notes': case.progress_notes,
+        'uploaded_file': case.uploaded_file.name or None,
+        'report_file': case.report_file.name or None,
+        'created_by': case.created_by.username,
+        'assigned_to': case.assigned_to.username if case.assigned_to else None,
+        'created_at': case.created_at,
+        'updated_at': case.updated_at,
+    }
+
+
+def case_messages(case_ids):
+    return (
+        CaseMessage.objects.filter(case_id__in=case_ids)
+        .order_by('case_id', 'timestamp', 'id')
+        .values('case_id', 'id', 'sender__username', 'message', 'file', 'timestamp')
+    )
+
+
+def case_history(case_ids):
+    return (
+        CaseHistory.objects.filter(case_id__in=case_ids)
+        .order_by('case_id', 'timestamp', 'id')
+        .values('case_id', 'id', 'event', 'action', 'changes', 'performed_by__username', 'timestamp')
+    )
+
+
+def message_record(row):
+    return {
+        'id': row['id'],
+        'sender': row['sender__username'],
+        'message': row['message'],
+        'file': row['file'] or None,
+        'timestamp': row['timestamp'],
+    }
+
+
+def history_record(row):
+    return {
+        'id': row['id'],
+        'event': row['event'],
+        'action': row['action'],
+        'changes': row['changes'],
+        'performed_by': row['performed_by__username'],
+        'timestamp': row['timestamp'],
+    }
+
+
+def archived_message_record(record):
+    # The archive resolved the sender as the chat shows them.
+    return {
+        'id': record['id'],
+        'sender': record['sender'],
+        'message': record['message'],
+        'file': record['file'],
+        'timestamp': parse_datetime(record['timestamp']),
+    }
+
+
+def archived_history_record(record):
+    return {
+        'id': record['id'],
+        'event': record['event'],
+        'action': record['action'],
+        'changes': record['changes'],
+        'performed_by': record['performed_by'],
+        'timestamp': parse_datetime(record['timestamp']),
+    }
+
+
+RELATED = {
+    'messages': (case_messages, message_record),
+    'history': (case_history, history_record),
+}
+ARCHIVED = {
+    'messages': ('message', archived_message_record),
+    'history': ('history', archived_history_record),
+}
+
+
+def archived_records(case_ids, include):
+    """{name: {case id: [record]}} of the lists in ``include`` from the archive files of ``case_ids``."""
+    archived = {name: {} for name in include}
+    if not include:
+        return archived
+    kinds = {ARCHIVED[name][0]: name for name in include}
+    for case_id, path in CaseArchive.objects.filter(case_id__in=case_ids).values_list('case_id', 'path'):
+        for record in unique_records(read_records(os.path.join(archive_root(), path))):
+            name = kinds.get(record['kind'])
+            if name is not None:
+                archived[name].setdefault(case_id, []).append(ARCHIVED[name][1](record))
+    return archived
+
+
+def merged(archived, live):
+    """A case's archived and live records by time; a row an interrupted archive run left in both counts once."""
+    if not archived:
+        return live
+    live_ids = {record['id'] for record in live}
+    records = [record for record in archived if record['id'] not in live_ids] + live
+    records.sort(key=lambda record: (record['timestamp'], record['id']))
+    return records
+
+
+def export_records(queryset, include=()):
+    """One dict per case of ``queryset``, with the lists named in ``include``."""
+    for batch in batched(queryset.iterator(chunk_size=CHUNK_SIZE), CHUNK_SIZE):
+        case_ids = [case.pk for case in batch]
+        archived = archived_records(case_ids, include)
+        related = {}
+        for name in include:
+            rows, record = RELATED[name]
+            grouped = groupby(rows(case_ids).iterator(chunk_size=CHUNK_SIZE), key=itemgetter('case_id'))
+            live = {case_id: [record(row) for row in group] for case_id, group in grouped}
+            related[name] = {
+                case_id: merged(archived[name].get(case_id), live.get(case_id, []))
+                for case_id in archived[name].keys() | live.keys()
+            }
+        for case in batch:
+            record = case_record(case)
+            for name in include:
+                record[name] = related[name].get(case.pk, [])
+            yield record
+
+
+class Echo:
+    """The file-like object csv.writer needs, handing each row back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(records, include=()):
+    writer = csv.writer(Echo())
+    yield writer.writerow([*CASE_FIELDS, *include])
+    for record in records:
+        yield writer.writerow([
+            *(csv_value(record[field]) for field in CASE_FIELDS),
+            *(json.dumps(record[name], cls=DjangoJSONEncoder) for name in include),
+        ])
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    """Join ``lines`` into UTF-8 chunks of about ``size`` bytes."""
+    buffer, length = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(queryset, format='csv', include=(), compress=False):
+    """The export of ``queryset`` as an iterator of bytes."""
+    records = export_records(queryset, include)
+    lines = csv_lines(records, include) if format == 'csv' else jsonl_lines(records)
+    chunks = buffered(lines)
+    return gzipped(chunks) if compress else chunks
+
+
+def export_filename(format, compress=False):
+    extension = FORMATS[format][1] + ('.gz' if compress else '')
+    return f'cases-{timezone.localdate():%Y%m%d}.{extension}'
@@ -1,6 +1,8 @@
 from django import forms
 from .models import Case, CaseMessage
 from django.contrib.auth import get_user_model
+from .export import export_queryset
+from .stats import STATUS_BUCKETS
 
 
 User = get_user_model()
@@ -48,4 +50,33 @@ class CaseMessageForm(forms.ModelForm):
                 'placeholder': 'Type your message...',
                 'class': 'form-control'
             }),
-        }
\ No newline at end of file
+        }
+
+
+class CaseExportForm(forms.Form):
+    """The filters and options of a case export, for the export view and command."""
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSON lines')], required=False)
+    status = forms.MultipleChoiceField(
+        choices=[(status, status) for status in STATUS_BUCKETS.values()], required=False,
+    )
+    handler = forms.ModelChoiceField(queryset=User.objects.filter(groups__name__iexact='handler'), required=False)
+    created_from = forms.DateField(required=False)
+    created_to = forms.DateField(required=False)
+    include = forms.MultipleChoiceField(choices=[('messages', 'Messages'), ('history', 'History')], required=False)
+    gzip = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        start, end = cleaned_data.get('created_from'), cleaned_data.get('created_to')
+        if start and end and start > end:
+            raise forms.ValidationError("The start date must be on or before the end date.")
+        return cleaned_data
+
+    def queryset(self):
+        return export_queryset(
+            statuses=self.cleaned_data['status'],
+            handler=self.cleaned_data['handler'],
+            created_from=self.cleaned_data['created_from'],
+            created_to=self.cleaned_data['created_to'],
+        )
@@ -0,0 +1,358 @@
+"""
+Bulk import of serialized data: like ``loaddata``, but without saving the
+objects one at a time.
+
+The input is Django's JSON serialization, either a JSON array (what
+``dumpdata`` writes, e.g. data.json) or one object per line, optionally
+gzipped. An incremental parser reads it a block at a time and spools each
+record to a temporary file for its model. The models are then inserted in
+foreign key order, BATCH_SIZE objects per bulk_create and per transaction.
+A checkpoint file is written after every batch, so an interrupted import
+resumes where it stopped instead of starting over.
+
+Older dumps carry django-simple-history's cases.historicalcase snapshots.
+That model is gone, but its records are folded into the imported audit
+trail as migration 0018 folded the table (audit.fold_snapshots()), so the
+imported cases keep their structured transitions. They're spooled into
+SNAPSHOT_BUCKETS files by case, so folding holds one bucket in memory at a
+time. Records of other models that no longer exist are skipped.
+
+Bulk inserts skip Case.save(), so the counter and rollup tables and the
+search index are rebuilt at the end. The primary key sequences are also
+reset, like loaddata does.
+"""
+import gzip
+import json
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Deserializer
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .audit import fold_snapshots
+from .counters import rebuild_counters
+from .models import Case, CaseHistory
+from .rollups import rebuild_rollups
+from .search import index_cases
+from .utils import batched, generated_timestamps
+
+
+BATCH_SIZE = 1000
+READ_SIZE = 64 * 1024
+SNAPSHOTS = 'cases.historicalcase'
+SNAPSHOT_BUCKETS = 64
+
+
+class InvalidImport(Exception):
+    pass
+
+
+def open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def iter_records(stream, read_size=READ_SIZE):
+    """
+    The objects of a JSON array or of whitespace-separated JSON objects
+    (JSON lines), parsed as they're read, ``read_size`` characters at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    in_array = None
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    while True:
+        # Skip the separators between records.
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                if buffer[position] == ',' and not in_array:
+                    raise InvalidImport("Unexpected ',' between records.")
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            fill()
+        if position == len(buffer):
+            if in_array:
+                raise InvalidImport("The JSON array isn't closed.")
+            return
+        if in_array is None:
+            in_array = buffer[position] == '['
+            if in_array:
+                position += 1
+                continue
+        if in_array and buffer[position] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            # Most likely the record continues in the next block.
+            if eof:
+                raise InvalidImport(f"Invalid JSON: {error}") from None
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # A number or literal can't tell where it ends until it sees what follows.
+            fill()
+            continue
+        position = end
+        yield record
+
+
+def dependencies(model):
+    """The other models ``model``'s rows point to."""
+    related = {
+        field.related_model
+        for field in model._meta.get_fields()
+        if (field.many_to_one or field.one_to_one or field.many_to_many)
+        and field.concrete and field.related_model is not None
+    }
+    related.discard(model)
+    return related
+
+
+def insert_order(models):
+    """``models`` sorted so every model comes after the ones it points to."""
+    ordered, visiting = [], set()
+
+    def visit(model):
+        if model in ordered:
+            return
+        if model in visiting:
+            raise InvalidImport(f"Circular foreign keys through {model._meta.label}.")
+        visiting.add(model)
+        for dependency in sorted(dependencies(model) & models, key=lambda model: model._meta.label):
+            visit(dependency)
+        visiting.discard(model)
+        ordered.append(model)
+
+    for model in sorted(models, key=lambda model: model._meta.label):
+        visit(model)
+    return ordered
+
+
+def model_for(label):
+    try:
+        return apps.get_model(label)
+    except (LookupError, ValueError):
+        return None
+
+
+def excluded(model, exclude):
+    return model._meta.app_label in exclude or model._meta.label_lower in exclude
+
+
+class Checkpoint:
+    """
+    How far an import got: the models it finished and how many records of
+    the current one it inserted, saved atomically after every batch.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.finished = []
+        self.model = None
+        self.done = 0
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as checkpoint:
+                state = json.load(checkpoint)
+        except FileNotFoundError:
+            return False
+        if state['source'] != self.source:
+            raise InvalidImport(f"The checkpoint {self.path} belongs to an import of {state['source']}.")
+        self.finished, self.model, self.done = state['finished'], state['model'], state['done']
+        return True
+
+    def skip(self, label):
+        """How many records of ``label`` the interrupted run inserted; None if all of them."""
+        if label in self.finished:
+            return None
+        return self.done if label == self.model else 0
+
+    def save(self, label, done=None):
+        if done is None:
+            self.finished.append(label)
+            self.model, self.done = None, 0
+        else:
+            self.model, self.done = label, done
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as checkpoint:
+            json.dump(
+                {'source': self.source, 'finished': self.finished, 'model': self.model, 'done': self.done},
+                checkpoint,
+            )
+        os.replace(temporary, self.path)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Importer:
+    """
+    Import ``path`` in batches of ``batch_size``; see the module docstring.
+    Models or apps in ``exclude`` (``'app'`` or ``'app.model'``) are left
+    out. With ``resume``, the run continues from ``checkpoint`` (default
+    ``<path>.checkpoint``). With ``ignore_conflicts``, rows whose keys
+    already exist are skipped instead of failing the import.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, exclude=(), checkpoint=None, resume=False,
+                 ignore_conflicts=False, log=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.exclude = {label.lower() for label in exclude}
+        self.checkpoint = Checkpoint(checkpoint or f'{path}.checkpoint', path)
+        self.resume = resume
+        self.ignore_conflicts = ignore_conflicts
+        self.log = log or (lambda message: None)
+        self.counts = {}
+        self.skipped = {}
+
+    def run(self):
+        if self.resume and self.checkpoint.load():
+            self.log(f"Resuming after {len(self.checkpoint.finished)} model(s) from {self.checkpoint.path}")
+        with tempfile.TemporaryDirectory() as spool_dir:
+            spools = self.spool(spool_dir)
+            models = insert_order(set(spools) - {SNAPSHOTS})
+            with generated_timestamps(models):
+                for model in models:
+                    self.insert(model, spools[model])
+            if SNAPSHOTS in spools:
+                self.fold_snapshots(spools[SNAPSHOTS])
+        self.reset_sequences(models)
+        if Case in models:
+            rebuild_counters()
+            rebuild_rollups()
+            index_cases()
+        self.checkpoint.delete()
+        return self.counts
+
+    def spool(self, directory):
+        """Split the input into one JSON lines file per model; returns {model: path}."""
+        files, spools = {}, {}
+        try:
+            with open_input(self.path) as stream:
+                for record in iter_records(stream):
+                    label = record.get('model', '') if isinstance(record, dict) else ''
+                    if label == SNAPSHOTS and SNAPSHOTS not in self.exclude and 'cases' not in self.exclude:
+                        if SNAPSHOTS not in spools:
+                            spools[SNAPSHOTS] = [
+                                os.path.join(directory, f'{SNAPSHOTS}.{bucket}.jsonl')
+                                for bucket in range(SNAPSHOT_BUCKETS)
+                            ]
+                            files.update({path: open(path, 'w', encoding='utf-8') for path in spools[SNAPSHOTS]})
+                        bucket = spools[SNAPSHOTS][int(record['fields']['id']) % SNAPSHOT_BUCKETS]
+                        files[bucket].write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+                        continue
+                    model = model_for(label)
+                    if model is None or excluded(model, self.exclude):
+                        self.skipped[label] = self.skipped.get(label, 0) + 1
+                        continue
+                    if model not in files:
+                        spools[model] = os.path.join(directory, f'{model._meta.label_lower}.jsonl')
+                        files[model] = open(spools[model], 'w', encoding='utf-8')
+                    files[model].write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        finally:
+            for spool in files.values():
+                spool.close()
+        return spools
+
+    def spooled(self, path, skip):
+        with open(path, encoding='utf-8') as spool:
+            for number, line in enumerate(spool):
+                if number >= skip:
+                    yield json.loads(line)
+
+    def insert(self, model, path):
+        label = model._meta.label_lower
+        skip = self.checkpoint.skip(label)
+        if skip is None:
+            return
+        done = skip
+        objects = Deserializer(self.spooled(path, skip), ignorenonexistent=True)
+        for number, batch in enumerate(batched(objects, self.batch_size)):
+            with transaction.atomic():
+                # A batch the interrupted run committed but couldn't checkpoint
+                # would otherwise fail on its own primary keys.
+                self.insert_batch(model, batch, self.ignore_conflicts or (number == 0 and skip > 0))
+            done += len(batch)
+            self.counts[label] = self.counts.get(label, 0) + len(batch)
+            self.checkpoint.save(label, done)
+            self.log(f"{label}: {done}")
+        self.checkpoint.save(label)
+
+    def fold_snapshots(self, buckets):
+        """Turn the spooled HistoricalCase snapshots into audit trail rows, a bucket of cases at a time."""
+        skip = self.checkpoint.skip(SNAPSHOTS)
+        if skip is None:
+            return
+        for number, path in enumerate(buckets[skip:], start=skip):
+            snapshots = {}
+            for record in self.spooled(path, 0):
+                fields = record['fields']
+                snapshots.setdefault(int(fields['id']), []).append(dict(
+                    fields,
+                    history_id=record.get('pk'),
+                    history_date=parse_datetime(fields['history_date']),
+                    history_user_id=fields.get('history_user'),
+                ))
+            with transaction.atomic():
+                entries = {}
+                for entry in CaseHistory.objects.filter(case_id__in=snapshots, changes={}).order_by('timestamp', 'id'):
+                    entries.setdefault(entry.case_id, []).append(entry)
+                user_ids = {snapshot.get('assigned_to') for records in snapshots.values() for snapshot in records}
+                usernames = dict(get_user_model().objects.filter(pk__in=user_ids - {None}).values_list('pk', 'username'))
+                matched, created = [], []
+                for case_id, records in snapshots.items():
+                    records.sort(key=lambda snapshot: (snapshot['history_date'], snapshot['history_id']))
+                    updated, new = fold_snapshots(case_id, records, entries.get(case_id, []), usernames)
+                    matched += updated
+                    created += new
+                CaseHistory.objects.bulk_update(matched, ['event', 'changes', 'performed_by'], batch_size=self.batch_size)
+                CaseHistory.objects.bulk_create(created, batch_size=self.batch_size)
+                self.counts[SNAPSHOTS] = self.counts.get(SNAPSHOTS, 0) + len(matched) + len(created)
+            self.checkpoint.save(SNAPSHOTS, number + 1)
+        CaseHistory.objects.filter(event=CaseHistory.NOTE, action__startswith='A file uploaded').update(
+            event=CaseHistory.FILE,
+        )
+        self.checkpoint.save(SNAPSHOTS)
+        self.log(f"{SNAPSHOTS}: folded into the audit trail")
+
+    def insert_batch(self, model, batch, ignore_conflicts):
+        model.objects.bulk_create(
+            [deserialized.object for deserialized in batch],
+            ignore_conflicts=ignore_conflicts,
+        )
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            if not through._meta.auto_created:
+                continue
+            source = field.m2m_field_name() + '_id'
+            target = field.m2m_reverse_field_name() + '_id'
+            rows = [
+                through(**{source: deserialized.object.pk, target: related_id})
+                for deserialized in batch
+                for related_id in (deserialized.m2m_data or {}).get(field.name, [])
+            ]
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def reset_sequences(self, models):
+        with connection.cursor() as cursor:
+            for line in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(line)
@@ -0,0 +1,200 @@
+"""
+Synthetic data at production volumes, for benchmarks and query plans.
+
+Rows are written with bulk_create in batches and generated lazily, so
+millions of cases take batch-sized memory. Bulk inserts skip Case.save(),
+so the counter and rollup tables and the search index are rebuilt at the end.
+"""
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import rebuild_counters
+from .models import Case, CaseHistory, CaseMessage
+from .rollups import rebuild_rollups
+from .search import index_cases
+from .stats import STATUS_BUCKETS
+from .utils import batched, generated_timestamps
+
+
+STATUSES = list(STATUS_BUCKETS.values())
+UNASSIGNED_STATUSES = ('Pending', 'Approved')
+
+# The order a case moves through its states, for its history.
+LIFECYCLE = ['Pending', 'Approved', 'Assigned', 'In Progress', 'Waiting for Info', 'Resolved', 'Closed']
+
+WORDS = (
+    'theft vandalism harassment fraud assault burglary noise dispute parking '
+    'market station road block street office campus park night morning evening '
+    'reported witnessed suspect vehicle phone wallet window door camera neighbour'
+).split()
+
+LOCATIONS = ['Lahore', 'Karachi', 'Islamabad', 'Peshawar', 'Quetta', 'Multan', 'Faisalabad', 'Sialkot']
+
+
+class LoadGenerator:
+    """
+    Generate ``users`` reporting users, ``handlers`` handlers and ``cases``
+    cases spread over the last ``days`` days, each with
+    ``messages_per_case`` chat messages and up to ``history_per_case``
+    audit trail entries. Usernames start with ``prefix`` so generated data
+    can be told apart and removed.
+    """
+
+    def __init__(self, users=1000, handlers=50, cases=10000, messages_per_case=4,
+                 history_per_case=3, days=365, batch_size=1000, seed=0,
+                 prefix='load', password='loadtest', log=None):
+        self.users = users
+        self.handlers = handlers
+        self.cases = cases
+        self.messages_per_case = messages_per_case
+        self.history_per_case = history_per_case
+        self.days = days
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.password = password
+        self.password_hash = None
+        self.rng = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def run(self):
+        user_ids = self.create_users('user', self.users)
+        handler_ids = self.create_users('handler', self.handlers)
+        if not user_ids:
+            user_ids = list(get_user_model().objects.filter(role='user').values_list('pk', flat=True))
+        if not handler_ids:
+            handler_ids = list(
+                get_user_model().objects.filter(groups__name='handler').values_list('pk', flat=True)
+            )
+        if self.cases and not user_ids:
+            raise ValueError("Cases need at least one user to report them.")
+
+        created = 0
+        for batch in batched(range(self.cases), self.batch_size):
+            with transaction.atomic():
+                self.create_cases(batch, user_ids, handler_ids)
+            created += len(batch)
+            self.log(f"{created}/{self.cases} cases")
+
+        self.log("Rebuilding counters, rollups and search index")
+        rebuild_counters()
+        rebuild_rollups()
+        index_cases()
+
+    def create_users(self, role, count):
+        User = get_user_model()
+        if not count:
+            return []
+        # Hash once; every generated account shares the password.
+        if self.password_hash is None:
+            self.password_hash = make_password(self.password)
+        start = User.objects.filter(username__startswith=f'{self.prefix}_{role}').count()
+        ids = []
+        for batch in batched(range(start, start + count), self.batch_size):
+            with transaction.atomic():
+                people = User.objects.bulk_create(
+                    User(
+                        username=f'{self.prefix}_{role}{i}',
+                        email=f'{self.prefix}_{role}{i}@example.com',
+                        password=self.password_hash,
+                        role=role,
+                    )
+                    for i in batch
+                )
+                if role == 'handler':
+                    group, _ = Group.objects.get_or_create(name='handler')
+                    User.groups.through.objects.bulk_create(
+                        User.groups.through(customuser_id=person.pk, group_id=group.pk) for person in people
+                    )
+            ids.extend(person.pk for person in people)
+            self.log(f"{len(ids)}/{count} {role}s")
+        return ids
+
+    def sentence(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).capitalize()
+
+    def timeline(self, created_at, steps):
+        """``steps`` increasing timestamps from ``created_at`` up to now."""
+        span = (self.now - created_at).total_seconds()
+        return sorted(
+            created_at + datetime.timedelta(seconds=self.rng.uniform(0, span))
+            for _ in range(steps)
+        )
+
+    def create_cases(self, batch, user_ids, handler_ids):
+        rng = self.rng
+        cases = []
+        for i in batch:
+            status = rng.choice(STATUSES)
+            created_at = self.now - datetime.timedelta(seconds=rng.uniform(0, self.days * 86400))
+            assigned = status not in UNASSIGNED_STATUSES and handler_ids
+            cases.append(Case(
+                title=self.sentence(4),
+                description=self.sentence(30),
+                location=rng.choice(LOCATIONS),
+                incident_date=(created_at - datetime.timedelta(days=rng.randint(0, 10))).date(),
+                is_anonymous=rng.random() < 0.1,
+                status=status,
+                created_by_id=rng.choice(user_ids),
+                assigned_to_id=rng.choice(handler_ids) if assigned else None,
+                created_at=created_at,
+                updated_at=self.timeline(created_at, 1)[0],
+            ))
+
+        messages, history = [], []
+        with generated_timestamps((Case, CaseMessage, CaseHistory)):
+            cases = Case.objects.bulk_create(cases)
+            for case in cases:
+                messages.extend(self.case_messages(case))
+                history.extend(self.case_history(case))
+            CaseMessage.objects.bulk_create(messages, batch_size=self.batch_size)
+            CaseHistory.objects.bulk_create(history, batch_size=self.batch_size)
+
+    def case_messages(self, case):
+        participants = [case.created_by_id] + ([case.assigned_to_id] if case.assigned_to_id else [])
+        for timestamp in self.timeline(case.created_at, self.messages_per_case):
+            yield CaseMessage(
+                case=case,
+                sender_id=self.rng.choice(participants),
+                message=self.sentence(self.rng.randint(3, 25)),
+                timestamp=timestamp,
+            )
+
+    def case_history(self, case):
+        """Audit trail entries for the states a case went through."""
+        reached = LIFECYCLE[:LIFECYCLE.index(case.status) + 1][-self.history_per_case:]
+        timestamps = [case.created_at] + self.timeline(case.created_at, len(reached) - 1)
+        records = []
+        previous = {}
+        for status, timestamp in zip(reached, timestamps):
+            state = {
+                'status': status,
+                'assigned_to': case.assigned_to_id if status not in UNASSIGNED_STATUSES else None,
+            }
+            changes = {
+                field: [previous.get(field), value]
+                for field, value in state.items()
+                if previous.get(field) != value
+            }
+            if not previous:
+                event, action = CaseHistory.CREATED, 'Case Registered'
+            elif 'assigned_to' in changes:
+                event, action = CaseHistory.ASSIGNMENT, 'Case assigned'
+            else:
+                event, action = CaseHistory.TRANSITION, f"Status updated to '{status}'"
+            records.append(CaseHistory(
+                case=case,
+                event=event,
+                changes=changes,
+                action=action,
+                performed_by_id=case.created_by_id if status == 'Pending' else case.assigned_to_id,
+                timestamp=timestamp,
+            ))
+            previous = state
+        return records
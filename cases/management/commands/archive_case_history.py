@@ -0,0 +1,39 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.archive import ARCHIVE_AFTER_DAYS, archivable_cases, archive_cases, archive_root
+from cases.partitions import PARTITIONED, ensure_partitions, supported
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the history and chat of cases closed for a long time into gzip JSON lines "
+        "files under MEDIA_ROOT; the case page loads them on demand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=ARCHIVE_AFTER_DAYS,
+            help="Archive cases closed more than this many days ago.",
+        )
+        parser.add_argument('--limit', type=int, help="Archive at most this many cases.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the cases that would be archived.")
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError("--days can't be negative.")
+        if options['dry_run']:
+            count = archivable_cases(options['days']).count()
+            self.stdout.write(f"{count} case(s) would be archived.")
+            return
+        cases, rows = archive_cases(
+            days=options['days'],
+            limit=options['limit'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {rows} row(s) of {cases} case(s) to {archive_root()}."))
+        if supported():
+            # Keep the coming months' partitions there even if partition_case_tables isn't scheduled.
+            for label in PARTITIONED:
+                for name in ensure_partitions(apps.get_model(label)):
+                    self.stdout.write(f"Created {name}")
@@ -0,0 +1,51 @@
+from django.core.serializers.base import DeserializationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from cases.importer import BATCH_SIZE, Importer, InvalidImport
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a dumpdata JSON array or JSON lines file, optionally gzipped, with batched "
+        "bulk inserts in foreign key order. Interrupted imports can be resumed with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to import, e.g. data.json or export.jsonl.gz.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Objects per insert and transaction.")
+        parser.add_argument(
+            '--exclude', '-e', action='append', default=[], metavar='APP_LABEL[.ModelName]',
+            help="Leave out an app or model; repeat for several.",
+        )
+        parser.add_argument('--checkpoint', help="Where to record progress; <path>.checkpoint by default.")
+        parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint of an interrupted run.")
+        parser.add_argument(
+            '--ignore-conflicts', action='store_true',
+            help="Skip rows whose keys already exist instead of failing.",
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        importer = Importer(
+            options['path'],
+            batch_size=options['batch_size'],
+            exclude=options['exclude'],
+            checkpoint=options['checkpoint'],
+            resume=options['resume'],
+            ignore_conflicts=options['ignore_conflicts'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        try:
+            counts = importer.run()
+        except FileNotFoundError as error:
+            raise CommandError(error)
+        except (InvalidImport, DeserializationError, DatabaseError) as error:
+            raise CommandError(f"{error}\nFix the input and rerun with --resume to continue.")
+
+        for label, count in counts.items():
+            self.stdout.write(f"{label}: {count}")
+        for label, count in importer.skipped.items():
+            self.stdout.write(f"Skipped {count} record(s) of {label or 'unknown models'}.")
+        self.stdout.write(self.style.SUCCESS(f"Imported {sum(counts.values())} object(s)."))
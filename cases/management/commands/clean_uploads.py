@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from cases.uploads import STALE_AFTER_HOURS, clean_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads nobody has sent a chunk to for a while, with their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=STALE_AFTER_HOURS,
+            help="Delete uploads untouched for this many hours.",
+        )
+
+    def handle(self, *args, **options):
+        count = clean_stale_uploads(options['hours'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} stale upload(s)."))
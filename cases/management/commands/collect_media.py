@@ -0,0 +1,31 @@
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.storage import DEDUP_DIRS, DedupStorage, collect_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the files under " + " and ".join(DEDUP_DIRS) + " that no case or chat message "
+        "refers to any more, releasing their blobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only list them.")
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help="Skip files saved in the last this many seconds (default: 3600).",
+        )
+
+    def handle(self, *args, **options):
+        storage = storages['default']
+        if not isinstance(storage, DedupStorage):
+            raise CommandError("The default storage isn't cases.storage.DedupStorage; see STORAGES.")
+        count = collect_media(
+            storage,
+            min_age=options['min_age'],
+            dry_run=options['dry_run'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {count} unreferenced file(s)."))
@@ -0,0 +1,28 @@
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.storage import DEDUP_DIRS, DedupStorage, dedup_tree
+
+
+class Command(BaseCommand):
+    help = (
+        "Store each distinct file under " + " and ".join(DEDUP_DIRS) + " once, replacing the "
+        "copies with hard links in place, and repair the blob reference counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count the duplicates.")
+
+    def handle(self, *args, **options):
+        storage = storages['default']
+        if not isinstance(storage, DedupStorage):
+            raise CommandError("The default storage isn't cases.storage.DedupStorage; see STORAGES.")
+        stats = dedup_tree(
+            storage,
+            dry_run=options['dry_run'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        verb = "would free" if options['dry_run'] else "freed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['files']} file(s), {stats['duplicates']} duplicate(s); {verb} {stats['bytes_saved']} bytes."
+        ))
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.query_plans import compare_plans
+
+
+class Command(BaseCommand):
+    help = (
+        "Explain and time the hot case queries with and without the case indexes, "
+        "to check the plans move from table scans to index scans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Timed runs per query; the median is reported.")
+        parser.add_argument('--no-analyze', action='store_true', help="Don't refresh planner statistics first.")
+        parser.add_argument('--output', help="Also write the plans and timings to this JSON file.")
+        parser.add_argument('--plans', action='store_true', help="Print the full plans.")
+
+    def handle(self, *args, **options):
+        try:
+            results = compare_plans(runs=max(1, options['runs']), analyze=not options['no_analyze'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        regressions = []
+        for name, result in results.items():
+            before, after = result['before'], result['after']
+            self.stdout.write(
+                f"{name:<24} {before['median_ms']:>9.2f} ms -> {after['median_ms']:>9.2f} ms  "
+                f"{before['shape']:>8} -> {after['shape']}"
+            )
+            if options['plans']:
+                self.stdout.write(f"  before:\n{before['plan']}\n  after:\n{after['plan']}")
+            if after['shape'] != 'index':
+                regressions.append(name)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write('\n')
+
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"Not served by an index alone: {', '.join(regressions)}."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every query is served by an index."))
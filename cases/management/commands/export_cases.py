@@ -0,0 +1,55 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.export import FORMATS, INCLUDES, export_stream
+from cases.forms import CaseExportForm
+from cases.models import Case
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream cases, optionally with their messages and history, to a CSV or JSON lines "
+        "file without loading them into memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument(
+            '--status', action='append', default=[], choices=[value for value, label in Case.STATUS_CHOICES],
+            help="Only cases with this status; repeat for several.",
+        )
+        parser.add_argument('--handler', type=int, help="Only cases assigned to the handler with this user id.")
+        parser.add_argument('--from', dest='created_from', metavar='YYYY-MM-DD', help="Only cases registered on or after this day.")
+        parser.add_argument('--to', dest='created_to', metavar='YYYY-MM-DD', help="Only cases registered on or before this day.")
+        parser.add_argument(
+            '--include', action='append', default=[], choices=INCLUDES,
+            help="Add each case's messages or history; repeat for both.",
+        )
+        parser.add_argument('--gzip', action='store_true', help="Compress the output.")
+        parser.add_argument('--output', '-o', help="File to write; standard output by default.")
+
+    def handle(self, *args, **options):
+        form = CaseExportForm({
+            'format': options['format'],
+            'status': options['status'],
+            'handler': options['handler'],
+            'created_from': options['created_from'],
+            'created_to': options['created_to'],
+            'include': options['include'],
+            'gzip': options['gzip'],
+        })
+        if not form.is_valid():
+            raise CommandError("; ".join(
+                f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()
+            ))
+        chunks = export_stream(form.queryset(), form.cleaned_data['format'], form.cleaned_data['include'], options['gzip'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stderr.write(self.style.SUCCESS(f"Exported to {options['output']}."))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.loadgen import LoadGenerator
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic users, handlers, cases, messages and history for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Reporting users to create.")
+        parser.add_argument('--handlers', type=int, default=50, help="Handlers to create.")
+        parser.add_argument('--cases', type=int, default=10000, help="Cases to create.")
+        parser.add_argument('--messages-per-case', type=int, default=4)
+        parser.add_argument('--history-per-case', type=int, default=3)
+        parser.add_argument('--days', type=int, default=365, help="Spread the cases over this many past days.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per INSERT.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible data sets.")
+        parser.add_argument('--prefix', default='load', help="Prefix of the generated usernames.")
+        parser.add_argument('--password', default='loadtest', help="Password of every generated account.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        generator = LoadGenerator(
+            users=options['users'],
+            handlers=options['handlers'],
+            cases=options['cases'],
+            messages_per_case=options['messages_per_case'],
+            history_per_case=options['history_per_case'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            password=options['password'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        try:
+            generator.run()
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['users']} users, {options['handlers']} handlers and {options['cases']} cases."
+        ))
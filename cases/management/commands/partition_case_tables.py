@@ -0,0 +1,40 @@
+import datetime
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from cases.partitions import MONTHS_AHEAD, PARTITIONED, drop_empty_partitions, ensure_partitions, supported
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the coming monthly partitions of the case history and message tables, "
+        "and optionally drop old ones the archive has emptied. PostgreSQL only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=MONTHS_AHEAD,
+            help="Create partitions this many months ahead.",
+        )
+        parser.add_argument(
+            '--drop-empty-before', metavar='YYYY-MM-DD', type=datetime.date.fromisoformat,
+            help="Drop empty partitions of months before this date.",
+        )
+
+    def handle(self, *args, **options):
+        if not supported():
+            self.stdout.write(f"{connection.vendor} tables aren't partitioned; nothing to do.")
+            return
+        if options['months'] < 0:
+            raise CommandError("--months can't be negative.")
+        until = datetime.date.today() + datetime.timedelta(days=31 * options['months'])
+        for label in PARTITIONED:
+            model = apps.get_model(label)
+            for name in ensure_partitions(model, until):
+                self.stdout.write(f"Created {name}")
+            if options['drop_empty_before']:
+                for name in drop_empty_partitions(model, options['drop_empty_before']):
+                    self.stdout.write(f"Dropped {name}")
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.counters import rebuild_counters, verify_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the case status counter table from the cases table and verify it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help="Only compare the counters with the cases table, don't rewrite them.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            rebuild_counters()
+            self.stdout.write("Counter table rebuilt.")
+
+        mismatches = verify_counters()
+        for (scope, owner_id, status), (stored, expected) in sorted(mismatches.items()):
+            self.stderr.write(f"{scope}:{owner_id} '{status}': stored {stored}, expected {expected}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} counter(s) out of sync with the cases table.")
+        self.stdout.write(self.style.SUCCESS("Counters match the cases table."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from cases.search import get_search_backend, index_cases
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search document of every case."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        index_cases()
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({type(backend).__name__})."))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cases.benchmark import SCENARIOS, BenchmarkRunner, write_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the main pages and write p50/p95/p99 latency, queries per request "
+        "and peak memory to a JSON file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per scenario first.")
+        parser.add_argument('--output', default='benchmark.json', help="Where to write the results.")
+        parser.add_argument(
+            '--base-url',
+            help="Benchmark a running server, e.g. http://127.0.0.1:8000, instead of the test client.",
+        )
+        parser.add_argument('--read-only', action='store_true', help="Skip the scenarios that write.")
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios', choices=[s.name for s in SCENARIOS],
+            help="Only run this scenario; may be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1.")
+        runner = BenchmarkRunner(
+            requests=options['requests'],
+            warmup=options['warmup'],
+            base_url=options['base_url'],
+            include_writes=not options['read_only'],
+            only=options['scenarios'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        try:
+            results = runner.run()
+        except ValueError as error:
+            raise CommandError(error)
+        write_results(results, options['output'])
+
+        for name, result in results['scenarios'].items():
+            latency = result['latency_ms']
+            queries = result['queries']
+            self.stdout.write(
+                f"{name:<24} p50 {latency['p50']:>8.2f} ms  p95 {latency['p95']:>8.2f} ms  "
+                f"p99 {latency['p99']:>8.2f} ms"
+                + (f"  {queries['max']:>4.0f} queries" if queries else "")
+            )
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
@@ -0,0 +1,115 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connections
+
+logger = logging.getLogger('cases.tasks')
+
+# How often a worker looks for tasks whose worker died, in seconds.
+REQUEUE_EVERY = 60
+
+
+def run_in_thread(task):
+    from cases.tasks import run_task
+
+    # Each thread has its own connection; drop it if it broke or aged out.
+    close_old_connections()
+    try:
+        return run_task(task)
+    finally:
+        close_old_connections()
+
+
+def work(threads, poll, once, stop):
+    """Claim and run tasks, ``threads`` at a time, until ``stop`` is set (or the queue is empty, with ``once``)."""
+    from cases.tasks import claim, requeue_lost, run_task, worker_name
+
+    worker = worker_name()
+    requeued_at = 0
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while not stop.is_set():
+            try:
+                if time.monotonic() - requeued_at > REQUEUE_EVERY:
+                    requeue_lost()
+                    requeued_at = time.monotonic()
+                claimed = claim(worker, threads)
+            except DatabaseError:
+                # E.g. the database restarting; keep polling.
+                logger.exception("Claiming tasks failed")
+                close_old_connections()
+                stop.wait(poll)
+                continue
+            if not claimed:
+                if once:
+                    break
+                close_old_connections()
+                stop.wait(poll)
+                continue
+            if threads == 1:
+                run_task(claimed[0])
+            else:
+                list(pool.map(run_in_thread, claimed))
+    connections.close_all()
+
+
+def work_process(threads, poll, once, stop):
+    # Spawned processes start without Django; forked ones have it already.
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    work(threads, poll, once, stop)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background tasks (cases.tasks) until stopped, in --processes "
+        "processes of --threads threads each. SIGTERM or Ctrl-C stops after the running tasks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes.")
+        parser.add_argument('--threads', type=int, default=1, help="Tasks each process runs at once.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once no task is due.")
+        parser.add_argument(
+            '--purge-days', type=int,
+            help="First delete tasks that succeeded more than this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        from cases.tasks import purge_finished
+
+        processes, threads = options['processes'], options['threads']
+        if processes < 1 or threads < 1:
+            raise CommandError("--processes and --threads must be at least 1.")
+        if options['purge_days'] is not None:
+            self.stdout.write(f"Deleted {purge_finished(options['purge_days'])} finished task(s).")
+
+        if processes == 1:
+            stop = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: stop.set())
+            work(threads, options['poll'], options['once'], stop)
+        else:
+            stop = multiprocessing.Event()
+            # Children mustn't inherit this process's connections.
+            connections.close_all()
+            children = [
+                multiprocessing.Process(
+                    target=work_process, args=(threads, options['poll'], options['once'], stop), daemon=True,
+                )
+                for _ in range(processes)
+            ]
+            for child in children:
+                child.start()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: stop.set())
+            for child in children:
+                child.join()
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
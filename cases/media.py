@@ -0,0 +1,183 @@
+"""
+Access-controlled serving of uploaded media.
+
+Every URL under MEDIA_URL goes through cases.views.protected_media, which
+checks the request against the file's owner before anything is sent:
+
+- case_files/ and reports/: evidence and reports, for the case's
+  participants (cases.access: its reporter, its handler and superusers);
+- chat_files/: chat attachments, for the participants of the message's
+  case, archived messages included (ArchivedAttachment);
+- profile_images/ and thumbnails/: any signed-in user.
+
+Everything else under MEDIA_ROOT (blobs, partial uploads, archives) is
+never served. A file the user may not see is a 404, like a missing one.
+
+The bytes are best left to the front-end server: with CASE_MEDIA_SENDFILE
+set to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd), the
+response is only a header naming the file, and the server streams it,
+ranges and all. Without one, file_response() serves it from Django with
+ETag/Last-Modified validation and single Range requests (If-Range
+respected), so evidence videos can still be seeked.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .access import is_participant
+from .models import ArchivedAttachment, Case, CaseMessage
+
+
+PUBLIC_DIRS = ('profile_images/', 'thumbnails/')
+SENDFILE_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def sendfile_backend():
+    backend = getattr(settings, 'CASE_MEDIA_SENDFILE', None)
+    if backend and backend not in SENDFILE_HEADERS:
+        raise ValueError(f"CASE_MEDIA_SENDFILE must be one of {', '.join(SENDFILE_HEADERS)}, not {backend!r}.")
+    return backend
+
+
+def accel_prefix():
+    """The internal nginx location that aliases MEDIA_ROOT."""
+    return getattr(settings, 'CASE_MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+
+def case_members(name):
+    """
+    [(created_by_id, assigned_to_id)] of the cases ``name`` belongs to; None
+    if it isn't case media. Each lookup is on an indexed name column.
+    """
+    if name.startswith('case_files/'):
+        return list(Case.objects.filter(uploaded_file=name).values_list('created_by_id', 'assigned_to_id'))
+    if name.startswith('reports/'):
+        return list(Case.objects.filter(report_file=name).values_list('created_by_id', 'assigned_to_id'))
+    if name.startswith('chat_files/'):
+        members = ('case__created_by_id', 'case__assigned_to_id')
+        live = CaseMessage.objects.filter(file=name).values_list(*members)
+        return list(live.union(ArchivedAttachment.objects.filter(name=name).values_list(*members)))
+    return None
+
+
+def can_view(user, name):
+    if not user.is_authenticated:
+        return False
+    if name.startswith(PUBLIC_DIRS):
+        return True
+    members = case_members(name)
+    return members is not None and any(is_participant(user, *pair) for pair in members)
+
+
+def clean_name(name):
+    """``name`` normalised, or None if it leaves MEDIA_ROOT or names a hidden file."""
+    name = name.replace('\\', '/')
+    parts = name.split('/')
+    if not name or name.startswith('/') or any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+        return None
+    return name
+
+
+def content_type(name):
+    content_type, encoding = mimetypes.guess_type(name)
+    return content_type if content_type and not encoding else 'application/octet-stream'
+
+
+def sendfile_response(name, backend):
+    response = HttpResponse(content_type=content_type(name))
+    if backend == 'x-accel-redirect':
+        response[SENDFILE_HEADERS[backend]] = accel_prefix() + quote(name)
+    else:
+        response[SENDFILE_HEADERS[backend]] = default_storage.path(name)
+    return response
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def requested_range(request, size, etag, last_modified):
+    """
+    The (start, end) byte range, end inclusive, asked for by a Range header
+    this response can honour; None to send the whole file, False if the
+    range is unsatisfiable. Only single ranges are served; anything else
+    gets the whole file, which clients must accept.
+    """
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last N bytes.
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class FileRange:
+    """``length`` bytes of ``file`` from where it's positioned; FileResponse streams it."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, name):
+    path = default_storage.path(name)
+    stat = os.stat(path)
+    etag, last_modified = file_etag(stat), int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = requested_range(request, stat.st_size, etag, last_modified)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif byte_range is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type(name))
+        else:
+            start, end = byte_range
+            file = open(path, 'rb')
+            file.seek(start)
+            response = FileResponse(FileRange(file, end - start + 1), status=206, content_type=content_type(name))
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def serve(request, name):
+    """The response for media ``name`` once can_view() allowed it; None if the file is missing."""
+    if not os.path.isfile(default_storage.path(name)):
+        return None
+    backend = sendfile_backend()
+    response = sendfile_response(name, backend) if backend else file_response(request, name)
+    # Shared caches mustn't hand one user's evidence to the next.
+    patch_cache_control(response, private=True)
+    return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counters(apps, schema_editor):
+    Case = apps.get_model('cases', 'Case')
+    CaseStatusCounter = apps.get_model('cases', 'CaseStatusCounter')
+
+    counters = []
+    per_status = Case.objects.order_by().values('status')
+    for row in per_status.annotate(n=Count('pk')):
+        counters.append(CaseStatusCounter(scope='global', owner_id=0, status=row['status'], count=row['n']))
+    for scope, field in (('handler', 'assigned_to_id'), ('creator', 'created_by_id')):
+        rows = per_status.filter(**{f'{field}__isnull': False}).values(field, 'status').annotate(n=Count('pk'))
+        for row in rows:
+            counters.append(CaseStatusCounter(scope=scope, owner_id=row[field], status=row['status'], count=row['n']))
+    CaseStatusCounter.objects.bulk_create(counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0013_alter_casehistory_case'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaseStatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('global', 'Global'), ('handler', 'Handler'), ('creator', 'Creator')], max_length=10)),
+                ('owner_id', models.BigIntegerField(default=0)),
+                ('status', models.CharField(max_length=50)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scope', 'owner_id', 'status'), name='unique_case_status_counter')],
+            },
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import OperationalError, migrations
+
+
+# The search documents as cases.search builds them, written out here so
+# later changes there don't change what this migration does.
+POSTGRES_INDEX = """
+    UPDATE cases_case AS c SET search_vector =
+        setweight(to_tsvector('simple', coalesce(src.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(src.location, '')), 'B') ||
+        setweight(to_tsvector('simple', cb.username || ' ' || coalesce(au.username, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(src.description, '')), 'C')
+    FROM cases_case AS src
+    JOIN {user_table} AS cb ON cb.id = src.created_by_id
+    LEFT JOIN {user_table} AS au ON au.id = src.assigned_to_id
+    WHERE src.id = c.id
+"""
+SQLITE_INDEX = """
+    INSERT INTO cases_case_fts (rowid, title, description, location, participants)
+    SELECT c.id, c.title, c.description, coalesce(c.location, ''),
+           cb.username || ' ' || coalesce(au.username, '')
+    FROM cases_case AS c
+    JOIN {user_table} AS cb ON cb.id = c.created_by_id
+    LEFT JOIN {user_table} AS au ON au.id = c.assigned_to_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE cases_case ADD COLUMN search_vector tsvector')
+        schema_editor.execute('CREATE INDEX cases_case_search_vector_gin ON cases_case USING GIN (search_vector)')
+    elif connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE cases_case_fts USING fts5("
+                    "title, description, location, participants, "
+                    "tokenize = 'unicode61 remove_diacritics 2')"
+                )
+        except OperationalError:
+            # SQLite built without FTS5: search falls back to icontains.
+            return
+    else:
+        return
+
+    user_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    sql = POSTGRES_INDEX if connection.vendor == 'postgresql' else SQLITE_INDEX
+    schema_editor.execute(sql.format(user_table=schema_editor.quote_name(user_table)))
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS cases_case_search_vector_gin')
+        schema_editor.execute('ALTER TABLE cases_case DROP COLUMN IF EXISTS search_vector')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS cases_case_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0014_casestatuscounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import migrations, models
+
+from cases.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('cases', '0015_case_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['-updated_at', '-id'], name='case_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['status', '-updated_at', '-id'], name='case_status_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['assigned_to', 'status', '-updated_at', '-id'], name='case_handler_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['assigned_to', '-updated_at', '-id'], name='case_handler_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['created_by', 'status', '-updated_at', '-id'], name='case_creator_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['created_by', '-updated_at', '-id'], name='case_creator_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(
+                condition=models.Q(('status__in', ['Pending', 'Approved', 'Closed']), _negated=True),
+                fields=['-updated_at', '-id'],
+                name='case_open_updated_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='case',
+            index=models.Index(fields=['created_at'], name='case_created_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='casehistory',
+            index=models.Index(fields=['case', '-timestamp', '-id'], name='casehistory_case_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='casemessage',
+            index=models.Index(fields=['case', 'timestamp', 'id'], name='casemessage_case_time_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:26
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+# A frozen copy of cases.rollups as of this migration, so later changes to
+# the app can't change what it does on a fresh database.
+TRANSITION_FIELDS = {
+    'Approved': 'approved',
+    'Resolved': 'resolved',
+    'Closed': 'closed',
+}
+CHUNK_SIZE = 5000
+
+
+def transition_keys(day, status, assigned_to_id):
+    field = TRANSITION_FIELDS.get(status)
+    if field is None:
+        return []
+    keys = [(day, 0, field)]
+    if assigned_to_id:
+        keys.append((day, assigned_to_id, field))
+    return keys
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Count the cases created per day, and replay the HistoricalCase records
+    of each case that still exists for its transitions; a deleted case
+    doesn't count.
+    """
+    Case = apps.get_model('cases', 'Case')
+    HistoricalCase = apps.get_model('cases', 'HistoricalCase')
+    CaseDailyStat = apps.get_model('cases', 'CaseDailyStat')
+
+    expected = Counter()
+    created = Case.objects.order_by().annotate(day=TruncDate('created_at')).values('day').annotate(n=Count('pk'))
+    for row in created:
+        expected[(row['day'], 0, 'created')] = row['n']
+
+    records = (
+        HistoricalCase.objects.filter(id__in=Case.objects.values('pk'))
+        .order_by('id', 'history_date', 'history_id')
+        .values_list('id', 'status', 'assigned_to_id', 'history_date')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    case_id = previous_status = None
+    for record_case_id, status, assigned_to_id, history_date in records:
+        if record_case_id != case_id:
+            case_id, previous_status = record_case_id, None
+        if status != previous_status:
+            for key in transition_keys(timezone.localdate(history_date), status, assigned_to_id):
+                expected[key] += 1
+        previous_status = status
+
+    rows = {}
+    for (day, handler_id, field), count in expected.items():
+        row = rows.setdefault((day, handler_id), CaseDailyStat(day=day, handler_id=handler_id))
+        setattr(row, field, count)
+    CaseDailyStat.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0016_case_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaseDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('handler_id', models.BigIntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('approved', models.IntegerField(default=0)),
+                ('resolved', models.IntegerField(default=0)),
+                ('closed', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('handler_id', 'day'), name='unique_case_daily_stat')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
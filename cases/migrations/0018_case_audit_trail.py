@@ -0,0 +1,155 @@
+import datetime
+from itertools import groupby
+from operator import attrgetter, itemgetter
+
+import django.core.serializers.json
+from django.db import migrations, models
+from django.utils.html import escape
+
+
+# A view wrote its CaseHistory row right after the save that wrote the
+# HistoricalCase snapshot; a row this soon after one describes its change.
+MATCH_WINDOW = datetime.timedelta(seconds=10)
+UNAUDITED_FIELDS = {'id', 'created_at', 'updated_at'}
+STATE_FIELDS = ('status', 'assigned_to')
+BATCH_SIZE = 1000
+
+
+def event_type(changes, created):
+    if created:
+        return 'created'
+    if 'status' in changes and 'assigned_to' in changes:
+        return 'assignment' if changes['status'][1] == 'Assigned' else 'transition'
+    if 'assigned_to' in changes:
+        return 'assignment'
+    if 'status' in changes:
+        return 'transition'
+    return 'update'
+
+
+def describe(event, changes, usernames):
+    if event == 'created':
+        return "Case Registered"
+    if event == 'assignment':
+        # The history is shown |safe.
+        handler = usernames(changes['assigned_to'][1])
+        return f"Case assigned to {escape(handler)}" if handler else "Case unassigned"
+    if event == 'transition':
+        return f"Status updated to '{escape(changes['status'][1])}'"
+    return "Case details updated: " + ", ".join(sorted(changes))
+
+
+def import_historical_records(apps, schema_editor):
+    """
+    Fold the HistoricalCase snapshots into the audit trail: each snapshot's
+    diff with the previous one becomes the changes of the CaseHistory row
+    logged for it, or of a new row when no view logged one.
+    """
+    Case = apps.get_model('cases', 'Case')
+    CaseHistory = apps.get_model('cases', 'CaseHistory')
+    HistoricalCase = apps.get_model('cases', 'HistoricalCase')
+    User = Case._meta.get_field('created_by').related_model
+    CaseHistory._meta.get_field('timestamp').auto_now_add = False
+
+    fields = [field for field in Case._meta.concrete_fields if field.name not in UNAUDITED_FIELDS]
+    names = {}
+
+    def usernames(user_id):
+        if user_id and user_id not in names:
+            names[user_id] = User.objects.filter(pk=user_id).values_list('username', flat=True).first()
+        return names.get(user_id)
+
+    snapshots = (
+        HistoricalCase.objects.filter(id__in=Case.objects.values('pk'))
+        .order_by('id', 'history_date', 'history_id')
+        .values('id', 'history_type', 'history_date', 'history_user_id', *(field.attname for field in fields))
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    logged = groupby(
+        CaseHistory.objects.order_by('case_id', 'timestamp', 'id').iterator(chunk_size=BATCH_SIZE),
+        key=attrgetter('case_id'),
+    )
+    matched, created = [], []
+    next_logged = next(logged, None)
+    for case_id, records in groupby(snapshots, key=itemgetter('id')):
+        while next_logged is not None and next_logged[0] < case_id:
+            next_logged = next(logged, None)
+        entries = list(next_logged[1]) if next_logged is not None and next_logged[0] == case_id else []
+
+        records = [record for record in records if record['history_type'] != '-']
+        previous = None
+        for index, record in enumerate(records):
+            # The view logged the change after saving it, before the next save.
+            start = record['history_date']
+            end = start + MATCH_WINDOW
+            if index + 1 < len(records):
+                end = min(end, records[index + 1]['history_date'])
+            values = {field.name: record[field.attname] for field in fields}
+            if previous is None:
+                changes = {name: [None, values[name]] for name in STATE_FIELDS if values[name] is not None}
+            else:
+                changes = {name: [previous[name], value] for name, value in values.items() if previous[name] != value}
+            event = event_type(changes, previous is None)
+            previous = values
+            if not changes:
+                continue
+
+            entry = next(
+                (
+                    entry for entry in entries
+                    if not entry.changes and start <= entry.timestamp < end
+                ),
+                None,
+            )
+            if entry is not None:
+                entry.event, entry.changes = event, changes
+                entry.performed_by_id = entry.performed_by_id or record['history_user_id']
+                matched.append(entry)
+            else:
+                created.append(CaseHistory(
+                    case_id=case_id,
+                    event=event,
+                    changes=changes,
+                    action=describe(event, changes, usernames),
+                    performed_by_id=record['history_user_id'],
+                    timestamp=record['history_date'],
+                ))
+
+        if len(matched) >= BATCH_SIZE or len(created) >= BATCH_SIZE:
+            CaseHistory.objects.bulk_update(matched, ['event', 'changes', 'performed_by'], batch_size=BATCH_SIZE)
+            CaseHistory.objects.bulk_create(created, batch_size=BATCH_SIZE)
+            matched, created = [], []
+    CaseHistory.objects.bulk_update(matched, ['event', 'changes', 'performed_by'], batch_size=BATCH_SIZE)
+    CaseHistory.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    CaseHistory.objects.filter(event='note', action__startswith='A file uploaded').update(event='file')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0017_casedailystat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='casehistory',
+            name='event',
+            field=models.CharField(
+                choices=[
+                    ('created', 'Created'), ('transition', 'Status change'), ('assignment', 'Assignment'),
+                    ('update', 'Update'), ('file', 'File upload'), ('note', 'Note'),
+                ],
+                default='note',
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name='casehistory',
+            name='changes',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.RunPython(import_historical_records, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='HistoricalCase',
+        ),
+    ]
@@ -0,0 +1,152 @@
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The table rebuild from cases.partitions, written out here so later
+# changes there don't change what this migration does.
+PARTITIONED = {
+    'cases.CaseHistory': 'timestamp',
+    'cases.CaseMessage': 'timestamp',
+}
+MONTHS_AHEAD = 3
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def months(start, end):
+    """First days of the months from ``start``'s to ``end``'s, inclusive."""
+    month = month_start(start)
+    while month <= end:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def create_partition_sql(table, month, quote_name):
+    return (
+        f'CREATE TABLE IF NOT EXISTS {quote_name(partition_name(table, month))} '
+        f'PARTITION OF {quote_name(table)} '
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+    )
+
+
+def add_keys(schema_editor, model):
+    """The foreign keys and indexes of a table rebuilt with CREATE TABLE ... LIKE, which copies neither."""
+    quote_name = schema_editor.quote_name
+    table = model._meta.db_table
+    for field in model._meta.local_fields:
+        if field.remote_field is None:
+            continue
+        target = field.remote_field.model._meta
+        schema_editor.execute(
+            f'ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(f"{table}_{field.column}_fk")} '
+            f'FOREIGN KEY ({quote_name(field.column)}) '
+            f'REFERENCES {quote_name(target.db_table)} ({quote_name(target.pk.column)}) '
+            f'DEFERRABLE INITIALLY DEFERRED'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {quote_name(f"{table}_{field.column}_idx")} '
+            f'ON {quote_name(table)} ({quote_name(field.column)})'
+        )
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+
+def partition_table(schema_editor, model, column):
+    """
+    Rebuild ``model``'s table as a table partitioned by month on
+    ``column``, moving its rows over. For migrations; takes an exclusive
+    lock on the table while it copies.
+    """
+    quote_name = schema_editor.quote_name
+    table = model._meta.db_table
+    old_table = f'{table}_unpartitioned'
+    sequence = f'{table}_id_seq'
+    execute = schema_editor.execute
+
+    execute(f'ALTER TABLE {quote_name(table)} RENAME TO {quote_name(old_table)}')
+    execute(
+        f'CREATE TABLE {quote_name(table)} (LIKE {quote_name(old_table)} INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE ({quote_name(column)})'
+    )
+    execute(f'CREATE TABLE {quote_name(table + "_default")} PARTITION OF {quote_name(table)} DEFAULT')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN({quote_name(column)}) FROM {quote_name(old_table)}')
+        first = cursor.fetchone()[0]
+    today = datetime.date.today()
+    for month in months(first.date() if first else today, today + datetime.timedelta(days=31 * MONTHS_AHEAD)):
+        execute(create_partition_sql(table, month, quote_name))
+    execute(f'INSERT INTO {quote_name(table)} SELECT * FROM {quote_name(old_table)}')
+    execute(f'DROP TABLE {quote_name(old_table)} CASCADE')
+
+    # The identity sequence went with the old table.
+    execute(f'CREATE SEQUENCE {quote_name(sequence)} OWNED BY {quote_name(table)}.{quote_name("id")}')
+    execute(f"ALTER TABLE {quote_name(table)} ALTER COLUMN {quote_name('id')} SET DEFAULT nextval('{sequence}')")
+    execute(
+        f"SELECT setval('{sequence}', COALESCE((SELECT MAX({quote_name('id')}) FROM {quote_name(table)}), 0) + 1, false)"
+    )
+    execute(f'ALTER TABLE {quote_name(table)} ADD PRIMARY KEY ({quote_name("id")}, {quote_name(column)})')
+    add_keys(schema_editor, model)
+
+
+def unpartition_table(schema_editor, model, column):
+    """Reverse of partition_table(): back to a plain table with the same rows."""
+    quote_name = schema_editor.quote_name
+    table = model._meta.db_table
+    old_table = f'{table}_partitioned'
+
+    execute = schema_editor.execute
+    execute(f'ALTER TABLE {quote_name(table)} RENAME TO {quote_name(old_table)}')
+    # The sequence is owned by the id column; detach it so it outlives the old table.
+    execute(f'ALTER SEQUENCE {quote_name(table + "_id_seq")} OWNED BY NONE')
+    execute(f'CREATE TABLE {quote_name(table)} (LIKE {quote_name(old_table)} INCLUDING DEFAULTS)')
+    execute(f'INSERT INTO {quote_name(table)} SELECT * FROM {quote_name(old_table)}')
+    execute(f'DROP TABLE {quote_name(old_table)} CASCADE')
+    execute(f'ALTER SEQUENCE {quote_name(table + "_id_seq")} OWNED BY {quote_name(table)}.{quote_name("id")}')
+    execute(f'ALTER TABLE {quote_name(table)} ADD PRIMARY KEY ({quote_name("id")})')
+    add_keys(schema_editor, model)
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for label, column in PARTITIONED.items():
+            partition_table(schema_editor, apps.get_model(label), column)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for label, column in PARTITIONED.items():
+            unpartition_table(schema_editor, apps.get_model(label), column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0018_case_audit_trail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaseArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('history_count', models.IntegerField(default=0)),
+                ('message_count', models.IntegerField(default=0)),
+                ('archived_at', models.DateTimeField()),
+                ('case', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='cases.case')),
+            ],
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0023_notification_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HandlerCapacity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('max_open_cases', models.PositiveIntegerField(blank=True, null=True)),
+                ('handler', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='assignment_capacity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'handler capacities',
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:23
+
+import gzip
+import json
+import os
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_archived_attachments(apps, schema_editor):
+    """Read the chat attachments of the archives written so far; see cases.archive."""
+    CaseArchive = apps.get_model('cases', 'CaseArchive')
+    ArchivedAttachment = apps.get_model('cases', 'ArchivedAttachment')
+    root = os.path.join(settings.MEDIA_ROOT, getattr(settings, 'CASE_ARCHIVE_DIR', 'case_archive'))
+    for case_id, path in CaseArchive.objects.values_list('case_id', 'path').iterator():
+        try:
+            with gzip.open(os.path.join(root, path), 'rt', encoding='utf-8') as archive:
+                records = [json.loads(line) for line in archive if line.strip()]
+        except FileNotFoundError:
+            continue
+        ArchivedAttachment.objects.bulk_create(
+            [
+                ArchivedAttachment(name=record['file'], case_id=case_id)
+                for record in records if record['kind'] == 'message' and record.get('file')
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cases', '0024_handler_capacity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['uploaded_file'], name='case_uploaded_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['report_file'], name='case_report_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='casemessage',
+            index=models.Index(fields=['file'], name='casemessage_file_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedattachment',
+            name='case',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attachments', to='cases.case'),
+        ),
+        migrations.RunPython(record_archived_attachments, migrations.RunPython.noop),
+    ]
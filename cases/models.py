@@ -1,11 +1,57 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 from django_fsm import FSMField, transition
-from simple_history.models import HistoricalRecords
 
 # Create your models here.
 
+class CaseQuerySet(models.QuerySet):
+    """
+    Named loading profiles, so every page costs the same number of queries
+    however many cases, messages or history entries it shows.
+    """
+
+    LIST_FIELDS = (
+        'id', 'title', 'status', 'is_anonymous', 'created_at', 'updated_at',
+        'created_by__id', 'created_by__username',
+        'assigned_to__id', 'assigned_to__username',
+    )
+
+    EXPORT_FIELDS = (
+        'id', 'title', 'description', 'status', 'location', 'incident_date',
+        'is_anonymous', 'suspect_name', 'witnesses', 'progress_notes',
+        'uploaded_file', 'report_file', 'created_at', 'updated_at',
+        'created_by__id', 'created_by__username',
+        'assigned_to__id', 'assigned_to__username',
+    )
+
+    def for_list(self):
+        """What a case card in the list pages shows."""
+        return self.select_related('created_by', 'assigned_to').only(*self.LIST_FIELDS)
+
+    def for_detail(self):
+        """The case detail page: the case, its chat, its history and whether any of it is archived."""
+        return self.select_related('created_by', 'assigned_to', 'archive').prefetch_related(
+            models.Prefetch(
+                'messages',
+                queryset=CaseMessage.objects.select_related('sender')
+                .prefetch_related('sender__groups')
+                .order_by('timestamp', 'id'),
+            ),
+            models.Prefetch(
+                'custom_history',
+                queryset=CaseHistory.objects.select_related('performed_by').order_by('-timestamp', '-id'),
+            ),
+        )
+
+    def for_export(self):
+        """Flat rows for exports; messages and history are streamed separately."""
+        return self.select_related('created_by', 'assigned_to').only(*self.EXPORT_FIELDS)
+
+
 class Case(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -69,25 +115,183 @@ class Case(models.Model):
         related_name='cases_assigned',
         limit_choices_to={'groups__name': 'handler'}
     )
-    history = HistoricalRecords()
+    objects = CaseQuerySet.as_manager()
+
+    class Meta:
+        # Shaped after the list pages: a filter on status, handler or creator,
+        # then the keyset ordering (-updated_at, -id).
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='case_updated_idx'),
+            models.Index(fields=['status', '-updated_at', '-id'], name='case_status_updated_idx'),
+            models.Index(fields=['assigned_to', 'status', '-updated_at', '-id'], name='case_handler_status_idx'),
+            models.Index(fields=['assigned_to', '-updated_at', '-id'], name='case_handler_updated_idx'),
+            models.Index(fields=['created_by', 'status', '-updated_at', '-id'], name='case_creator_status_idx'),
+            models.Index(fields=['created_by', '-updated_at', '-id'], name='case_creator_updated_idx'),
+            # The admin's assigned list: every case that's being worked on.
+            models.Index(
+                fields=['-updated_at', '-id'],
+                condition=~models.Q(status__in=['Pending', 'Approved', 'Closed']),
+                name='case_open_updated_idx',
+            ),
+            models.Index(fields=['created_at'], name='case_created_at_idx'),
+            # cases.media finds the case a file belongs to by its name.
+            models.Index(fields=['uploaded_file'], name='case_uploaded_file_idx'),
+            models.Index(fields=['report_file'], name='case_report_file_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.status})"
 
+    @property
+    def history(self):
+        """The case's past states, rebuilt from its audit trail like HistoricalCase records; see cases.audit."""
+        from .audit import CaseSnapshots
+
+        return CaseSnapshots(self)
+
+    def save(self, *args, actor=None, action=None, **kwargs):
+        """
+        Save and log the change in the audit trail as done by ``actor``,
+        worded as ``action`` if given; see cases.audit.
+        """
+        from .audit import audit_values, record_change
+        from .counters import counter_deltas, apply_counter_deltas
+        from .dashboard_cache import invalidate_case
+        from .notifications import notify_changes
+        from .rollups import apply_rollup_deltas, rollup_deltas
+        from .search import index_cases, search_document
+
+        with transaction.atomic():
+            old_values = old_state = old_document = None
+            if not self._state.adding:
+                # Lock the row so concurrent transitions can't both apply the same delta.
+                stored = Case.objects.select_for_update().filter(pk=self.pk).first()
+                if stored is not None:
+                    old_values = audit_values(stored)
+                    old_state = (stored.status, stored.assigned_to_id, stored.created_by_id)
+                    old_document = search_document(stored)
+            super().save(*args, **kwargs)
+            entry = record_change(self, old_values, actor, action)
+            if entry is not None:
+                notify_changes([(self, entry)])
+            new_state = (self.status, self.assigned_to_id, self.created_by_id)
+            apply_counter_deltas(counter_deltas(old_state, new_state))
+            apply_rollup_deltas(rollup_deltas(old_state, new_state, self.created_at))
+            invalidate_case(old_state, new_state)
+            # Status changes, the usual save, leave the search document as it was.
+            if search_document(self) != old_document:
+                index_cases([self.pk])
+
+
+
+class CaseStatusCounter(models.Model):
+    """
+    Materialized number of cases per (scope, owner, status), kept in step with
+    Case writes so the dashboards don't have to aggregate the cases table.
+    """
+    SCOPE_CHOICES = [
+        ('global', 'Global'),
+        ('handler', 'Handler'),
+        ('creator', 'Creator'),
+    ]
+
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES)
+    owner_id = models.BigIntegerField(default=0)  # user id, 0 for the global scope
+    status = models.CharField(max_length=50)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'owner_id', 'status'], name='unique_case_status_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.owner_id} {self.status} = {self.count}"
+
+
+
+class CaseDailyStat(models.Model):
+    """
+    Cases created, approved, resolved and closed on one day, overall
+    (handler_id 0) or among one handler's cases; see cases.rollups.
+    """
+    day = models.DateField()
+    handler_id = models.BigIntegerField(default=0)  # user id, 0 for all cases
+    created = models.IntegerField(default=0)
+    approved = models.IntegerField(default=0)
+    resolved = models.IntegerField(default=0)
+    closed = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['handler_id', 'day'], name='unique_case_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} handler {self.handler_id}: +{self.created} created, {self.closed} closed"
+
 
 
 class CaseHistory(models.Model):
+    """One entry of a case's audit trail; written through cases.audit."""
+    CREATED = 'created'
+    TRANSITION = 'transition'
+    ASSIGNMENT = 'assignment'
+    UPDATE = 'update'
+    FILE = 'file'
+    NOTE = 'note'
+    EVENT_CHOICES = [
+        (CREATED, 'Created'),
+        (TRANSITION, 'Status change'),
+        (ASSIGNMENT, 'Assignment'),
+        (UPDATE, 'Update'),
+        (FILE, 'File upload'),
+        (NOTE, 'Note'),
+    ]
+
     case = models.ForeignKey(Case, related_name='custom_history', on_delete=models.CASCADE)
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES, default=NOTE)
+    # {field name: [old value, new value]}, foreign keys as ids.
+    changes = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
     action = models.CharField(max_length=255)
     performed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['case', '-timestamp', '-id'], name='casehistory_case_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.action} on {self.timestamp}"
 
 
 
 
+class CaseArchive(models.Model):
+    """Where a case's archived history and chat went; see cases.archive."""
+    case = models.OneToOneField(Case, related_name='archive', on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)  # relative to the archive root
+    history_count = models.IntegerField(default=0)
+    message_count = models.IntegerField(default=0)
+    archived_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archive of case #{self.case_id}"
+
+
+class ArchivedAttachment(models.Model):
+    """
+    A chat attachment whose message was archived, and its case, so
+    cases.media still knows who may see the file; see cases.archive.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    case = models.ForeignKey(Case, related_name='archived_attachments', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
 class CaseMessage(models.Model):
     case = models.ForeignKey(Case, related_name='messages', on_delete=models.CASCADE)
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -95,5 +299,167 @@ class CaseMessage(models.Model):
     file = models.FileField(upload_to='chat_files/', blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['case', 'timestamp', 'id'], name='casemessage_case_time_idx'),
+            models.Index(fields=['file'], name='casemessage_file_idx'),
+        ]
+
     def __str__(self):
         return f"Message by {self.sender.username} in Case #{self.case.id} on {self.timestamp}"
+
+
+class ChunkedUpload(models.Model):
+    """A file being uploaded in chunks, until it's attached; see cases.uploads."""
+    EVIDENCE = 'evidence'
+    REPORT = 'report'
+    MESSAGE = 'message'
+    TARGET_CHOICES = [
+        (EVIDENCE, 'Case evidence'),
+        (REPORT, 'Case report'),
+        (MESSAGE, 'Chat attachment'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    case = models.ForeignKey(Case, related_name='uploads', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)  # bytes received so far
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} to case #{self.case_id} ({self.offset}/{self.size})"
+
+
+class MediaBlob(models.Model):
+    """One stored copy of some file content, shared by every MediaFile with that content; see cases.storage."""
+    digest = models.CharField(max_length=64, primary_key=True)  # SHA-256, hex
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.refcount} references)"
+
+
+class MediaFile(models.Model):
+    """A storage name, as kept in a FileField, and the blob holding its content."""
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(MediaBlob, related_name='files', on_delete=models.PROTECT)
+
+    def __str__(self):
+        return self.name
+
+
+class Task(models.Model):
+    """A call to a background task, queued until a worker runs it; see cases.tasks."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)  # dotted path of the task function
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # At most one queued task per key; enqueueing it again is a no-op.
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # What workers poll: the due queued tasks, oldest first.
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='task_due_idx'),
+            models.Index(fields=['status', 'locked_at'], name='task_status_locked_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status='queued'), name='unique_queued_task',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class CaseEvent(models.Model):
+    """
+    A live case event relayed to the other server processes; see
+    cases.events.DatabaseBroker. Rows are pruned after a minute.
+    """
+    # Not a foreign key: the row is gone long before anyone deletes the case.
+    case_id = models.BigIntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    origin = models.CharField(max_length=32)  # the publishing process, which already delivered it
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.payload.get('type')} event of case #{self.case_id}"
+
+
+class Notification(models.Model):
+    """
+    Something a user should hear about, waiting in the outbox until it's
+    sent in their next digest; see cases.notifications.
+    """
+    ASSIGNED = 'assigned'
+    APPROVED = 'approved'
+    STATUS = 'status'
+    EVENT_CHOICES = [
+        (ASSIGNED, 'Case assigned'),
+        (APPROVED, 'Case approved'),
+        (STATUS, 'Status changed'),
+    ]
+
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='notifications', on_delete=models.CASCADE)
+    case = models.ForeignKey(Case, related_name='notifications', on_delete=models.CASCADE)
+    event = models.CharField(max_length=10, choices=EVENT_CHOICES)
+    text = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The dispatcher's view of the outbox: what's unsent, per recipient.
+            models.Index(fields=['recipient', 'id'], condition=models.Q(sent_at__isnull=True), name='notification_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return f"To {self.recipient_id}: {self.text}"
+
+
+class HandlerCapacity(models.Model):
+    """
+    How much of the approved queue auto-assignment hands a handler; see
+    cases.assignment. Handlers without a row get a weight of 1 and
+    CASE_ASSIGNMENT_MAX_OPEN.
+    """
+    handler = models.OneToOneField(
+        settings.AUTH_USER_MODEL, related_name='assignment_capacity', on_delete=models.CASCADE,
+    )
+    # Share of the work relative to other handlers; 0 leaves them out.
+    weight = models.PositiveSmallIntegerField(default=1)
+    max_open_cases = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'handler capacities'
+
+    def __str__(self):
+        cap = 'no cap' if self.max_open_cases is None else f"at most {self.max_open_cases}"
+        return f"{self.handler_id}: weight {self.weight}, {cap}"
@@ -0,0 +1,180 @@
+"""
+Notifications about case changes, sent as digests.
+
+Every change that matters to someone other than the person making it is
+written to the outbox (Notification) in the same transaction as the change:
+the handler hears about an assignment, and the reporter about an approval
+or a status change. Case.save() and the bulk actions call notify_changes()
+with the history entries they write, so every path that changes a case
+goes through it.
+
+Nothing is sent on the request. Writing to the outbox queues one
+dispatch_notifications task (cases.tasks), due DIGEST_DELAY seconds later
+and deduplicated, so everything that happens in that window goes out
+together: each recipient gets a single digest of all their pending
+notifications, however many cases changed. Assigning 500 cases to a handler
+sends them one message.
+
+Digests are delivered by every backend in CASE_NOTIFICATION_BACKENDS, each
+a class with a send(digest) method. The default, EmailBackend, emails the
+recipient through Django's email settings; ConsoleBackend and FileBackend
+are for development and tests. A backend that raises fails the task, and
+the task's retry sends the digest again.
+"""
+import json
+import sys
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notification
+from .tasks import enqueue, task
+
+
+# Seconds notifications wait for others to share their digest.
+DIGEST_DELAY = 60
+DIGEST_KEY = 'notification-digest'
+
+
+def digest_delay():
+    return getattr(settings, 'CASE_NOTIFICATION_DIGEST_DELAY', DIGEST_DELAY)
+
+
+def case_label(case):
+    return f'#{case.pk} "{case.title}"'
+
+
+def change_notifications(case, entry):
+    """The unsaved notifications for history ``entry`` of ``case``; its actor isn't told about their own change."""
+    changes = entry.changes
+    notifications = {}
+    if 'assigned_to' in changes and case.assigned_to_id:
+        notifications[case.assigned_to_id] = (Notification.ASSIGNED, f"{case_label(case)} was assigned to you.")
+    if 'status' in changes and changes['status'][0] is not None:
+        status = changes['status'][1]
+        if status == 'Approved':
+            event, text = Notification.APPROVED, f"Your case {case_label(case)} was approved."
+        else:
+            event, text = Notification.STATUS, f"{case_label(case)} is now {status}."
+        notifications.setdefault(case.created_by_id, (event, text))
+        if case.assigned_to_id:
+            notifications.setdefault(case.assigned_to_id, (event, text))
+    notifications.pop(entry.performed_by_id, None)
+    return [
+        Notification(recipient_id=recipient_id, case=case, event=event, text=text)
+        for recipient_id, (event, text) in notifications.items()
+    ]
+
+
+def notify_changes(changes):
+    """Put the notifications for (case, history entry) pairs in the outbox and schedule the next digest."""
+    notifications = [
+        notification
+        for case, entry in changes
+        for notification in change_notifications(case, entry)
+    ]
+    if not notifications:
+        return []
+    Notification.objects.bulk_create(notifications)
+    enqueue(dispatch_notifications, dedup_key=DIGEST_KEY, delay=digest_delay())
+    return notifications
+
+
+class Digest:
+    """A recipient's pending notifications, oldest first, as one message."""
+
+    def __init__(self, recipient, notifications):
+        self.recipient = recipient
+        self.notifications = notifications
+
+    @property
+    def subject(self):
+        count = len(self.notifications)
+        return f"CaseEase: {count} update{'s' if count != 1 else ''} on your cases"
+
+    @property
+    def body(self):
+        lines = [f"Hello {self.recipient.username},", ""]
+        lines += [f"- {notification.text}" for notification in self.notifications]
+        lines += ["", "Please check the portal for details."]
+        return "\n".join(lines)
+
+
+class ConsoleBackend:
+    """Writes digests to stdout, like Django's console email backend."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, digest):
+        self.stream.write(f"To: {digest.recipient.username}\nSubject: {digest.subject}\n\n{digest.body}\n\n")
+        self.stream.flush()
+
+
+class FileBackend:
+    """Appends each digest as a JSON line to CASE_NOTIFICATION_FILE."""
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'CASE_NOTIFICATION_FILE', 'notifications.jsonl')
+
+    def send(self, digest):
+        record = {
+            'recipient': digest.recipient.username,
+            'subject': digest.subject,
+            'notifications': [
+                {'case': notification.case_id, 'event': notification.event, 'text': notification.text}
+                for notification in digest.notifications
+            ],
+            'sent_at': timezone.now().isoformat(),
+        }
+        with open(self.path, 'a', encoding='utf-8') as outbox:
+            outbox.write(json.dumps(record) + '\n')
+
+
+class EmailBackend:
+    """Emails digests to recipients who have an address."""
+
+    def send(self, digest):
+        if digest.recipient.email:
+            send_mail(digest.subject, digest.body, None, [digest.recipient.email])
+
+
+def backends():
+    paths = getattr(settings, 'CASE_NOTIFICATION_BACKENDS', ['cases.notifications.EmailBackend'])
+    return [import_string(path)() for path in paths]
+
+
+def send_digest(recipient_id, channels):
+    """Send ``recipient_id`` their pending notifications as one digest; returns how many it held."""
+    with transaction.atomic():
+        pending = Notification.objects.filter(recipient_id=recipient_id, sent_at__isnull=True)
+        if connection.features.has_select_for_update_skip_locked:
+            # Another dispatcher sending this digest already has them.
+            pending = pending.select_for_update(skip_locked=True, of=('self',))
+        notifications = list(pending.select_related('recipient', 'case').order_by('id'))
+        if not notifications:
+            return 0
+        digest = Digest(notifications[0].recipient, notifications)
+        for channel in channels:
+            channel.send(digest)
+        Notification.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+            sent_at=timezone.now(),
+        )
+    return len(notifications)
+
+
+@task
+def dispatch_notifications():
+    """Send every recipient with pending notifications their digest; returns (digests, notifications)."""
+    channels = backends()
+    digests = sent = 0
+    recipients = Notification.objects.filter(sent_at__isnull=True).values_list('recipient_id', flat=True)
+    for recipient_id in sorted(set(recipients)):
+        count = send_digest(recipient_id, channels)
+        if count:
+            digests += 1
+            sent += count
+    return digests, sent
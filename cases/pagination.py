@@ -0,0 +1,177 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+DEFAULT_PAGE_SIZE = 24
+DEFAULT_MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder drops microseconds past milliseconds, which would
+        # make the cursor land between rows.
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by the position of the last row seen instead of an
+    OFFSET, so fetching page 1000 costs the same as fetching page 1.
+
+    ``ordering`` must end with a unique column so every row has a distinct
+    position; rows inserted or updated while a user is paging can't shift
+    the rows of the pages that follow.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-updated_at', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise InvalidCursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+
+        decoded = []
+        for field_name, value in zip(self.fields, values):
+            try:
+                field = self.queryset.model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                decoded.append(value)  # an annotation, e.g. a search rank
+                continue
+            try:
+                decoded.append(field.to_python(value))
+            except ValidationError:
+                raise InvalidCursor(cursor)
+        return decoded
+
+    def _seek(self, values, reverse):
+        """Q object selecting the rows that come after ``values`` in the ordering."""
+        condition = Q()
+        for index in range(len(self.fields) - 1, -1, -1):
+            descending = self.ordering[index].startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            field = self.fields[index]
+            step = Q(**{f'{field}__{lookup}': values[index]})
+            if index < len(self.fields) - 1:
+                step |= Q(**{field: values[index]}) & condition
+            condition = step
+        return condition
+
+    def page(self, after=None, before=None):
+        queryset = self.queryset
+        reverse = before is not None and after is None
+        cursor = before if reverse else after
+
+        if reverse:
+            ordering = [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+        else:
+            ordering = list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self._seek(self.decode_cursor(cursor), reverse))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=cursor is not None)
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset pagination for the case list views. ``?after=`` / ``?before=``
+    carry the opaque cursors and ``?page_size=`` overrides the configured
+    CASE_LIST_PAGE_SIZE up to CASE_LIST_MAX_PAGE_SIZE.
+    """
+    ordering = ('-updated_at', '-id')
+
+    def get_paginate_by(self, queryset=None):
+        size = getattr(settings, 'CASE_LIST_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+        max_size = getattr(settings, 'CASE_LIST_MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+        try:
+            size = int(self.request.GET.get('page_size', size))
+        except ValueError:
+            pass
+        return max(1, min(size, max_size))
+
+    def get_ordering(self):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_ordering()
+        if 'search_rank' in queryset.query.annotations:
+            ordering = ('-search_rank', '-id')  # most relevant search results first
+        paginator = KeysetPaginator(queryset, page_size, ordering)
+        try:
+            page = paginator.page(
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before'),
+            )
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_page_context(self, queryset):
+        """Context for views that aren't ListViews."""
+        paginator, page, object_list, is_paginated = self.paginate_queryset(queryset, self.get_paginate_by())
+        return {
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'cases': object_list,
+        }
@@ -0,0 +1,118 @@
+"""
+Monthly range partitions of the append-only case tables on PostgreSQL.
+
+CaseHistory and CaseMessage are partitioned by their timestamp, one
+partition per calendar month plus a default partition for anything outside
+them, so old months can be vacuumed, detached or dropped on their own.
+The tables keep their Django models; only the primary key grows the
+timestamp, which PostgreSQL requires of a partitioned table. Migration 0019
+converted them; this module keeps the partitions coming.
+
+Partitions are created MONTHS_AHEAD months ahead by partition_case_tables,
+which is meant to run daily from cron, and by every archive_case_history
+run, so a month's rows never land in the default partition.
+
+Other databases keep plain tables. There, as on PostgreSQL, the archive
+(cases.archive) is what keeps the tables from growing without bound.
+"""
+import datetime
+
+from django.db import connection
+
+
+# Model label -> the column the table is partitioned by.
+PARTITIONED = {
+    'cases.CaseHistory': 'timestamp',
+    'cases.CaseMessage': 'timestamp',
+}
+MONTHS_AHEAD = 3
+
+
+def supported(using=connection):
+    return using.vendor == 'postgresql'
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def months(start, end):
+    """First days of the months from ``start``'s to ``end``'s, inclusive."""
+    month = month_start(start)
+    while month <= end:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def is_partitioned(table, using=connection):
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions(table, using=connection):
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [table],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_partition_sql(table, month, quote_name):
+    return (
+        f'CREATE TABLE IF NOT EXISTS {quote_name(partition_name(table, month))} '
+        f'PARTITION OF {quote_name(table)} '
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+    )
+
+
+def ensure_partitions(model, until=None, using=connection):
+    """
+    Create the monthly partitions of ``model``'s table up to ``until``
+    (default MONTHS_AHEAD months from now). Rows for a month without a
+    partition land in the default one, and a partition can't be created
+    for a month the default partition already has rows for, so run this
+    ahead of time, e.g. daily from cron with partition_case_tables.
+    Returns the names of the partitions created.
+    """
+    table = model._meta.db_table
+    today = datetime.date.today()
+    until = until or today + datetime.timedelta(days=31 * MONTHS_AHEAD)
+    existing = existing_partitions(table, using)
+    created = []
+    with using.cursor() as cursor:
+        for month in months(today, until):
+            name = partition_name(table, month)
+            if name not in existing:
+                cursor.execute(create_partition_sql(table, month, using.ops.quote_name))
+                created.append(name)
+    return created
+
+
+def drop_empty_partitions(model, before, using=connection):
+    """Drop the partitions of months before ``before`` that the archive has emptied."""
+    table = model._meta.db_table
+    quote_name = using.ops.quote_name
+    dropped = []
+    with using.cursor() as cursor:
+        for name in sorted(existing_partitions(table, using)):
+            if name == f'{table}_default' or name >= partition_name(table, month_start(before)):
+                continue
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {quote_name(name)})')
+            if not cursor.fetchone()[0]:
+                cursor.execute(f'DROP TABLE {quote_name(name)}')
+                dropped.append(name)
+    return dropped
@@ -0,0 +1,143 @@
+"""
+Query plans of the hot case queries, with and without the indexes of
+migration 0016.
+
+Each query is built the way the views build it, against the busiest handler,
+reporting user and case in the database. ``compare_plans()`` explains and
+times each one, then drops the indexes inside a transaction that is rolled
+back, and explains and times it again. The drop takes an exclusive lock on
+PostgreSQL, so run it against a copy of production, not production itself.
+"""
+import datetime
+import re
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Case, CaseHistory, CaseMessage
+
+
+PAGE = 25
+OPEN_EXCLUDED = ['Pending', 'Approved', 'Closed']
+
+
+class PlanSample:
+    """The handler, user and case the queries are run against."""
+
+    def __init__(self):
+        User = get_user_model()
+        self.handler_id = (
+            User.objects.filter(groups__name='handler')
+            .annotate(n=Count('cases_assigned')).order_by('-n', 'pk')
+            .values_list('pk', flat=True).first()
+        )
+        self.user_id = (
+            User.objects.filter(role='user')
+            .annotate(n=Count('cases_created')).order_by('-n', 'pk')
+            .values_list('pk', flat=True).first()
+        )
+        self.case_id = (
+            Case.objects.annotate(n=Count('messages')).order_by('-n', 'pk')
+            .values_list('pk', flat=True).first()
+        )
+        if None in (self.handler_id, self.user_id, self.case_id):
+            raise ValueError("Needs at least one handler, one user and one case; see generate_load_data.")
+
+
+def latest(queryset):
+    return queryset.order_by('-updated_at', '-id')[:PAGE]
+
+
+def hot_queries(sample):
+    cases = Case.objects.for_list()
+    week_ago = timezone.now() - datetime.timedelta(days=7)
+    return {
+        'all_cases': latest(cases),
+        'pending_cases': latest(cases.filter(status='Pending')),
+        'admin_assigned_cases': latest(cases.exclude(status__in=OPEN_EXCLUDED)),
+        'handler_assigned_cases': latest(cases.filter(assigned_to_id=sample.handler_id, status='Assigned')),
+        'handler_all_cases': latest(cases.filter(assigned_to_id=sample.handler_id)),
+        'user_pending_cases': latest(cases.filter(created_by_id=sample.user_id, status='Pending')),
+        'user_all_cases': latest(cases.filter(created_by_id=sample.user_id)),
+        'cases_per_day': Case.objects.filter(created_at__gte=week_ago).values('created_at'),
+        'case_messages': CaseMessage.objects.filter(case_id=sample.case_id).order_by('timestamp', 'id'),
+        'case_history': CaseHistory.objects.filter(case_id=sample.case_id).order_by('-timestamp', '-id'),
+    }
+
+
+def plan_indexes():
+    """(model, index) for every index declared on the case models, i.e. those of migration 0016."""
+    return [(model, index) for model in (Case, CaseMessage, CaseHistory) for index in model._meta.indexes]
+
+
+def explain(queryset, label):
+    if connection.vendor == 'postgresql':
+        return queryset.explain(analyze=True, buffers=True)
+    # sqlite3 caches statements by their text and doesn't re-plan a cached
+    # EXPLAIN after the schema changes; the label keeps the runs apart.
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql} -- {label}', params)
+        return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+
+def scans(plan):
+    """The table accesses in a plan, e.g. 'Seq Scan on cases_case' or 'SEARCH cases_case USING INDEX ...'."""
+    if connection.vendor == 'postgresql':
+        pattern = r'((?:Parallel )?Seq Scan on \w+|(?:Bitmap )?Index(?: Only)? Scan(?: Backward)? (?:using|on) \w+(?: on \w+)?)'
+    else:
+        pattern = r'((?:SCAN|SEARCH) \S+(?: USING (?:COVERING |INTEGER PRIMARY )?(?:INDEX|KEY)(?: \w+)?)?)'
+    return re.findall(pattern, plan)
+
+
+def plan_shape(plan):
+    """'seq scan' if a table is read in full, else 'sort' if the rows are sorted afterwards, else 'index'."""
+    if connection.vendor == 'postgresql':
+        seq_scan = 'Seq Scan' in plan
+        sort = re.search(r'\bSort\b', plan) is not None
+    else:
+        seq_scan = re.search(r'\bSCAN \S+$', plan, re.MULTILINE) is not None
+        sort = 'USE TEMP B-TREE FOR ORDER BY' in plan
+    return 'seq scan' if seq_scan else 'sort' if sort else 'index'
+
+
+def time_query(queryset, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def measure(queries, runs, label):
+    results = {}
+    for name, queryset in queries.items():
+        plan = explain(queryset, label)
+        results[name] = {
+            'plan': plan,
+            'scans': scans(plan),
+            'shape': plan_shape(plan),
+            'median_ms': time_query(queryset, runs),
+        }
+    return results
+
+
+def compare_plans(runs=5, analyze=True):
+    """{query name: {'before': ..., 'after': ...}}; 'before' is without the 0016 indexes."""
+    if analyze:
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    queries = hot_queries(PlanSample())
+    after = measure(queries, runs, 'with indexes')
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for model, index in plan_indexes():
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+        before = measure(queries, runs, 'without indexes')
+        transaction.set_rollback(True)
+    return {name: {'before': before[name], 'after': after[name]} for name in queries}
@@ -0,0 +1,156 @@
+"""
+Daily case activity: how many cases were created, approved, resolved and
+closed each day, overall (handler_id 0) and per handler for the cases
+assigned to them.
+
+Case.save() keeps the CaseDailyStat table up to date as cases are created
+and change status; rebuild_rollups() recomputes it from Case.created_at and
+the audit trail, for backfills and after bulk writes.
+
+A deleted case leaves the rollups altogether, its transitions included:
+its audit trail goes with it, so a rebuild couldn't count them either.
+"""
+import datetime
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Case, CaseDailyStat
+
+
+# Status a case enters -> the column counting it.
+TRANSITION_FIELDS = {
+    'Approved': 'approved',
+    'Resolved': 'resolved',
+    'Closed': 'closed',
+}
+FIELDS = ['created', *TRANSITION_FIELDS.values()]
+
+
+def transition_keys(day, status, assigned_to_id):
+    field = TRANSITION_FIELDS.get(status)
+    if field is None:
+        return []
+    keys = [(day, 0, field)]
+    if assigned_to_id:
+        keys.append((day, assigned_to_id, field))
+    return keys
+
+
+def rollup_deltas(old_state, new_state, created_at, when=None, transitions=()):
+    """
+    Rollup changes for a case saved at ``when`` (default now), moving from
+    ``old_state`` to ``new_state``, each a (status, assigned_to_id,
+    created_by_id) tuple or None, like counters.counter_deltas(). For a
+    deleted case, ``transitions`` are its archive.case_transitions(),
+    taken before its audit trail went.
+    """
+    deltas = Counter()
+    if new_state is None:
+        deltas[(timezone.localdate(created_at), 0, 'created')] -= 1
+        for case_id, status, assigned_to_id, moment in transitions:
+            for key in transition_keys(timezone.localdate(moment), status, assigned_to_id):
+                deltas[key] -= 1
+        return deltas
+    day = timezone.localdate(when or timezone.now())
+    if old_state is None:
+        deltas[(timezone.localdate(created_at), 0, 'created')] += 1
+    if old_state is None or old_state[0] != new_state[0]:
+        for key in transition_keys(day, new_state[0], new_state[1]):
+            deltas[key] += 1
+    return deltas
+
+
+def apply_rollup_deltas(deltas):
+    """Apply a mapping of (day, handler_id, field) -> delta to the rollup table."""
+    # Always called inside Case.save()'s or the delete's transaction; a
+    # savepoint of its own would only add two queries to every write.
+    with transaction.atomic(savepoint=False):
+        for (day, handler_id, field), delta in deltas.items():
+            if not delta:
+                continue
+            rows = CaseDailyStat.objects.filter(day=day, handler_id=handler_id)
+            if not rows.update(**{field: F(field) + delta}):
+                CaseDailyStat.objects.get_or_create(day=day, handler_id=handler_id)
+                rows.update(**{field: F(field) + delta})
+
+
+def daily_series(start, end, handler_id=0):
+    """
+    {field: [count per day]} for every day from ``start`` to ``end``
+    inclusive, read from the rollup table in one query.
+    """
+    rows = {
+        row['day']: row
+        for row in CaseDailyStat.objects.filter(handler_id=handler_id, day__range=(start, end)).values('day', *FIELDS)
+    }
+    days = [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+    series = {'days': days}
+    for field in FIELDS:
+        series[field] = [rows[day][field] if day in rows else 0 for day in days]
+    return series
+
+
+def compute_rollups(transitions=None):
+    """
+    Recompute every rollup row: 'created' from Case.created_at, the
+    transitions from the (case_id, status, assigned_to_id, when) tuples of
+    ``transitions``, by default the audit trail's, archived or not.
+    """
+    from .archive import case_transitions
+
+    if transitions is None:
+        transitions = case_transitions()
+    expected = Counter()
+    created = (
+        Case.objects.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('day').annotate(n=Count('pk'))
+    )
+    for row in created:
+        expected[(row['day'], 0, 'created')] = row['n']
+
+    for case_id, status, assigned_to_id, when in transitions:
+        for key in transition_keys(timezone.localdate(when), status, assigned_to_id):
+            expected[key] += 1
+    return expected
+
+
+def stored_rollups(stat_model=CaseDailyStat):
+    stored = Counter()
+    for row in stat_model.objects.values('day', 'handler_id', *FIELDS):
+        for field in FIELDS:
+            if row[field]:
+                stored[(row['day'], row['handler_id'], field)] = row[field]
+    return stored
+
+
+def verify_rollups():
+    """Mismatches between the rollup table and its sources, as {(day, handler_id, field): (stored, expected)}."""
+    expected = compute_rollups()
+    stored = stored_rollups()
+    return {
+        key: (stored.get(key, 0), expected.get(key, 0))
+        for key in set(expected) | set(stored)
+        if stored.get(key, 0) != expected.get(key, 0)
+    }
+
+
+def rollup_rows(expected, stat_model=CaseDailyStat):
+    rows = {}
+    for (day, handler_id, field), count in expected.items():
+        row = rows.setdefault((day, handler_id), stat_model(day=day, handler_id=handler_id))
+        setattr(row, field, count)
+    return rows.values()
+
+
+@transaction.atomic
+def rebuild_rollups():
+    from .dashboard_cache import invalidate_all
+
+    CaseDailyStat.objects.all().delete()
+    CaseDailyStat.objects.bulk_create(rollup_rows(compute_rollups()), batch_size=1000)
+    invalidate_all()
@@ -0,0 +1,197 @@
+"""
+Full-text search over cases.
+
+Each case is indexed as one document made of its title, description, location
+and participant usernames. PostgreSQL keeps it in a weighted ``tsvector``
+column on cases_case with a GIN index; SQLite keeps it in an FTS5 shadow
+table. Both are created by migration 0015 and updated by Case.save() when
+one of INDEXED_FIELDS changed. Any other backend, or SQLite built without
+FTS5, falls back to icontains.
+"""
+import re
+from functools import lru_cache
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Case
+from .tasks import task
+
+
+FTS_TABLE = 'cases_case_fts'
+INDEX_BATCH_SIZE = 500
+# The case fields a search document is made of; the participants' usernames
+# come through their ids, and renames are reindexed by reindex_user_cases().
+INDEXED_FIELDS = ('title', 'description', 'location', 'created_by_id', 'assigned_to_id')
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+class PostgresSearchBackend:
+    # Usernames and titles are searched verbatim, so no stemming dictionary.
+    config = 'simple'
+
+    def index(self, case_ids=None):
+        user_table = get_user_model()._meta.db_table
+        sql = f"""
+            UPDATE cases_case AS c SET search_vector =
+                setweight(to_tsvector('{self.config}', coalesce(src.title, '')), 'A') ||
+                setweight(to_tsvector('{self.config}', coalesce(src.location, '')), 'B') ||
+                setweight(to_tsvector('{self.config}', cb.username || ' ' || coalesce(au.username, '')), 'B') ||
+                setweight(to_tsvector('{self.config}', coalesce(src.description, '')), 'C')
+            FROM cases_case AS src
+            JOIN {user_table} AS cb ON cb.id = src.created_by_id
+            LEFT JOIN {user_table} AS au ON au.id = src.assigned_to_id
+            WHERE src.id = c.id
+        """
+        with connection.cursor() as cursor:
+            if case_ids is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql + ' AND c.id = ANY(%s)', [list(case_ids)])
+
+    def remove(self, case_ids):
+        pass  # the vector lives on the case row
+
+    def tsquery(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def filter(self, queryset, terms):
+        return queryset.filter(RawSQL(
+            f"cases_case.search_vector @@ to_tsquery('{self.config}', %s)",
+            [self.tsquery(terms)],
+            output_field=BooleanField(),
+        ))
+
+    def rank(self, queryset, terms):
+        return self.filter(queryset, terms).annotate(search_rank=RawSQL(
+            f"ts_rank(cases_case.search_vector, to_tsquery('{self.config}', %s))",
+            [self.tsquery(terms)],
+            output_field=FloatField(),
+        ))
+
+
+class SQLiteSearchBackend:
+    def index(self, case_ids=None):
+        user_table = get_user_model()._meta.db_table
+        sql = f"""
+            INSERT OR REPLACE INTO {FTS_TABLE} (rowid, title, description, location, participants)
+            SELECT c.id, c.title, c.description, coalesce(c.location, ''),
+                   cb.username || ' ' || coalesce(au.username, '')
+            FROM cases_case AS c
+            JOIN {user_table} AS cb ON cb.id = c.created_by_id
+            LEFT JOIN {user_table} AS au ON au.id = c.assigned_to_id
+        """
+        with connection.cursor() as cursor:
+            if case_ids is None:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(sql)
+                return
+            case_ids = list(case_ids)
+            for start in range(0, len(case_ids), INDEX_BATCH_SIZE):
+                batch = case_ids[start:start + INDEX_BATCH_SIZE]
+                cursor.execute(sql + f" WHERE c.id IN ({', '.join(['%s'] * len(batch))})", batch)
+
+    def remove(self, case_ids):
+        case_ids = list(case_ids)
+        with connection.cursor() as cursor:
+            for start in range(0, len(case_ids), INDEX_BATCH_SIZE):
+                batch = case_ids[start:start + INDEX_BATCH_SIZE]
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+    def match(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def filter(self, queryset, terms):
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match(terms)])
+        return queryset.filter(pk__in=matches)
+
+    def rank(self, queryset, terms):
+        # Join the FTS table rather than looking the rank up per case: a
+        # correlated MATCH subquery reruns the full-text query for every row.
+        # bm25() is lower-is-better; negate it so every backend ranks descending.
+        # Column weights follow the PostgreSQL setweight() classes.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = cases_case.id', f'{FTS_TABLE} MATCH %s'],
+            params=[self.match(terms)],
+        ).annotate(search_rank=RawSQL(
+            f'-bm25({FTS_TABLE}, 10.0, 1.0, 4.0, 4.0)', [], output_field=FloatField(),
+        ))
+
+
+class SimpleSearchBackend:
+    def index(self, case_ids=None):
+        pass
+
+    def remove(self, case_ids):
+        pass
+
+    def filter(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) |
+                Q(description__icontains=term) |
+                Q(location__icontains=term) |
+                Q(created_by__username__icontains=term) |
+                Q(assigned_to__username__icontains=term)
+            )
+        return queryset
+
+    def rank(self, queryset, terms):
+        return self.filter(queryset, terms).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+@lru_cache(maxsize=None)
+def _backend_for(vendor, database_name):
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        return SQLiteSearchBackend()
+    return SimpleSearchBackend()
+
+
+def get_search_backend():
+    return _backend_for(connection.vendor, connection.settings_dict['NAME'])
+
+
+def search_cases(queryset, query, rank=False):
+    """
+    Narrow ``queryset`` to the cases matching every word of ``query``
+    (prefix matches included). With ``rank=True`` each case also gets a
+    ``search_rank`` annotation, higher meaning more relevant.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    backend = get_search_backend()
+    if rank:
+        return backend.rank(queryset, terms)
+    return backend.filter(queryset, terms)
+
+
+def search_document(case):
+    return tuple(getattr(case, field) for field in INDEXED_FIELDS)
+
+
+def index_cases(case_ids=None):
+    """Refresh the search documents of ``case_ids``, or of every case when None."""
+    get_search_backend().index(case_ids)
+
+
+def unindex_cases(case_ids):
+    get_search_backend().remove(case_ids)
+
+
+def user_case_ids(user_id):
+    return Case.objects.filter(Q(created_by_id=user_id) | Q(assigned_to_id=user_id)).values_list('pk', flat=True)
+
+
+@task
+def reindex_user_cases(user_id):
+    """Refresh the documents of every case ``user_id`` is on, e.g. after a rename; queued by the signal."""
+    index_cases(list(user_case_ids(user_id)))
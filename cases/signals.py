@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .archive import case_transitions
+from .counters import apply_counter_deltas, counter_deltas
+from .dashboard_cache import invalidate_case, invalidate_scopes, scope_key
+from .events import has_listeners, history_event, hub, message_event
+from .models import ArchivedAttachment, Case, CaseHistory, CaseMessage, CaseStatusCounter
+from .rollups import apply_rollup_deltas, rollup_deltas
+from .search import reindex_user_cases, unindex_cases
+from .tasks import enqueue
+
+
+@receiver(pre_delete, sender=Case)
+def remember_case_transitions(sender, instance, **kwargs):
+    # The audit trail is deleted ahead of the case; case_deleted needs it.
+    instance._transitions = list(case_transitions([instance.pk]))
+
+
+@receiver(post_delete, sender=Case)
+def case_deleted(sender, instance, **kwargs):
+    # Runs for cascaded deletes too, which never call Case.delete().
+    old_state = (instance.status, instance.assigned_to_id, instance.created_by_id)
+    apply_counter_deltas(counter_deltas(old_state, None))
+    apply_rollup_deltas(rollup_deltas(old_state, None, instance.created_at, transitions=instance._transitions))
+    invalidate_case(old_state)
+    unindex_cases([instance.pk])
+
+
+@receiver(post_delete, sender=Case)
+def delete_case_files(sender, instance, **kwargs):
+    for file in (instance.uploaded_file, instance.report_file):
+        if file:
+            file.storage.delete(file.name)
+
+
+@receiver(post_delete, sender=CaseMessage)
+def delete_message_file(sender, instance, **kwargs):
+    # An archived message's attachment stays for the archive; see cases.archive.
+    if instance.file and not ArchivedAttachment.objects.filter(name=instance.file.name).exists():
+        instance.file.storage.delete(instance.file.name)
+
+
+@receiver(post_delete, sender=ArchivedAttachment)
+def delete_archived_attachment(sender, instance, **kwargs):
+    CaseMessage._meta.get_field('file').storage.delete(instance.name)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def drop_user_counters(sender, instance, **kwargs):
+    # Assigned cases are detached with SET_NULL, which bypasses Case.save().
+    CaseStatusCounter.objects.filter(scope__in=['handler', 'creator'], owner_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_counts(sender, instance, update_fields=None, **kwargs):
+    # The admin cards count users and handlers; logins only touch last_login.
+    if update_fields is None or {'is_staff', 'is_superuser'} & set(update_fields):
+        invalidate_scopes([scope_key('global')])
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_group_counts(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_scopes([scope_key('global')])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def queue_user_reindex(sender, instance, created, update_fields=None, **kwargs):
+    # Usernames are part of the search document of every case the user is on,
+    # which can be thousands: the worker reindexes them after the response.
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    enqueue(reindex_user_cases, instance.pk, dedup_key=f'reindex-user:{instance.pk}')
+
+
+@receiver(post_save, sender=CaseMessage)
+def publish_message(sender, instance, created, **kwargs):
+    if created and has_listeners(instance.case_id):
+        transaction.on_commit(lambda: hub.publish(instance.case_id, message_event(instance)))
+
+
+@receiver(post_save, sender=CaseHistory)
+def publish_history(sender, instance, created, **kwargs):
+    if created and has_listeners(instance.case_id):
+        transaction.on_commit(lambda: hub.publish(instance.case_id, history_event(instance)))
@@ -0,0 +1,46 @@
+from django.db.models import Count, Q
+
+
+# Status value for every bucket we count. 'Assigned' is not an FSM state but
+# AssignHandlerInlineView writes it directly, so it gets a bucket of its own.
+STATUS_BUCKETS = {
+    'pending': 'Pending',
+    'approved': 'Approved',
+    'assigned': 'Assigned',
+    'in_progress': 'In Progress',
+    'waiting_for_info': 'Waiting for Info',
+    'resolved': 'Resolved',
+    'closed': 'Closed',
+}
+
+
+def derive_buckets(counts):
+    """
+    Add the composite buckets the dashboards display on top of the raw
+    per-status counts (which must include 'total').
+    """
+    total = counts['total']
+    counts['active'] = total - counts['pending'] - counts['approved'] - counts['closed']
+    counts['ongoing'] = counts['active'] - counts['assigned']
+    counts['open'] = total - counts['pending'] - counts['closed']
+    counts['not_closed'] = total - counts['closed']
+    return counts
+
+
+def case_status_counts(queryset):
+    """
+    Count every status bucket of ``queryset`` in a single aggregate query.
+
+    ``queryset`` is the scope: all cases, a handler's or a user's cases, or a
+    search result.
+    """
+    aggregates = {'total': Count('pk')}
+    for bucket, status in STATUS_BUCKETS.items():
+        aggregates[bucket] = Count('pk', filter=Q(status=status))
+
+    counts = queryset.order_by().aggregate(**aggregates)
+    return derive_buckets(counts)
+
+
+def get_percent(count, total):
+    return int((count / total) * 100) if total else 0
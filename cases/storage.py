@@ -0,0 +1,268 @@
+"""
+Content-addressed storage for case evidence and chat attachments.
+
+DedupStorage is a FileSystemStorage that keeps each distinct content once.
+A file saved under one of DEDUP_DIRS is hashed as it's written and stored
+as MEDIA_ROOT/.blobs/<2 hex>/<sha256>. The name it was saved under is a
+hard link to that blob. FileField names and URLs stay what they were, and
+the web server serves them as before; only the bytes are shared.
+
+MediaFile maps each name to its blob and MediaBlob counts the names per
+blob. Deleting the last name of a blob deletes the blob too. Where a hard
+link isn't possible, e.g. across filesystems, the name gets its own copy
+and is still counted, so deletes stay correct. The rows go in the caller's
+transaction and the files only once it commits, so a rollback never leaves
+a counted name without its file.
+
+Deleting a case or a chat message deletes its files (cases.signals); a chat
+attachment outlives its message while the archive refers to it
+(ArchivedAttachment). Files replaced or otherwise dropped without a delete
+are found by collect_media(), run by the collect_media command.
+
+dedup_tree(), run by the dedup_media command, converts an existing media
+tree in place and repairs the counts.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+DEDUP_DIRS = ('case_files/', 'chat_files/')
+BLOB_DIR = '.blobs'
+READ_SIZE = 64 * 1024
+
+
+def blob_name(digest):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as content:
+        while data := content.read(READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    """Hard link ``target`` to ``source``, or copy it; fails if ``target`` exists."""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            shutil.copyfileobj(src, dst, READ_SIZE)
+
+
+class DedupStorage(FileSystemStorage):
+    def deduplicated(self, name):
+        return str(name).replace('\\', '/').startswith(DEDUP_DIRS)
+
+    def _save(self, name, content):
+        if not self.deduplicated(name):
+            return super()._save(name, content)
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk; the blob can be a link to it. Its owner deletes it.
+            staged, owned = content.temporary_file_path(), False
+            # Chunked uploads (cases.uploads) come with the digest they were checked against.
+            digest = getattr(content, 'sha256', None) or file_digest(staged)
+            size = os.path.getsize(staged)
+        else:
+            staged, digest, size = self.stage(content)
+            owned = True
+        try:
+            return self.store(name, staged, digest, size)
+        finally:
+            if owned and os.path.exists(staged):
+                os.unlink(staged)
+
+    def stage(self, content):
+        """Write ``content`` to a temporary file next to the blobs, hashing it on the way."""
+        directory = self.path(BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        handle, staged = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as output:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                digest.update(chunk)
+                output.write(chunk)
+                size += len(chunk)
+        return staged, digest.hexdigest(), size
+
+    def store(self, name, staged, digest, size):
+        from .models import MediaBlob, MediaFile
+
+        blob_path = self.path(blob_name(digest))
+        with transaction.atomic():
+            # The lock keeps a concurrent delete from removing the blob under us.
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(digest=digest, defaults={'size': size})
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                link_or_copy(staged, blob_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(blob_path, self.file_permissions_mode)
+            while True:
+                full_path = self.path(name)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                try:
+                    link_or_copy(blob_path, full_path)
+                    break
+                except FileExistsError:
+                    # Taken since save() chose the name.
+                    name = self.get_available_name(name)
+            # A row left behind by a file removed outside the storage.
+            stale = MediaFile.objects.filter(name=name).first()
+            if stale is not None and stale.blob_id == digest:
+                return str(name).replace('\\', '/')
+            self.release(name)
+            MediaFile.objects.create(name=name, blob=blob)
+            MediaBlob.objects.filter(pk=digest).update(refcount=F('refcount') + 1)
+        return str(name).replace('\\', '/')
+
+    def release(self, name):
+        """Drop ``name``'s reference to its blob, deleting the blob with its last reference."""
+        from .models import MediaBlob, MediaFile
+
+        media_file = MediaFile.objects.filter(name=name).first()
+        if media_file is None:
+            return
+        blob = MediaBlob.objects.select_for_update().get(pk=media_file.blob_id)
+        media_file.delete()
+        if blob.refcount > 1:
+            MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+            return
+        digest = blob.digest
+        blob.delete()
+        # Until then a rollback can bring the row back.
+        transaction.on_commit(lambda: FileSystemStorage.delete(self, blob_name(digest)))
+
+    def delete(self, name):
+        if not self.deduplicated(name):
+            return super().delete(name)
+        with transaction.atomic():
+            self.release(name)
+            transaction.on_commit(lambda: FileSystemStorage.delete(self, name))
+
+
+def dedup_tree(storage, dry_run=False, log=None):
+    """
+    Bring the files already under DEDUP_DIRS into ``storage``'s blobs:
+    replace each duplicate with a hard link to its blob, record every name,
+    recount the references and delete blobs nothing references. Run it
+    while nothing else saves media: a blob being saved has no row yet. Returns
+    {'files', 'duplicates', 'bytes_saved'}; with ``dry_run`` only counts.
+    """
+    from .models import MediaBlob, MediaFile
+
+    known = dict(MediaFile.objects.values_list('name', 'blob_id'))
+    seen = set()
+    stats = {'files': 0, 'duplicates': 0, 'bytes_saved': 0}
+    first_paths = {}  # digest -> the first file seen with it, for dry runs
+    for directory in DEDUP_DIRS:
+        root = storage.path(directory)
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                if os.path.islink(full_path) or filename.endswith('.dedup'):
+                    continue
+                name = os.path.relpath(full_path, storage.location).replace(os.sep, '/')
+                digest, size = file_digest(full_path), os.path.getsize(full_path)
+                seen.add(name)
+                stats['files'] += 1
+                blob_path = storage.path(blob_name(digest))
+                if dry_run:
+                    first_path = first_paths.setdefault(digest, full_path)
+                    if not os.path.samefile(first_path, full_path):
+                        stats['duplicates'] += 1
+                        stats['bytes_saved'] += size
+                    continue
+                with transaction.atomic():
+                    blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                        digest=digest, defaults={'size': size},
+                    )
+                    if not os.path.exists(blob_path):
+                        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                        link_or_copy(full_path, blob_path)
+                    elif not os.path.samefile(full_path, blob_path):
+                        # Swap the copy for a link in one rename; readers always see a file.
+                        temporary = f'{full_path}.dedup'
+                        link_or_copy(blob_path, temporary)
+                        os.replace(temporary, full_path)
+                        stats['duplicates'] += 1
+                        stats['bytes_saved'] += size
+                    if known.get(name) != digest:
+                        MediaFile.objects.update_or_create(name=name, defaults={'blob': blob})
+                if log and stats['files'] % 1000 == 0:
+                    log(f"{stats['files']} files, {stats['duplicates']} duplicates")
+    if dry_run:
+        return stats
+
+    with transaction.atomic():
+        # Names whose files are gone no longer hold their blobs.
+        MediaFile.objects.exclude(name__in=seen).delete()
+        MediaBlob.objects.update(refcount=Coalesce(
+            Subquery(
+                MediaFile.objects.filter(blob=OuterRef('pk')).order_by()
+                .values('blob').annotate(n=Count('pk')).values('n')
+            ),
+            0,
+        ))
+        MediaBlob.objects.filter(refcount=0).delete()
+        # Blobs without a row: unreferenced, or left by a save whose transaction rolled back.
+        blobs = set(MediaBlob.objects.values_list('digest', flat=True))
+        for dirpath, dirnames, filenames in os.walk(storage.path(BLOB_DIR)):
+            for filename in filenames:
+                if filename not in blobs:
+                    os.unlink(os.path.join(dirpath, filename))
+    return stats
+
+
+def referenced_names():
+    """Every media name a row refers to: case evidence and reports, chat attachments live and archived."""
+    from .models import ArchivedAttachment, Case, CaseMessage
+
+    names = set(ArchivedAttachment.objects.values_list('name', flat=True))
+    for field in ('uploaded_file', 'report_file'):
+        names.update(Case.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True}).values_list(field, flat=True))
+    names.update(CaseMessage.objects.exclude(file='').exclude(file__isnull=True).values_list('file', flat=True))
+    return names
+
+
+def collect_media(storage, min_age=3600, dry_run=False, log=None):
+    """
+    Delete the names under DEDUP_DIRS that no row refers to, e.g. evidence
+    replaced by a newer upload, dropping their blob references. Names
+    linked in the last ``min_age`` seconds are left alone: their rows may
+    not have committed yet. Returns how many were (or, with ``dry_run``,
+    would be) deleted.
+    """
+    from .models import MediaFile
+
+    referenced = referenced_names()
+    cutoff = time.time() - min_age
+    count = 0
+    for name in MediaFile.objects.values_list('name', flat=True).iterator():
+        if name in referenced:
+            continue
+        try:
+            # A new link changes the inode's ctime; its mtime is the blob's.
+            if os.stat(storage.path(name)).st_ctime > cutoff:
+                continue
+        except FileNotFoundError:
+            pass
+        count += 1
+        if log:
+            log(name)
+        if not dry_run:
+            storage.delete(name)
+    return count
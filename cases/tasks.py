@@ -0,0 +1,225 @@
+"""
+Background tasks, queued in the database and run by ``manage.py run_tasks``.
+
+Work a response doesn't wait for, e.g. reindexing every case of a renamed
+user or rendering thumbnails, is queued with enqueue() instead of done in
+the request. A queued task is a Task row written in the caller's
+transaction, so it's queued exactly when the change that asked for it
+commits, and no broker is needed.
+
+Task functions are decorated with @task and called with JSON-serializable
+arguments. A task that raises is retried after an exponential backoff, up
+to its max_attempts, then left as failed with its last error. Tasks given a
+dedup_key are queued at most once until a worker picks them up: queueing
+the same key again returns the task already waiting.
+
+The module doesn't import models at load time, so modules defining tasks
+stay importable where Django isn't set up, e.g. in a process pool.
+
+Workers claim due tasks with SELECT ... FOR UPDATE SKIP LOCKED where the
+database has it (PostgreSQL, MySQL 8), so any number of them poll the same
+table without waiting on each other; on SQLite, which has one writer at a
+time anyway, claiming is a single conditional UPDATE. A task whose worker died is
+queued again once it has been running for TASK_TIMEOUT.
+
+With CASE_TASKS_EAGER, tasks run in the process that queues them as soon as
+its transaction commits, for development without a worker.
+"""
+import datetime
+import logging
+import os
+import random
+import socket
+import traceback
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# Seconds before the first retry; each further one waits twice as long, up to BACKOFF_MAX.
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+# Seconds a task may run before it's assumed lost with its worker.
+TASK_TIMEOUT = 600
+
+
+class UnknownTask(Exception):
+    pass
+
+
+def task(func=None, *, max_attempts=MAX_ATTEMPTS):
+    """Make ``func`` a task that enqueue() can queue; it stays callable directly."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        wrapper.task_name = f'{func.__module__}.{func.__qualname__}'
+        wrapper.max_attempts = max_attempts
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def eager():
+    return getattr(settings, 'CASE_TASKS_EAGER', False)
+
+
+def task_timeout():
+    return getattr(settings, 'CASE_TASK_TIMEOUT', TASK_TIMEOUT)
+
+
+def resolve(name):
+    try:
+        func = import_string(name)
+    except ImportError:
+        raise UnknownTask(f"No task {name!r}.") from None
+    if getattr(func, 'task_name', None) != name:
+        raise UnknownTask(f"{name!r} isn't decorated with @task.")
+    return func
+
+
+def enqueue(func, *args, dedup_key=None, delay=0, **kwargs):
+    """
+    Queue ``func(*args, **kwargs)`` to run in a worker, ``delay`` seconds
+    from now at the earliest; returns the Task, or None in eager mode.
+    """
+    from .models import Task
+
+    if not hasattr(func, 'task_name'):
+        raise UnknownTask(f"{func!r} isn't decorated with @task.")
+    if eager():
+        transaction.on_commit(lambda: func(*args, **kwargs))
+        return None
+    fields = {
+        'name': func.task_name,
+        'args': list(args),
+        'kwargs': kwargs,
+        'max_attempts': func.max_attempts,
+        'run_at': timezone.now() + datetime.timedelta(seconds=delay),
+    }
+    if dedup_key is None:
+        return Task.objects.create(**fields)
+    queued = Task.objects.filter(dedup_key=dedup_key, status=Task.QUEUED).first()
+    if queued is not None:
+        return queued
+    try:
+        with transaction.atomic():
+            return Task.objects.create(dedup_key=dedup_key, **fields)
+    except IntegrityError:
+        # Another process queued it since we looked.
+        return Task.objects.get(dedup_key=dedup_key, status=Task.QUEUED)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, limit=1):
+    """Mark up to ``limit`` due tasks as running for ``worker`` and return them."""
+    from .models import Task
+
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    claimed = {'status': Task.RUNNING, 'locked_by': worker, 'locked_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Task.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        # One statement: SQLite takes the write lock up front instead of
+        # failing to upgrade a read lock, and the status condition keeps two
+        # workers from both taking a task.
+        Task.objects.filter(pk__in=due.values('pk')[:limit], status=Task.QUEUED).update(**claimed)
+    return list(Task.objects.filter(status=Task.RUNNING, locked_by=worker, locked_at=now).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    """Seconds before retrying a task that failed ``attempts`` times, jittered so retries spread out."""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.75, 1.0)
+
+
+def finish(task, **fields):
+    """Record how ``task`` ended, unless it was reclaimed after a timeout meanwhile."""
+    from .models import Task
+
+    return Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_by=task.locked_by).update(**fields)
+
+
+def retry_or_fail(task, error):
+    from .models import Task
+
+    if task.attempts >= task.max_attempts:
+        finish(task, status=Task.FAILED, last_error=error, finished_at=timezone.now())
+        return
+    fields = {
+        'status': Task.QUEUED,
+        'run_at': timezone.now() + datetime.timedelta(seconds=backoff(task.attempts)),
+        'locked_by': '',
+        'locked_at': None,
+        'last_error': error,
+    }
+    try:
+        with transaction.atomic():
+            finish(task, **fields)
+    except IntegrityError:
+        # The same key was queued again while this ran; that run will do the work.
+        finish(task, status=Task.DONE, last_error=f"Superseded after: {error}", finished_at=timezone.now())
+
+
+def run_task(task):
+    """Run a claimed task and record the outcome; returns whether it succeeded."""
+    from .models import Task
+
+    try:
+        func = resolve(task.name)
+        func(*task.args, **task.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Task %s #%s failed (attempt %s of %s)", task.name, task.pk, task.attempts, task.max_attempts)
+        retry_or_fail(task, error)
+        return False
+    else:
+        finish(task, status=Task.DONE, last_error='', finished_at=timezone.now())
+        return True
+
+
+def requeue_lost(timeout=None):
+    """Give tasks running for longer than ``timeout`` seconds back to the queue; returns how many."""
+    from .models import Task
+
+    cutoff = timezone.now() - datetime.timedelta(seconds=timeout or task_timeout())
+    lost = Task.objects.filter(status=Task.RUNNING, locked_at__lt=cutoff)
+    for task in lost:
+        retry_or_fail(task, f"Timed out on {task.locked_by}.")
+    return len(lost)
+
+
+def run_pending(worker=None, limit=None):
+    """Run due tasks one at a time in this thread until none are left, or ``limit``; returns how many."""
+    worker = worker or worker_name()
+    count = 0
+    while limit is None or count < limit:
+        claimed = claim(worker)
+        if not claimed:
+            break
+        run_task(claimed[0])
+        count += 1
+    return count
+
+
+def purge_finished(days=7):
+    """Delete tasks that succeeded more than ``days`` days ago; failed ones are kept for inspection."""
+    from .models import Task
+
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()
+    return deleted
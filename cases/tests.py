@@ -1,3 +1,1262 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core import mail, serializers
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models.signals import post_init
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .archive import archive_case, archive_cases, load_archive
+from .assignment import OPEN_STATUSES
+from .counters import rebuild_counters, verify_counters
+from .dashboard_cache import cached_status_counts
+from .events import SUBSCRIBER_QUEUE_SIZE, DatabaseBroker, LocalBroker, hub, load_broker
+from .importer import iter_records
+from .uploads import start_upload, write_chunk
+from . import storage, tasks, uploads
+from . import export
+from .loadgen import LoadGenerator
+from .query_plans import compare_plans
+from .models import (
+    ArchivedAttachment, Case, CaseArchive, CaseDailyStat, CaseHistory, CaseMessage, ChunkedUpload, MediaBlob, MediaFile,
+    HandlerCapacity, Notification, Task,
+)
+from .rollups import daily_series, rebuild_rollups, verify_rollups
+from .search import index_cases, search_cases
+from .tasks import task
+from . import urls as case_urls
+
+
+FIXTURE = settings.BASE_DIR / 'data.json'
+
+# Only the application data from the dump; content types, permissions,
+# sessions and admin log entries are environment specific.
+FIXTURE_MODELS = {
+    'auth.group',
+    'accounts.customuser',
+    'cases.case',
+    'cases.casemessage',
+    'cases.casehistory',
+}
+
+STATUSES = ['Pending', 'Approved', 'Assigned', 'In Progress', 'Waiting for Info', 'Resolved', 'Closed']
+
+
+def url_names(urlconf):
+    return {pattern.name for pattern in urlconf.urlpatterns if pattern.name}
+
+
+class Measurement:
+    def __init__(self, response, queries, rows):
+        self.response = response
+        self.queries = queries
+        self.rows = rows
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    def report(self):
+        return '\n'.join(f"  {index}. {query['sql']}" for index, query in enumerate(self.queries, 1))
+
+
+@contextmanager
+def count_rows():
+    """Count the model instances built from database rows while the block runs."""
+    counter = {'rows': 0}
+
+    def on_init(sender, **kwargs):
+        counter['rows'] += 1
+
+    post_init.connect(on_init, weak=False)
+    try:
+        yield counter
+    finally:
+        post_init.disconnect(on_init)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Loads the data.json fixture and measures how many queries and rows a
+    request costs. Subclasses declare BUDGETS as {url_name: (max_queries,
+    max_rows)} and call assertBudget() before and after grow(), which
+    multiplies the data set, to check the cost doesn't depend on its size.
+    """
+    BUDGETS = {}
+    GROWTH = 60  # synthetic cases added per grow()
+
+    @classmethod
+    def setUpTestData(cls):
+        with open(FIXTURE, encoding='utf-8') as fixture:
+            records = [record for record in json.load(fixture) if record['model'] in FIXTURE_MODELS]
+        for obj in serializers.deserialize('python', records, ignorenonexistent=True):
+            obj.save()
+        # Raw fixture saves skip Case.save(), so derive what it maintains.
+        rebuild_counters()
+        rebuild_rollups()
+        index_cases()
+
+        User = get_user_model()
+        cls.handler_group = Group.objects.get(name='handler')
+        cls.admin = User.objects.filter(is_superuser=True).first()
+        cls.handler = max(User.objects.filter(groups=cls.handler_group), key=lambda u: u.cases_assigned.count())
+        cls.user = max(User.objects.filter(role='user'), key=lambda u: u.cases_created.count())
+        cls.case = cls.user.cases_created.order_by('pk').first()
+        cls.synthetic = 0
+
+    def setUp(self):
+        # Cached dashboard fragments outlive the rolled back test data.
+        cache.clear()
+        # Pages rendering profile images through |thumbnail don't write into the real media.
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    @classmethod
+    def grow(cls, cases=None):
+        """Add users, handlers, cases, messages and history in bulk."""
+        cases = cases or cls.GROWTH
+        User = get_user_model()
+        rng = random.Random(cls.synthetic)
+        start = cls.synthetic
+        cls.synthetic += cases
+
+        people = User.objects.bulk_create(
+            User(username=f'synthetic{start + i}', role='handler' if i % 4 == 0 else 'user')
+            for i in range(cases // 2)
+        )
+        handlers = [person for person in people if person.role == 'handler'] + [cls.handler]
+        creators = [person for person in people if person.role == 'user'] + [cls.user]
+        User.groups.through.objects.bulk_create(
+            User.groups.through(customuser_id=handler.pk, group_id=cls.handler_group.pk)
+            for handler in handlers[:-1]
+        )
+
+        new_cases = Case.objects.bulk_create(
+            Case(
+                title=f'Synthetic case {start + i}',
+                description='Generated to check query counts',
+                status=status,
+                created_by=rng.choice(creators),
+                assigned_to=None if status in ('Pending', 'Approved') else rng.choice(handlers),
+            )
+            for i, status in enumerate(rng.choice(STATUSES) for _ in range(cases))
+        )
+        CaseMessage.objects.bulk_create(
+            CaseMessage(case=case, sender=case.created_by, message='Any update?')
+            for case in new_cases for _ in range(3)
+        )
+        CaseHistory.objects.bulk_create(
+            CaseHistory(case=case, action='Case Registered', performed_by=case.created_by)
+            for case in new_cases
+        )
+        rebuild_counters()
+        index_cases()
+
+    def measure(self, user, method, url, data=None):
+        self.client.logout()
+        if user is not None:
+            self.client.force_login(user)
+        with count_rows() as rows, CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        return Measurement(response, queries.captured_queries, rows['rows'])
+
+    def assertBudget(self, name, measurement):
+        max_queries, max_rows = self.BUDGETS[name]
+        self.assertLess(measurement.response.status_code, 400, f"{name} answered {measurement.response.status_code}")
+        self.assertLessEqual(
+            measurement.query_count, max_queries,
+            f"{name} ran {measurement.query_count} queries (budget {max_queries}):\n{measurement.report()}",
+        )
+        self.assertLessEqual(
+            measurement.rows, max_rows,
+            f"{name} fetched {measurement.rows} rows (budget {max_rows}):\n{measurement.report()}",
+        )
+
+    def assertScales(self, name, before, after):
+        self.assertEqual(
+            before.query_count, after.query_count,
+            f"{name} went from {before.query_count} to {after.query_count} queries as the data grew:\n"
+            f"{after.report()}",
+        )
+
+    def check_scaling(self, requests):
+        """
+        ``requests`` maps url names to callables returning a Measurement.
+        Each is measured, the data set is grown, and each is measured again.
+        Requests run once unmeasured first: the first write after a fixture
+        load or a counter rebuild may create the counter rows it updates.
+        """
+        def warm(request):
+            request()
+            return request()
+
+        before = {name: warm(request) for name, request in requests.items()}
+        for name, measurement in before.items():
+            self.assertBudget(name, measurement)
+        self.grow()
+        self.grow()
+        for name, request in requests.items():
+            after = warm(request)
+            self.assertBudget(name, after)
+            self.assertScales(name, before[name], after)
+
+
+class CaseQueryBudgetTests(QueryBudgetTestCase):
+    BUDGETS = {
+        'register_case': (4, 5),
+        'assign_handler_inline': (18, 10),
+        'case_detail': (8, 40),
+        'get_messages': (5, 30),
+        # Reads the file, not the database.
+        'case_archive': (3, 5),
+        # Under WSGI the stream is refused; see CaseEventTests for ASGI.
+        'case_events': (2, 2),
+        'upload_start': (5, 5),
+        'upload_chunk': (4, 5),
+        'upload_complete': (18, 11),
+    }
+
+    def test_every_url_has_a_budget(self):
+        self.assertLessEqual(url_names(case_urls), set(self.BUDGETS))
+
+    def test_read_views(self):
+        # An archive whose file is gone reads as empty.
+        CaseArchive.objects.create(case=self.case, path='missing.jsonl.gz', archived_at=timezone.now())
+        self.check_scaling({
+            'register_case': lambda: self.measure(self.user, 'get', reverse('register_case')),
+            'case_detail': lambda: self.measure(self.user, 'get', reverse('case_detail', args=[self.case.pk])),
+            'get_messages': lambda: self.measure(self.user, 'get', reverse('get_messages', args=[self.case.pk])),
+            'case_archive': lambda: self.measure(self.user, 'get', reverse('case_archive', args=[self.case.pk])),
+            'case_events': lambda: self.measure(self.user, 'get', reverse('case_events', args=[self.case.pk])),
+        })
+
+    def test_assign_handler(self):
+        def assign():
+            case = Case.objects.create(title='To assign', description='d', created_by=self.user, status='Approved')
+            return self.measure(
+                self.admin, 'post', reverse('assign_handler_inline', args=[case.pk]),
+                {'assigned_to': self.handler.pk},
+            )
+
+        self.check_scaling({'assign_handler_inline': assign})
+
+    def test_uploads(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+        def sent(size=3):
+            upload = start_upload(self.user, self.case, ChunkedUpload.MESSAGE, 'notes.txt', size)
+            return write_chunk(upload.pk, self.user, 0, io.BytesIO(b'abc'), 3)
+
+        self.check_scaling({
+            'upload_start': lambda: self.measure(
+                self.user, 'post', reverse('upload_start', args=[self.case.pk]),
+                {'target': 'message', 'filename': 'notes.txt', 'size': 3},
+            ),
+            'upload_chunk': lambda: self.measure(self.user, 'get', reverse('upload_chunk', args=[sent().pk])),
+            'upload_complete': lambda: self.measure(
+                self.user, 'post', reverse('upload_complete', args=[sent().pk]), {'message': 'See attached'},
+            ),
+        })
+
+
+class MessagePollingTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.stranger = User.objects.create(username='stranger', role='user')
+        self.case = Case.objects.create(title='Chat', description='d', created_by=self.user)
+        self.first = CaseMessage.objects.create(case=self.case, sender=self.user, message='Hello')
+        CaseMessage.objects.create(case=self.case, sender=self.user, message='Any news?')
+        self.url = reverse('get_messages', args=[self.case.pk])
+
+    def test_returns_the_messages_after_the_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {'since': self.first.pk})
+        self.assertEqual([message['text'] for message in response.json()['messages']], ['Any news?'])
+        response = self.client.get(self.url, {'since': self.first.pk}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_only_participants_may_read(self):
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+
+class CaseEventTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.stranger = User.objects.create(username='stranger', role='user')
+        self.case = Case.objects.create(title='Live', description='d', created_by=self.user)
+        self.url = reverse('case_events', args=[self.case.pk])
+
+    async def test_hub_delivers_to_the_case_subscribers(self):
+        with hub.subscribe(1) as subscription, hub.subscribe(2) as other:
+            hub.publish(1, {'type': 'message', 'id': 1})
+            self.assertEqual(await asyncio.wait_for(subscription.get(), 1), {'type': 'message', 'id': 1})
+            await asyncio.sleep(0)
+            self.assertTrue(other.queue.empty())
+        self.assertFalse(hub.has_subscribers(1))
+
+    async def test_slow_subscribers_lose_their_oldest_events(self):
+        with hub.subscribe(1) as subscription:
+            for event_id in range(SUBSCRIBER_QUEUE_SIZE + 5):
+                hub.publish(1, {'type': 'message', 'id': event_id})
+            await asyncio.sleep(0)
+            self.assertEqual(subscription.queue.qsize(), SUBSCRIBER_QUEUE_SIZE)
+            self.assertEqual((await subscription.get())['id'], 5)
+
+    async def test_streams_events_to_participants_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        hub.publish(self.case.pk, {'type': 'history', 'id': 7})
+        self.assertEqual(await asyncio.wait_for(anext(stream), 1), b'event: history\ndata: {"type": "history", "id": 7}\n\n')
+        await stream.aclose()
+
+    async def test_only_participants_may_listen(self):
+        await self.async_client.aforce_login(self.stranger)
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 404)
+
+    def test_database_broker_relays_events_from_other_processes(self):
+        other = Case.objects.create(title='Other', description='d', created_by=self.user)
+        publisher, receiver = DatabaseBroker(), DatabaseBroker()
+        receiver.hub = mock.Mock(subscribed_cases=lambda: [self.case.pk])
+        publisher.publish(self.case.pk, {'type': 'message', 'id': 1})
+        receiver.poll()  # the first poll skips what came before
+        publisher.publish(self.case.pk, {'type': 'message', 'id': 2})
+        publisher.publish(other.pk, {'type': 'message', 'id': 3})
+        receiver.publish(self.case.pk, {'type': 'message', 'id': 4})  # delivered locally already
+        receiver.poll()
+        receiver.hub.dispatch.assert_called_once_with(self.case.pk, {'type': 'message', 'id': 2})
+
+    def test_several_web_processes_relay_through_the_database(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertIsInstance(load_broker(), LocalBroker)
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            self.assertIsInstance(load_broker(), DatabaseBroker)
+            with override_settings(CASE_EVENTS_BROKER='cases.events.LocalBroker'):
+                self.assertIsInstance(load_broker(), LocalBroker)
+
+    def test_wsgi_gets_no_stream_and_the_page_polls(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 204)
+        self.assertFalse(self.client.get(reverse('case_detail', args=[self.case.pk])).context['live_events'])
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        # A cache every process shares; see test_a_process_local_cache_is_not_used.
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir.name},
+        }))
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.handler = User.objects.create(username='handler', role='handler')
+
+    def test_case_writes_invalidate_affected_scopes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            case = Case.objects.create(title='Cached', description='d', created_by=self.user)
+        self.assertEqual(cached_status_counts('global')['pending'], 1)
+        self.assertEqual(cached_status_counts('handler', self.handler.pk)['total'], 0)
+
+        with self.assertNumQueries(0):
+            cached_status_counts('global')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            case.status = 'Assigned'
+            case.assigned_to = self.handler
+            case.save()
+        self.assertEqual(cached_status_counts('global')['pending'], 0)
+        self.assertEqual(cached_status_counts('handler', self.handler.pk)['assigned'], 1)
+        self.assertEqual(cached_status_counts('creator', self.user.pk)['open'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            case.delete()
+        self.assertEqual(cached_status_counts('handler', self.handler.pk)['total'], 0)
+
+    def test_a_process_local_cache_is_not_used(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            cached_status_counts('global')
+            with self.assertNumQueries(1):
+                cached_status_counts('global')
+
+    def test_rebuilding_counters_invalidates_everything(self):
+        Case.objects.bulk_create([Case(title='Raw', description='d', created_by=self.user)])
+        self.assertEqual(cached_status_counts('creator', self.user.pk)['total'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_counters()
+        self.assertEqual(cached_status_counts('creator', self.user.pk)['total'], 1)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.handler = User.objects.create(username='handler', role='handler')
+
+    def test_writes_keep_rollups_in_sync(self):
+        case = Case.objects.create(title='Rolled', description='d', created_by=self.user)
+        for status in ['Approved', 'Assigned', 'Resolved', 'Closed']:
+            case.status = status
+            case.assigned_to = self.handler if status != 'Approved' else None
+            case.save()
+        Case.objects.create(title='Deleted', description='d', created_by=self.user).delete()
+
+        today = timezone.localdate()
+        series = daily_series(today, today)
+        self.assertEqual(
+            [series[field] for field in ('created', 'approved', 'resolved', 'closed')],
+            [[1], [1], [1], [1]],
+        )
+        self.assertEqual(daily_series(today, today, self.handler.pk)['resolved'], [1])
+        self.assertEqual(verify_rollups(), {})
+
+        CaseDailyStat.objects.all().delete()
+        rebuild_rollups()
+        self.assertEqual(daily_series(today, today)['created'], [1])
+
+    def test_a_deleted_case_leaves_the_rollups(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        case = Case.objects.create(title='Deleted', description='d', created_by=self.user)
+        for status in ['Approved', 'Assigned', 'Resolved']:
+            case.status = status
+            case.assigned_to = self.handler if status != 'Approved' else None
+            case.save()
+        archive_case(case.pk)
+        case.status = 'Closed'
+        case.save()
+        case.delete()
+
+        today = timezone.localdate()
+        series = daily_series(today, today)
+        self.assertEqual(
+            [series[field] for field in ('created', 'approved', 'resolved', 'closed')],
+            [[0], [0], [0], [0]],
+        )
+        self.assertEqual(daily_series(today, today, self.handler.pk)['resolved'], [0])
+        call_command('rebuild_case_rollups', verify_only=True, stdout=io.StringIO())
+
+    def test_chart_reads_the_requested_range(self):
+        admin = get_user_model().objects.create_superuser(username='boss', password='pw')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin_dashboard'), {'days': 90})
+        self.assertEqual(response.context['chart_days'], 90)
+        self.assertEqual(len(json.loads(response.context['cases_per_day_labels'])), 90)
+        self.assertEqual(self.client.get(reverse('admin_dashboard'), {'days': 'x'}).context['chart_days'], 7)
+
+
+class AuditTrailTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.handler = User.objects.create(username='handler', role='handler')
+
+    def test_each_save_logs_one_structured_event(self):
+        case = Case.objects.create(title='Audited', description='d', created_by=self.user)
+        case.status = 'Assigned'
+        case.assigned_to = self.handler
+        case.save(actor=self.user)
+        case.location = 'Lahore'
+        case.save(actor=self.handler, action="Location added")
+        case.save()
+
+        self.assertEqual(
+            [(entry.event, entry.changes, entry.action, entry.performed_by) for entry in case.custom_history.order_by('id')],
+            [
+                (CaseHistory.CREATED, {'status': [None, 'Pending']}, 'Case Registered', None),
+                (
+                    CaseHistory.ASSIGNMENT,
+                    {'status': ['Pending', 'Assigned'], 'assigned_to': [None, self.handler.pk]},
+                    'Case assigned to handler (handler)', self.user,
+                ),
+                (CaseHistory.UPDATE, {'location': [None, 'Lahore']}, 'Location added', self.handler),
+            ],
+        )
+
+    def test_transitions_write_one_row(self):
+        case = Case.objects.create(
+            title='Audited', description='d', created_by=self.user, assigned_to=self.handler, status='In Progress',
+        )
+        self.client.force_login(self.handler)
+        self.client.post(reverse('update_status', args=[case.pk]), {'status': 'Resolved'})
+
+        entry = case.custom_history.latest('id')
+        self.assertEqual(case.custom_history.count(), 2)
+        self.assertEqual(entry.changes, {'status': ['In Progress', 'Resolved']})
+        self.assertEqual(entry.performed_by, self.handler)
+
+    def test_history_reads_like_historical_case_records(self):
+        case = Case.objects.create(title='Audited', description='d', created_by=self.user)
+        registered = timezone.now()
+        case.status = 'Assigned'
+        case.assigned_to = self.handler
+        case.save(actor=self.user)
+        case.title = 'Renamed'
+        case.save(actor=self.handler)
+        CaseMessage.objects.create(case=case, sender=self.user, message='hi')
+
+        records = list(case.history.all())
+        self.assertEqual([record.history_type for record in records], ['~', '~', '+'])
+        self.assertEqual([record.title for record in records], ['Renamed', 'Audited', 'Audited'])
+        self.assertEqual([record.status for record in records], ['Assigned', 'Assigned', 'Pending'])
+        self.assertEqual(records[1].assigned_to, self.handler)
+        self.assertEqual(records[0].history_user, self.handler)
+        self.assertIs(records[0].prev_record, records[1])
+        self.assertEqual(case.history.as_of(registered).status, 'Pending')
+        self.assertEqual(case.history.most_recent().title, 'Renamed')
+        self.assertEqual(case.history.order_by('history_date').first().history_type, '+')
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.handler = User.objects.create(username='handler', role='handler')
+        self.case = Case.objects.create(title='Old', description='d', created_by=self.user)
+        self.case.status, self.case.assigned_to = 'Assigned', self.handler
+        self.case.save(actor=self.user)
+        self.case.status = 'Closed'
+        self.case.save(actor=self.handler)
+        CaseMessage.objects.create(case=self.case, sender=self.handler, message='Done')
+        Case.objects.filter(pk=self.case.pk).update(updated_at=timezone.now() - datetime.timedelta(days=400))
+        Case.objects.create(title='Recent', description='d', created_by=self.user, status='Closed')
+
+    def test_moves_old_closed_cases_out_of_the_database(self):
+        self.assertEqual(archive_cases(), (1, 4))
+        self.assertFalse(self.case.custom_history.exists())
+        self.assertFalse(CaseMessage.objects.filter(case=self.case).exists())
+        self.assertEqual(archive_cases(), (0, 0))
+
+        archive = CaseArchive.objects.get(case=self.case)
+        self.assertEqual((archive.history_count, archive.message_count), (3, 1))
+        archived = load_archive(self.case)
+        self.assertEqual([entry['event'] for entry in archived['history']], ['transition', 'assignment', 'created'])
+        self.assertEqual(archived['messages'][0]['message'], 'Done')
+
+        # The rollups still see the archived transitions.
+        self.assertEqual(verify_rollups(), {})
+
+    def test_detail_page_loads_the_archive(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('case_archive', args=[self.case.pk])).status_code, 404)
+
+        archive_cases()
+        response = self.client.get(reverse('case_detail', args=[self.case.pk]))
+        self.assertContains(response, 'id="load-archive"')
+        response = self.client.get(reverse('case_archive', args=[self.case.pk]))
+        self.assertEqual(len(response.json()['history']), 3)
+        self.assertEqual(response.json()['messages'][0]['sender'], 'handler')
+
+    def test_only_participants_may_load_the_archive(self):
+        archive_cases()
+        stranger = get_user_model().objects.create(username='stranger', role='user')
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(reverse('case_archive', args=[self.case.pk])).status_code, 404)
+
+
+@override_settings(CASE_UPLOAD_MAX_SIZE=100)
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        User = get_user_model()
+        self.user = User.objects.create(username='reporter', role='user')
+        self.other = User.objects.create(username='other', role='user')
+        self.case = Case.objects.create(title='Evidence', description='d', created_by=self.user)
+        self.client.force_login(self.user)
+
+    def start(self, target='evidence', size=10):
+        return self.client.post(
+            reverse('upload_start', args=[self.case.pk]),
+            json.dumps({'target': target, 'filename': '../clip.mp4', 'size': size}),
+            content_type='application/json',
+        )
+
+    def chunk(self, url, offset, data, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum:
+            headers['Upload-Checksum'] = f'sha256 {checksum}'
+        return self.client.patch(url, data, content_type='application/offset+octet-stream', headers=headers)
+
+    def test_resumes_and_attaches_atomically(self):
+        upload = self.start().json()
+        self.assertEqual(self.chunk(upload['url'], 0, b'01234').json()['offset'], 5)
+        # A retried or skipped chunk is refused; the client asks where to resume.
+        self.assertEqual(self.chunk(upload['url'], 0, b'01234').status_code, 409)
+        self.assertEqual(self.chunk(upload['url'], 5, b'56789', checksum='0' * 64).status_code, 422)
+        self.assertEqual(self.client.get(upload['url']).json()['offset'], 5)
+        self.assertEqual(self.client.post(f"{upload['url']}complete/").status_code, 409)
+
+        self.chunk(upload['url'], 5, b'56789', checksum=hashlib.sha256(b'56789').hexdigest())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"{upload['url']}complete/", {'sha256': hashlib.sha256(b'0123456789').hexdigest()},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.uploaded_file.name, 'case_files/clip.mp4')
+        self.assertEqual(self.case.uploaded_file.read(), b'0123456789')
+        self.assertEqual(self.case.custom_history.latest('id').changes, {'uploaded_file': [None, 'case_files/clip.mp4']})
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(uploads.upload_root()), [])
+
+    def test_completion_hashes_the_file_once(self):
+        upload = self.start(size=4).json()
+        self.chunk(upload['url'], 0, b'abcd')
+        with mock.patch('cases.storage.file_digest') as file_digest:
+            response = self.client.post(f"{upload['url']}complete/", {'sha256': hashlib.sha256(b'abcd').hexdigest()})
+        self.assertEqual(response.status_code, 200)
+        file_digest.assert_not_called()
+        self.assertEqual(MediaFile.objects.get(name='case_files/clip.mp4').blob_id, hashlib.sha256(b'abcd').hexdigest())
+
+    def test_registration_sends_the_evidence_in_chunks(self):
+        response = self.client.post(reverse('register_case'), {
+            'title': 'Lights out', 'description': 'd', 'location': 'F-10',
+        }, headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 201)
+        registered = response.json()
+        upload = self.client.post(
+            registered['upload_url'],
+            json.dumps({'target': 'evidence', 'filename': 'photo.jpg', 'size': 3}),
+            content_type='application/json',
+        ).json()
+        self.chunk(upload['url'], 0, b'jpg')
+        self.client.post(f"{upload['url']}complete/", {'sha256': hashlib.sha256(b'jpg').hexdigest()})
+        case = Case.objects.get(pk=registered['case'])
+        self.assertEqual(case.uploaded_file.name, 'case_files/photo.jpg')
+        self.assertEqual(
+            self.client.post(reverse('register_case'), {}, headers={'Accept': 'application/json'}).status_code, 400,
+        )
+
+    def test_chat_attachment_becomes_a_message(self):
+        upload = self.start(target='message', size=3).json()
+        self.chunk(upload['url'], 0, b'abc')
+        self.client.post(f"{upload['url']}complete/", {'message': 'Photo'})
+
+        message = CaseMessage.objects.get(case=self.case)
+        self.assertEqual((message.message, message.file.name), ('Photo', 'chat_files/clip.mp4'))
+        self.assertEqual(self.case.custom_history.latest('id').event, CaseHistory.FILE)
+
+    def test_enforces_limits_and_ownership(self):
+        self.assertEqual(self.start(size=101).status_code, 413)
+        self.assertEqual(self.start(target='report').status_code, 403)
+        upload = self.start(size=4).json()
+        self.assertEqual(self.chunk(upload['url'], 0, b'12345').status_code, 413)
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(upload['url']).status_code, 404)
+        self.assertEqual(self.start().status_code, 403)
+
+
+class DedupStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+
+    def test_stores_each_content_once(self):
+        first = default_storage.save('case_files/clip.mp4', ContentFile(b'evidence'))
+        second = default_storage.save('chat_files/clip.mp4', ContentFile(b'evidence'))
+        third = default_storage.save('case_files/clip.mp4', ContentFile(b'other'))
+
+        self.assertEqual(default_storage.url(second), '/media/chat_files/clip.mp4')
+        self.assertTrue(os.path.samefile(default_storage.path(first), default_storage.path(second)))
+        self.assertNotEqual(third, first)
+        self.assertEqual(sorted(MediaBlob.objects.values_list('refcount', flat=True)), [1, 2])
+
+        blob = MediaFile.objects.get(name=first).blob
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(first)
+        self.assertEqual(default_storage.open(second).read(), b'evidence')
+        # A delete rolled back keeps both the counted name and the blob.
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            default_storage.delete(second)
+            raise DatabaseError
+        self.assertTrue(MediaFile.objects.filter(name=second).exists())
+        self.assertEqual(default_storage.open(second).read(), b'evidence')
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(second)
+        self.assertFalse(MediaBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(storage.blob_name(blob.digest)))
+
+    def test_deleted_and_replaced_files_release_their_blobs(self):
+        user = get_user_model().objects.create(username='reporter')
+        case = Case.objects.create(
+            title='Theft', description='d', created_by=user,
+            uploaded_file=default_storage.save('case_files/a.jpg', ContentFile(b'a')),
+        )
+        kept = CaseMessage.objects.create(
+            case=case, sender=user, file=default_storage.save('chat_files/b.jpg', ContentFile(b'b')),
+        )
+        gone = CaseMessage.objects.create(
+            case=case, sender=user, file=default_storage.save('chat_files/c.jpg', ContentFile(b'c')),
+        )
+        ArchivedAttachment.objects.create(name=kept.file.name, case=case)
+        with self.captureOnCommitCallbacks(execute=True):
+            CaseMessage.objects.filter(pk__in=[kept.pk, gone.pk]).delete()
+        # The archive still refers to the archived message's attachment.
+        self.assertEqual(set(MediaFile.objects.values_list('name', flat=True)), {'case_files/a.jpg', 'chat_files/b.jpg'})
+
+        # Evidence replaced without a delete is collected.
+        case.uploaded_file = default_storage.save('case_files/d.jpg', ContentFile(b'd'))
+        case.save()
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('collect_media', min_age=0, stdout=out)
+        self.assertIn('Deleted 1 unreferenced file(s).', out.getvalue())
+        self.assertFalse(default_storage.exists('case_files/a.jpg'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            case.delete()
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(default_storage.exists('chat_files/b.jpg'))
+
+    def test_dedups_an_existing_tree(self):
+        for name in ('case_files/a.jpg', 'chat_files/b.jpg', 'chat_files/c.jpg'):
+            os.makedirs(os.path.dirname(f'{self.media_root}/{name}'), exist_ok=True)
+            with open(f'{self.media_root}/{name}', 'wb') as media:
+                media.write(b'same' if name != 'chat_files/c.jpg' else b'different')
+        call_command('dedup_media', stdout=io.StringIO())
+
+        self.assertTrue(os.path.samefile(f'{self.media_root}/case_files/a.jpg', f'{self.media_root}/chat_files/b.jpg'))
+        self.assertEqual(sorted(MediaBlob.objects.values_list('refcount', flat=True)), [1, 2])
+        self.assertEqual(storage.dedup_tree(default_storage)['duplicates'], 0)
+
+
+class ProtectedMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        User = get_user_model()
+        self.reporter = User.objects.create_user(username='reporter', password='pw')
+        self.stranger = User.objects.create_user(username='stranger', password='pw')
+        self.admin = User.objects.create_superuser(username='boss', password='pw')
+        self.name = default_storage.save('case_files/clip.mp4', ContentFile(bytes(range(256)) * 4))
+        self.case = Case.objects.create(
+            title='Theft', description='d', created_by=self.reporter, uploaded_file=self.name,
+        )
+        self.url = default_storage.url(self.name)
+
+    def get(self, user, url=None, **headers):
+        self.client.force_login(user)
+        return self.client.get(url or self.url, headers=headers)
+
+    def test_only_case_members_see_case_files(self):
+        self.assertEqual(self.get(self.reporter).status_code, 200)
+        self.assertEqual(self.get(self.admin).status_code, 200)
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        self.assertEqual(self.get(self.reporter, f'/media/{storage.BLOB_DIR}/').status_code, 404)
+        self.assertEqual(self.get(self.reporter, '/media/case_files/../clip.mp4').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_ranges_and_validators(self):
+        response = self.get(self.reporter, range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(response['Content-Length'], '10')
+
+        self.assertEqual(b''.join(self.get(self.reporter, range='bytes=-4').streaming_content), bytes(range(252, 256)))
+        self.assertEqual(self.get(self.reporter, range='bytes=2000-').status_code, 416)
+        etag = response['ETag']
+        self.assertEqual(self.get(self.reporter, if_none_match=etag).status_code, 304)
+        self.assertEqual(self.get(self.reporter, range='bytes=0-0', if_range='"stale"').status_code, 200)
+        self.assertEqual(self.get(self.reporter, range='bytes=0-0', if_range=etag).status_code, 206)
+
+    def test_reports_and_archived_attachments(self):
+        handler = get_user_model().objects.create_user(username='handler', password='pw')
+        report = default_storage.save('reports/findings.pdf', ContentFile(b'%PDF'))
+        self.case.assigned_to = handler
+        self.case.report_file = report
+        self.case.save()
+        self.assertEqual(self.get(handler, default_storage.url(report)).status_code, 200)
+        self.assertEqual(self.get(self.stranger, default_storage.url(report)).status_code, 404)
+
+        attachment = default_storage.save('chat_files/photo.jpg', ContentFile(b'jpeg'))
+        CaseMessage.objects.create(case=self.case, sender=self.reporter, file=attachment)
+        Case.objects.filter(pk=self.case.pk).update(
+            status='Closed', updated_at=timezone.now() - datetime.timedelta(days=400),
+        )
+        archive_cases(days=365)
+        self.assertFalse(CaseMessage.objects.filter(file=attachment).exists())
+        self.assertEqual(self.get(self.reporter, default_storage.url(attachment)).status_code, 200)
+        self.assertEqual(self.get(self.stranger, default_storage.url(attachment)).status_code, 404)
+
+    @override_settings(CASE_MEDIA_SENDFILE='x-accel-redirect')
+    def test_hands_off_to_the_front_end_server(self):
+        response = self.get(self.reporter)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('private', response['Cache-Control'])
+
+
+CALLS = []
+
+
+@task(max_attempts=2)
+def record_call(value, fail=False):
+    CALLS.append(value)
+    if fail:
+        raise ValueError(value)
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_runs_queued_tasks_once_per_dedup_key(self):
+        first = tasks.enqueue(record_call, 'a', dedup_key='k')
+        self.assertEqual(tasks.enqueue(record_call, 'b', dedup_key='k'), first)
+        tasks.enqueue(record_call, 'later', delay=60)
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(CALLS, ['a'])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (Task.DONE, 1))
+        # Picked up, so the key can be queued again.
+        self.assertNotEqual(tasks.enqueue(record_call, 'c', dedup_key='k').pk, first.pk)
+
+    def test_retries_with_backoff_then_fails(self):
+        queued = tasks.enqueue(record_call, 'x', fail=True)
+        tasks.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.QUEUED, 1))
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('ValueError', queued.last_error)
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        tasks.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, CALLS), (Task.FAILED, ['x', 'x']))
+
+    def test_requeues_tasks_of_dead_workers(self):
+        queued = tasks.enqueue(record_call, 'y')
+        [claimed] = tasks.claim('gone:1')
+        self.assertEqual(tasks.claim('other:2'), [])
+        Task.objects.filter(pk=claimed.pk).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(tasks.requeue_lost(), 1)
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        call_command('run_tasks', '--once', stdout=io.StringIO())
+        self.assertEqual(CALLS, ['y'])
+        # The lost worker finishing late doesn't overwrite the rerun.
+        tasks.finish(claimed, status=Task.FAILED)
+        self.assertEqual(Task.objects.get(pk=queued.pk).status, Task.DONE)
+
+    def test_renaming_a_user_reindexes_their_cases_in_the_background(self):
+        user = get_user_model().objects.create_user(username='reporter', password='pw')
+        case = Case.objects.create(title='Theft', description='d', created_by=user)
+        user.username = 'whistleblower'
+        user.save()
+        self.assertFalse(search_cases(Case.objects.all(), 'whistleblower').exists())
+        tasks.run_pending()
+        self.assertEqual(list(search_cases(Case.objects.all(), 'whistleblower')), [case])
+
+    def test_only_changes_to_the_search_document_reindex_a_case(self):
+        user = get_user_model().objects.create_user(username='reporter', password='pw')
+        case = Case.objects.create(title='Theft', description='d', created_by=user)
+        with mock.patch('cases.search.index_cases') as index:
+            case.status = 'Approved'
+            case.save()
+            index.assert_not_called()
+            case.title = 'Bike theft'
+            case.save()
+            index.assert_called_once_with([case.pk])
+
+
+@override_settings(CASE_NOTIFICATION_DIGEST_DELAY=0)
+class NotificationTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='boss', password='pw')
+        self.handler = User.objects.create(username='handler', role='handler', phone_number='+920000000000')
+        self.handler.groups.add(Group.objects.get_or_create(name='handler')[0])
+        self.reporter = User.objects.create(username='reporter', role='user')
+        outbox = tempfile.TemporaryDirectory()
+        self.addCleanup(outbox.cleanup)
+        self.outbox = os.path.join(outbox.name, 'notifications.jsonl')
+        self.enterContext(override_settings(
+            CASE_NOTIFICATION_BACKENDS=['cases.notifications.FileBackend'], CASE_NOTIFICATION_FILE=self.outbox,
+        ))
+        self.client.force_login(self.admin)
+
+    def digests(self):
+        with open(self.outbox, encoding='utf-8') as outbox:
+            return {digest['recipient']: digest for digest in map(json.loads, outbox)}
+
+    def test_bulk_assignment_sends_one_digest_per_recipient(self):
+        case_ids = [
+            Case.objects.create(title=f'Case {i}', description='d', created_by=self.reporter, status='Approved').pk
+            for i in range(40)
+        ]
+        self.client.post(
+            reverse('bulk_assign_cases'),
+            json.dumps({'case_ids': case_ids, 'assigned_to': self.handler.pk}), content_type='application/json',
+        )
+        self.assertEqual(Task.objects.filter(name__endswith='dispatch_notifications').count(), 1)
+        tasks.run_pending()
+
+        digests = self.digests()
+        self.assertEqual(set(digests), {'handler', 'reporter'})
+        self.assertEqual(len(digests['handler']['notifications']), 40)
+        self.assertEqual({n['event'] for n in digests['handler']['notifications']}, {Notification.ASSIGNED})
+        self.assertEqual(digests['reporter']['subject'], 'CaseEase: 40 updates on your cases')
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+
+    @override_settings(
+        CASE_NOTIFICATION_BACKENDS=['cases.notifications.EmailBackend'],
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    )
+    def test_digests_are_emailed_to_the_recipient(self):
+        self.handler.email = 'handler@example.com'
+        self.handler.save()
+        case = Case.objects.create(title='Theft', description='d', created_by=self.reporter, status='Approved')
+        self.client.post(reverse('assign_handler_inline', args=[case.pk]), {'assigned_to': self.handler.pk})
+        tasks.run_pending()
+
+        # The reporter has no address to send to.
+        self.assertEqual([message.to for message in mail.outbox], [['handler@example.com']])
+        self.assertIn(f'#{case.pk} "Theft" was assigned to you.', mail.outbox[0].body)
+
+    def test_inline_assignment_no_longer_redirects_to_whatsapp(self):
+        case = Case.objects.create(title='Theft', description='d', created_by=self.reporter, status='Approved')
+        response = self.client.post(reverse('assign_handler_inline', args=[case.pk]), {'assigned_to': self.handler.pk})
+        self.assertRedirects(response, reverse('approved_cases'), fetch_redirect_response=False)
+
+        # The actor isn't told about their own change.
+        case.refresh_from_db()
+        case.status = 'In Progress'
+        case.save(actor=self.handler)
+        tasks.run_pending()
+        self.assertEqual(
+            [n['text'] for n in self.digests()['handler']['notifications']],
+            [f'#{case.pk} "Theft" was assigned to you.'],
+        )
+        self.assertEqual(len(self.digests()['reporter']['notifications']), 2)
+
+
+class BulkActionTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='boss', password='pw')
+        self.handler = User.objects.create(username='handler', role='handler')
+        self.handler.groups.add(Group.objects.get_or_create(name='handler')[0])
+        self.reporters = User.objects.bulk_create(User(username=f'reporter{i}', role='user') for i in range(30))
+        self.client.force_login(self.admin)
+
+    def new_cases(self, status, count):
+        return [
+            Case.objects.create(title='Bulk', description='d', created_by=self.reporters[i % 30], status=status).pk
+            for i in range(count)
+        ]
+
+    def bulk(self, name, data):
+        return self.client.post(reverse(name), json.dumps(data), content_type='application/json')
+
+    def test_reports_each_case(self):
+        pending = self.new_cases('Pending', 3)
+        closed = self.new_cases('Closed', 1)
+        response = self.bulk('bulk_approve_cases', {'case_ids': [*pending, *closed, 0, 'x']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['succeeded'], pending)
+        self.assertCountEqual([failure['id'] for failure in response.json()['failed']], [*closed, 0, 'x'])
+        self.assertEqual(Case.objects.filter(pk__in=pending, status='Approved').count(), 3)
+        self.assertEqual(
+            list(CaseHistory.objects.filter(case__in=pending, action='Case Approved').values_list('changes', flat=True)),
+            [{'status': ['Pending', 'Approved']}] * 3,
+        )
+
+        response = self.bulk('bulk_assign_cases', {'case_ids': pending, 'assigned_to': self.handler.pk})
+        self.assertEqual(response.json()['succeeded'], pending)
+        self.assertEqual(Case.objects.filter(assigned_to=self.handler, status='Assigned').count(), 3)
+        self.assertEqual(verify_counters(), {})
+        self.assertEqual(verify_rollups(), {})
+
+        response = self.bulk('bulk_assign_cases', {'case_ids': pending, 'assigned_to': self.admin.pk})
+        self.assertEqual(response.status_code, 400)
+
+    def test_escapes_the_handler_in_the_history(self):
+        handler = get_user_model().objects.create(username='<b>handler</b>', role='handler')
+        handler.groups.add(Group.objects.get(name='handler'))
+        case_ids = self.new_cases('Approved', 1)
+        self.bulk('bulk_assign_cases', {'case_ids': case_ids, 'assigned_to': handler.pk})
+        self.assertEqual(
+            CaseHistory.objects.filter(case_id=case_ids[0]).latest('id').action,
+            'Case assigned to &lt;b&gt;handler&lt;/b&gt;',
+        )
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def approve(count):
+            case_ids = self.new_cases('Pending', count)
+            with CaptureQueriesContext(connection) as queries:
+                self.bulk('bulk_approve_cases', {'case_ids': case_ids})
+            return len(queries)
+
+        approve(30)  # creates the counter rows of every reporter
+        self.assertEqual(approve(1), approve(30))
+
+
+class AutoAssignTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='boss', password='pw')
+        group = Group.objects.get_or_create(name='handler')[0]
+        self.handlers = [User.objects.create(username=f'handler{i}', role='handler') for i in range(3)]
+        for handler in self.handlers:
+            handler.groups.add(group)
+        self.reporter = User.objects.create(username='reporter', role='user')
+        self.client.force_login(self.admin)
+
+    def new_cases(self, status, count, handler=None):
+        return [
+            Case.objects.create(
+                title='Auto', description='d', created_by=self.reporter, status=status, assigned_to=handler,
+            ).pk
+            for _ in range(count)
+        ]
+
+    def auto_assign(self, data=None):
+        return self.client.post(reverse('auto_assign_cases'), json.dumps(data or {}), content_type='application/json')
+
+    def open_cases(self):
+        return {
+            handler.username: handler.cases_assigned.filter(status__in=OPEN_STATUSES).count()
+            for handler in self.handlers
+        }
+
+    def test_levels_the_workload_across_the_whole_queue(self):
+        self.new_cases('In Progress', 4, self.handlers[0])
+        self.new_cases('Resolved', 5, self.handlers[1])  # not open
+        approved = self.new_cases('Approved', 8)
+        pending = self.new_cases('Pending', 1)
+
+        response = self.auto_assign()
+        self.assertEqual(response.json(), {'succeeded': approved, 'failed': []})
+        self.assertEqual(self.open_cases(), {'handler0': 4, 'handler1': 4, 'handler2': 4})
+        self.assertEqual(Case.objects.get(pk=pending[0]).status, 'Pending')
+        entry = CaseHistory.objects.filter(case_id=approved[0]).latest('id')
+        self.assertEqual(entry.performed_by, self.admin)
+        self.assertEqual(entry.changes['status'], ['Approved', 'Assigned'])
+        self.assertEqual(entry.action, f"Case assigned to {Case.objects.get(pk=approved[0]).assigned_to.username}")
+        self.assertEqual(Notification.objects.filter(case__in=approved, event=Notification.ASSIGNED).count(), 8)
+        self.assertEqual(verify_counters(), {})
+        self.assertEqual(verify_rollups(), {})
+
+    def test_weights_and_caps(self):
+        HandlerCapacity.objects.create(handler=self.handlers[0], weight=2)
+        HandlerCapacity.objects.create(handler=self.handlers[1], max_open_cases=1)
+        HandlerCapacity.objects.create(handler=self.handlers[2], weight=0)
+        approved = self.new_cases('Approved', 5)
+
+        response = self.auto_assign({'case_ids': approved[:4]})
+        self.assertEqual(response.json()['succeeded'], approved[:4])
+        self.assertEqual(self.open_cases(), {'handler0': 3, 'handler1': 1, 'handler2': 0})
+
+        with self.settings(CASE_ASSIGNMENT_MAX_OPEN=0):
+            HandlerCapacity.objects.filter(handler=self.handlers[0]).update(max_open_cases=3)
+            response = self.auto_assign()
+        self.assertEqual(response.json()['failed'], [{'id': approved[4], 'error': "Every handler is at their cap."}])
+        self.assertEqual(Case.objects.get(pk=approved[4]).status, 'Approved')
+
+    def test_queries_do_not_grow_with_the_queue(self):
+        def assign(count):
+            self.new_cases('Approved', count)
+            with CaptureQueriesContext(connection) as queries:
+                self.auto_assign()
+            return len(queries)
+
+        assign(30)  # creates the handlers' counter rows
+        self.assertEqual(assign(1), assign(30))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(username='boss', password='pw')
+        self.handler = User.objects.create(username='handler', role='handler')
+        self.handler.groups.add(Group.objects.get_or_create(name='handler')[0])
+        self.user = User.objects.create(username='reporter', role='user')
+        self.cases = [
+            Case.objects.create(title=f'Case {i}', description='d', created_by=self.user, status=status)
+            for i, status in enumerate(['Pending', 'Closed', 'Closed'])
+        ]
+        CaseMessage.objects.create(case=self.cases[1], sender=self.user, message='Hello, "world"')
+
+    def export(self, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_cases'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_streams_filtered_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(status='Closed', include='messages').decode())))
+        self.assertEqual([row['title'] for row in rows], ['Case 1', 'Case 2'])
+        self.assertEqual(json.loads(rows[0]['messages'])[0]['message'], 'Hello, "world"')
+        self.assertEqual(json.loads(rows[1]['messages']), [])
+
+    def test_streams_gzipped_json_lines(self):
+        body = gzip.decompress(self.export(format='jsonl', include=['messages', 'history'], gzip='1'))
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], [case.pk for case in self.cases])
+        self.assertEqual(records[0]['history'][0]['event'], CaseHistory.CREATED)
+
+    def test_queries_grow_by_chunk_not_by_case(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(export.export_stream(Case.objects.for_export(), include=export.INCLUDES))
+        # Cases, their archives, messages and history.
+        self.assertEqual(len(queries), 4)
+
+    def test_includes_archived_rows_and_every_status(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        Case.objects.filter(pk=self.cases[1].pk).update(updated_at=timezone.now() - datetime.timedelta(days=400))
+        archive_cases()
+        CaseMessage.objects.create(case=self.cases[1], sender=self.user, message='After archiving')
+        self.assertFalse(CaseHistory.objects.filter(case=self.cases[1]).exists())
+
+        records = [json.loads(line) for line in self.export(format='jsonl', include=['messages', 'history']).splitlines()]
+        archived = records[1]
+        self.assertEqual([message['message'] for message in archived['messages']], ['Hello, "world"', 'After archiving'])
+        self.assertEqual(archived['history'][0]['event'], CaseHistory.CREATED)
+
+        Case.objects.filter(pk=self.cases[0].pk).update(status='Assigned')
+        rows = list(csv.DictReader(io.StringIO(self.export(status='Assigned').decode())))
+        self.assertEqual([row['title'] for row in rows], ['Case 0'])
+
+    def test_only_admins_can_export(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('export_cases')).status_code, 403)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_cases'), {'created_from': '2026-02-01', 'created_to': '2026-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_writes_the_same_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/cases.jsonl'
+            call_command('export_cases', format='jsonl', status=['Pending'], output=path, stderr=io.StringIO())
+            with open(path, encoding='utf-8') as output:
+                self.assertEqual([json.loads(line)['title'] for line in output], ['Case 0'])
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, records):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write('\n'.join(json.dumps(record) for record in records))
+        return path
+
+    def test_parses_arrays_and_json_lines_incrementally(self):
+        records = [{'model': 'cases.case', 'pk': i, 'fields': {'title': '[x], {y}' * i}} for i in range(20)]
+        for text in (json.dumps(records, indent=2), '\n'.join(json.dumps(record) for record in records)):
+            self.assertEqual(list(iter_records(io.StringIO(text), read_size=7)), records)
+
+    def test_imports_the_fixture(self):
+        with open(FIXTURE, encoding='utf-8') as fixture:
+            expected = Counter(record['model'] for record in json.load(fixture) if record['model'] in FIXTURE_MODELS)
+        call_command(
+            'bulk_import', str(FIXTURE), batch_size=10, checkpoint=f'{self.directory}/checkpoint',
+            exclude=['admin', 'sessions', 'contenttypes', 'auth.permission'], stdout=io.StringIO(),
+        )
+        self.assertEqual(Case.objects.count(), expected['cases.case'])
+        self.assertEqual(CaseMessage.objects.count(), expected['cases.casemessage'])
+        # The HistoricalCase snapshots are folded into the audit trail.
+        self.assertGreaterEqual(CaseHistory.objects.count(), expected['cases.casehistory'])
+        self.assertTrue(CaseHistory.objects.filter(case_id=21).exclude(changes={}).exists())
+        self.assertTrue(get_user_model().objects.filter(groups__name='handler').exists())
+        self.assertEqual(verify_counters(), {})
+        self.assertEqual(verify_rollups(), {})
+        # The sequences continue after the imported keys.
+        self.assertGreater(
+            Case.objects.create(title='New', description='d', created_by=get_user_model().objects.first()).pk,
+            max(Case.objects.exclude(title='New').values_list('pk', flat=True)),
+        )
+
+    def test_resumes_after_a_failed_batch(self):
+        records = [
+            {'model': 'accounts.customuser', 'pk': 9001, 'fields': {'username': 'imported', 'password': '!'}},
+            *(
+                {'model': 'cases.case', 'pk': 9100 + i, 'fields': {
+                    'title': None if i == 1 else f'Case {i}', 'description': 'd', 'created_by': 9001,
+                    'created_at': '2025-07-01T00:00:00Z', 'updated_at': '2025-07-01T00:00:00Z',
+                }}
+                for i in range(3)
+            ),
+        ]
+        path = self.write('cases.jsonl', records)
+        with self.assertRaises(CommandError):
+            call_command('bulk_import', path, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(Case.objects.values_list('pk', flat=True)), [9100])
+
+        records[2]['fields']['title'] = 'Case 1'
+        self.write('cases.jsonl', records)
+        call_command('bulk_import', path, batch_size=1, resume=True, stdout=io.StringIO())
+        self.assertEqual(list(Case.objects.order_by('pk').values_list('pk', flat=True)), [9100, 9101, 9102])
+        self.assertEqual(Case.objects.get(pk=9100).created_at.year, 2025)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+
+class LoadGeneratorTests(TestCase):
+    def test_generates_consistent_data(self):
+        LoadGenerator(users=6, handlers=2, cases=25, messages_per_case=2, history_per_case=3, batch_size=10).run()
+
+        self.assertEqual(Case.objects.count(), 25)
+        self.assertEqual(CaseMessage.objects.count(), 50)
+        self.assertEqual(CaseHistory.objects.filter(event=CaseHistory.CREATED).count(), 25)
+        self.assertFalse(Case.objects.filter(status__in=['Pending', 'Approved'], assigned_to__isnull=False).exists())
+        self.assertFalse(CaseMessage.objects.filter(timestamp__lt=models.F('case__created_at')).exists())
+        self.assertEqual(verify_counters(), {})
+        self.assertEqual(verify_rollups(), {})
+
+
+@skipUnless(connection.vendor == 'sqlite', "PostgreSQL plans depend on table statistics; use explain_case_queries.")
+class QueryPlanTests(TestCase):
+    def test_hot_queries_are_served_by_indexes(self):
+        LoadGenerator(users=4, handlers=2, cases=40, messages_per_case=2, batch_size=20).run()
+
+        for name, result in compare_plans(runs=1, analyze=False).items():
+            self.assertEqual(result['after']['shape'], 'index', f"{name}:\n{result['after']['plan']}")
@@ -0,0 +1,294 @@
+"""
+Chunked, resumable uploads of case evidence, case reports and chat
+attachments.
+
+The client starts an upload with the file's name and size, then sends the
+bytes in order, each chunk a short request carrying the offset it starts
+at. A dropped connection loses at most the chunk in flight: the client asks
+for the upload's offset and continues from there. Once every byte is in,
+completing the upload moves the file into its field's ``upload_to``
+directory and attaches it to the case, or to a new chat message, in one
+transaction.
+
+Chunks are streamed to files under MEDIA_ROOT/CASE_UPLOAD_DIR, never held
+in memory. A chunk is read off the socket into a file of its own, checked
+against MAX_CHUNK_SIZE, the declared size and its SHA-256 if the client
+sends one, and only then is the upload row locked, for as long as it takes
+to append that file to the partial one. A slow client never holds a lock.
+
+Completion reads the file once, outside any lock, for its SHA-256: checked
+against the one the client sends, and handed to the storage (PartialFile),
+which would otherwise hash it again to deduplicate it.
+"""
+import datetime
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.html import escape
+
+from accounts.roles import USER, effective_role
+
+from .audit import record_event
+from .models import Case, CaseHistory, CaseMessage, ChunkedUpload
+
+
+# What the client is told to send, and the most a chunk may be.
+CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# Partial uploads untouched for this long are abandoned; see clean_uploads.
+STALE_AFTER_HOURS = 24
+
+TARGET_FIELDS = {
+    ChunkedUpload.EVIDENCE: (Case, 'uploaded_file'),
+    ChunkedUpload.REPORT: (Case, 'report_file'),
+    ChunkedUpload.MESSAGE: (CaseMessage, 'file'),
+}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class PartialFile(File):
+    """
+    A finished partial file; FileSystemStorage moves it into place instead
+    of copying it, and DedupStorage takes its ``sha256`` as read.
+    """
+
+    def __init__(self, file, name=None, sha256=None):
+        super().__init__(file, name)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def max_upload_size():
+    return getattr(settings, 'CASE_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+
+
+def upload_root():
+    return os.path.join(settings.MEDIA_ROOT, getattr(settings, 'CASE_UPLOAD_DIR', 'partial_uploads'))
+
+
+def partial_path(upload):
+    return os.path.join(upload_root(), f'{upload.pk}.part')
+
+
+def can_upload(user, case, target):
+    """Mirrors the pages that show these files: reporters add evidence, handlers reports, both chat."""
+    if user.is_superuser:
+        return True
+    if target == ChunkedUpload.EVIDENCE:
+        return user.pk == case.created_by_id
+    if target == ChunkedUpload.REPORT:
+        return user.pk == case.assigned_to_id
+    return user.pk in (case.created_by_id, case.assigned_to_id)
+
+
+def start_upload(user, case, target, filename, size):
+    if target not in TARGET_FIELDS:
+        raise UploadError(f"Unknown upload target {target!r}.")
+    if not can_upload(user, case, target):
+        raise UploadError("You can't upload files to this case.", status=403)
+    filename = os.path.basename(str(filename or '')).strip()
+    if not filename:
+        raise UploadError("The file needs a name.")
+    if not 0 < size <= max_upload_size():
+        raise UploadError(f"Files must be between 1 byte and {max_upload_size()} bytes.", status=413)
+    upload = ChunkedUpload.objects.create(case=case, user=user, target=target, filename=filename, size=size)
+    os.makedirs(upload_root(), exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+    return upload
+
+
+def write_chunk(upload_id, user, offset, stream, length, sha256=None):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset``; returns the
+    upload with its new offset. A chunk that doesn't start where the last
+    one ended is refused with 409 and the client resumes from the offset.
+    """
+    if length is None or length < 1:
+        raise UploadError("Send the chunk's Content-Length.", status=411)
+    if length > MAX_CHUNK_SIZE:
+        raise UploadError(f"Chunks can be at most {MAX_CHUNK_SIZE} bytes.", status=413)
+    # Checked before reading the chunk, and again under the lock.
+    check_offset(owned_upload(ChunkedUpload.objects.all(), upload_id, user), offset, length)
+    chunk_path = receive_chunk(upload_id, stream, length, sha256)
+    try:
+        with transaction.atomic():
+            # The lock serializes retries of the same chunk.
+            upload = owned_upload(ChunkedUpload.objects.select_for_update(), upload_id, user)
+            check_offset(upload, offset, length)
+            with open(partial_path(upload), 'r+b') as partial, open(chunk_path, 'rb') as chunk:
+                # Drop whatever a failed attempt at this chunk left behind.
+                partial.truncate(offset)
+                partial.seek(offset)
+                shutil.copyfileobj(chunk, partial, READ_SIZE)
+                partial.flush()
+                os.fsync(partial.fileno())
+            upload.offset += length
+            upload.save(update_fields=['offset', 'updated_at'])
+    finally:
+        remove_partial(chunk_path)
+    return upload
+
+
+def check_offset(upload, offset, length):
+    if offset != upload.offset:
+        raise UploadError(f"Expected the chunk at offset {upload.offset}.", status=409)
+    if offset + length > upload.size:
+        raise UploadError("The chunk runs past the end of the file.", status=413)
+
+
+def receive_chunk(upload_id, stream, length, sha256=None):
+    """Read a chunk off ``stream`` into a file of its own and check it; returns the file's path."""
+    os.makedirs(upload_root(), exist_ok=True)
+    handle, chunk_path = tempfile.mkstemp(dir=upload_root(), prefix=f'{upload_id}.', suffix='.chunk')
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(handle, 'wb') as chunk:
+            remaining = length
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise UploadError("The chunk ended early.")
+                digest.update(data)
+                chunk.write(data)
+                remaining -= len(data)
+        if sha256 and digest.hexdigest() != sha256.lower():
+            raise UploadError("The chunk doesn't match its SHA-256.", status=422)
+    except BaseException:
+        remove_partial(chunk_path)
+        raise
+    return chunk_path
+
+
+def owned_upload(queryset, upload_id, user):
+    upload = queryset.select_related('case').filter(pk=upload_id, user=user).first()
+    if upload is None:
+        raise UploadError("No such upload.", status=404)
+    return upload
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        while data := partial.read(READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def complete_upload(upload_id, user, sha256=None, message=''):
+    """
+    Attach a fully received upload to its case, or to a new chat message
+    with ``message``; returns the case or the message. The file is moved
+    into place and the row saved in one transaction: if either fails,
+    neither happens and the upload can be completed again.
+    """
+    upload = owned_upload(ChunkedUpload.objects.all(), upload_id, user)
+    check_complete(upload)
+    path = partial_path(upload)
+    # A complete upload takes no more chunks, so the file can be read before locking.
+    digest = file_sha256(path)
+    if sha256 and digest != sha256.lower():
+        raise UploadError("The file doesn't match its SHA-256.", status=422)
+
+    with transaction.atomic():
+        upload = owned_upload(ChunkedUpload.objects.select_for_update(), upload_id, user)
+        check_complete(upload)
+        model, field_name = TARGET_FIELDS[upload.target]
+        case = Case.objects.select_for_update().get(pk=upload.case_id)
+        if upload.target == ChunkedUpload.MESSAGE:
+            instance = CaseMessage(case=case, sender=user, message=message.strip(), timestamp=timezone.now())
+        else:
+            instance = case
+        field = model._meta.get_field(field_name)
+        name = field.generate_filename(instance, upload.filename)
+        with open(path, 'rb') as partial:
+            name = default_storage.save(name, PartialFile(partial, name=path, sha256=digest))
+        try:
+            setattr(instance, field_name, name)
+            if upload.target == ChunkedUpload.MESSAGE:
+                instance.save()
+                log_message_file(instance)
+            else:
+                label = upload.get_target_display()
+                instance.save(actor=user, action=f"{label} uploaded: {escape(upload.filename)}")
+            upload.delete()
+            transaction.on_commit(lambda: remove_partial(path))
+        except BaseException:
+            restore_partial(name, path)
+            raise
+    return instance
+
+
+def check_complete(upload):
+    if upload.offset != upload.size:
+        raise UploadError(f"Only {upload.offset} of {upload.size} bytes have arrived.", status=409)
+
+
+def restore_partial(name, path):
+    """Undo default_storage.save() of a partial file, so a failed completion can be retried."""
+    try:
+        # FileSystemStorage moved the file and DedupStorage linked it; put it back.
+        os.replace(default_storage.path(name), path)
+    except NotImplementedError:
+        # Other storages copied it.
+        default_storage.delete(name)
+
+
+def log_message_file(case_message):
+    """The history entry for a file sent in the chat; the sender stays anonymous where the chat hides them."""
+    case, sender = case_message.case, case_message.sender
+    file_name = case_message.file.name.replace("chat_files/", "")
+    file_url = case_message.file.url
+    # The middleware has usually resolved the sender's role already.
+    performed_by = None if case.is_anonymous and effective_role(sender) == USER else sender
+    record_event(
+        case, CaseHistory.FILE,
+        f'A file uploaded: <a href="{file_url}" target="_blank">{file_name}</a>',
+        actor=performed_by,
+        changes={'file': [None, case_message.file.name]},
+    )
+
+
+def remove_partial(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def abort_upload(upload_id, user):
+    with transaction.atomic():
+        upload = owned_upload(ChunkedUpload.objects.select_for_update(), upload_id, user)
+        path = partial_path(upload)
+        upload.delete()
+        transaction.on_commit(lambda: remove_partial(path))
+
+
+def clean_stale_uploads(hours=STALE_AFTER_HOURS):
+    """Delete uploads nobody has sent a chunk to for ``hours``; returns how many."""
+    cutoff = timezone.now() - datetime.timedelta(hours=hours)
+    count = 0
+    for upload in ChunkedUpload.objects.filter(updated_at__lt=cutoff).iterator():
+        remove_partial(partial_path(upload))
+        upload.delete()
+        count += 1
+    # Chunks a request that died mid-read left behind.
+    for chunk_path in glob.glob(os.path.join(upload_root(), '*.chunk')):
+        if os.path.getmtime(chunk_path) < cutoff.timestamp():
+            remove_partial(chunk_path)
+    return count
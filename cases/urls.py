@@ -10,4 +10,12 @@ urlpatterns = [
 
     path('case/<int:case_id>/get-messages/', views.get_messages, name='get_messages'),
 
+    path('case/<int:case_id>/events/', views.case_events, name='case_events'),
+
+    path('case/<int:case_id>/archive/', views.case_archive, name='case_archive'),
+
+    path('case/<int:case_id>/uploads/', views.UploadStartView.as_view(), name='upload_start'),
+    path('uploads/<uuid:upload_id>/', views.UploadChunkView.as_view(), name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.UploadCompleteView.as_view(), name='upload_complete'),
+
 ]
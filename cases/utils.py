@@ -0,0 +1,32 @@
+"""Small helpers shared by the bulk code paths: bulk actions, exports, imports and load data."""
+from contextlib import contextmanager
+from itertools import islice
+
+
+def batched(iterable, size):
+    """Lists of up to ``size`` items of ``iterable``, read lazily."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def generated_timestamps(models):
+    """
+    Let bulk_create keep the dates set on instances of ``models`` instead of
+    stamping auto_now / auto_now_add fields with the current time.
+    """
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
@@ -1,41 +1,77 @@
+import asyncio
+import json
+from functools import wraps
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, CreateView, TemplateView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from .models import Case
 from .forms import CaseForm, CaseMessageForm
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views import View
 from django.contrib import messages
 from django.contrib.auth import get_user_model
-from .models import CaseHistory, CaseMessage, Case
-from simple_history.utils import update_change_reason
-from django.http import JsonResponse
+from .models import CaseHistory, CaseMessage, Case, ChunkedUpload
+from .access import is_participant
+from .archive import load_archive
+from .events import can_stream, format_sse, hub
+from .media import can_view, clean_name, serve
+from .uploads import (
+    CHUNK_SIZE, UploadError, abort_upload, complete_upload, log_message_file, owned_upload, start_upload,
+    write_chunk,
+)
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse, Http404
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages as django_messages
+from django.core.files.storage import default_storage
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition, require_safe
+from django.db.models import Count, Max
 
 
 # Create your views here.
 
+EVENTS_KEEPALIVE = 25  # seconds between SSE comments that keep proxies from closing the stream
+
 
 class RegisterCaseView(LoginRequiredMixin, CreateView):
+    """
+    Registers a case. The page's script sends the form without the file and
+    asks for JSON, then uploads the evidence in chunks (cases.uploads) to
+    the URL it's given; without the script the file goes in the form.
+    """
     model = Case
     form_class = CaseForm
     template_name = 'cases/register_case.html'
     success_url = reverse_lazy('user_dashboard')
 
+    def wants_json(self):
+        return self.request.headers.get('Accept') == 'application/json'
+
     def form_valid(self, form):
         form.instance.created_by = self.request.user
-        response = super().form_valid(form)
-
-        # Log registration
-        CaseHistory.objects.create(
-            case=self.object,
+        self.object = form.save(commit=False)
+        # Case.save() logs the registration; anonymous reporters stay anonymous.
+        self.object.save(
+            actor=None if self.object.is_anonymous else self.request.user,
             action="Case Registered",
-            performed_by=None if self.object.is_anonymous else self.request.user
         )
+        form.save_m2m()
+        if self.wants_json():
+            return JsonResponse({
+                'case': self.object.pk,
+                'upload_url': reverse('upload_start', args=[self.object.pk]),
+                'redirect': self.get_success_url(),
+            }, status=201)
+        return redirect(self.get_success_url())
 
-        return response
+    def form_invalid(self, form):
+        if self.wants_json():
+            return JsonResponse({'errors': form.errors}, status=400)
+        return super().form_invalid(form)
 
 
 
@@ -55,21 +91,24 @@ class CaseDetailView(LoginRequiredMixin, DetailView):
     template_name = 'cases/case_detail.html'
     context_object_name = 'case'
 
+    def get_queryset(self):
+        return Case.objects.for_detail()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         case = self.object
 
         # Check permission
         user = self.request.user
-        context['can_message'] = (
-            user == case.created_by or 
-            user == case.assigned_to or 
-            user.is_superuser
-        )
+        context['can_message'] = is_participant(user, case.created_by_id, case.assigned_to_id)
 
-        context['messages'] = case.messages.order_by('timestamp')
+        # Both are prefetched and already ordered by Case.objects.for_detail().
+        chat = case.messages.all()
+        context['messages'] = chat
+        context['last_message_id'] = chat[len(chat) - 1].id if chat else 0
         context['message_form'] = CaseMessageForm()
-        context['history'] = case.custom_history.order_by('-timestamp')
+        context['history'] = case.custom_history.all()
+        context['live_events'] = can_stream(self.request)
 
         return context
 
@@ -79,7 +118,7 @@ class CaseDetailView(LoginRequiredMixin, DetailView):
         user = request.user
 
         # Restrict access
-        if not (user == case.created_by or user == case.assigned_to or user.is_superuser):
+        if not is_participant(user, case.created_by_id, case.assigned_to_id):
             django_messages.error(request, "You do not have permission to send messages for this case.")
             return redirect('case_detail', pk=case.pk)
 
@@ -100,17 +139,7 @@ class CaseDetailView(LoginRequiredMixin, DetailView):
 
             # If a file is uploaded, add to history
             if case_message.file:
-                file_name = case_message.file.name.replace("chat_files/", "")
-                file_url = case_message.file.url  # ← Proper way to get the URL
-                sender = case_message.sender
-                # Get first group name if exists, else empty string
-                group_name = sender.groups.first().name if sender.groups.exists() else ""
-                performed_by = None if case.is_anonymous and group_name != "handler" and not sender.is_superuser else user
-                CaseHistory.objects.create(
-                    case=case,
-                    action=f'A file uploaded: <a href="{file_url}" target="_blank">{file_name}</a>',
-                    performed_by=performed_by
-                )
+                log_message_file(case_message)
 
             return redirect('case_detail', pk=case.pk)
 
@@ -121,22 +150,243 @@ class CaseDetailView(LoginRequiredMixin, DetailView):
 
 
 
+async def case_events(request, case_id):
+    """
+    Server-Sent Events stream of new chat messages and history entries of a
+    case, for the people who take part in it. Needs the ASGI application
+    (CaseEase.asgi): an idle viewer is then just a pending await, with no
+    worker thread or database query held.
+    """
+    if not can_stream(request):
+        # No Content stops EventSource reconnecting; the page polls instead.
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    case = await Case.objects.filter(id=case_id).values('created_by_id', 'assigned_to_id').afirst()
+    if case is None or not is_participant(user, case['created_by_id'], case['assigned_to_id']):
+        raise Http404("No case found.")
+
+    async def stream():
+        with hub.subscribe(case_id) as subscription:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def message_state(request, case_id):
+    # Shared by the ETag and Last-Modified callbacks so it costs one query.
+    if not hasattr(request, '_message_state'):
+        request._message_state = CaseMessage.objects.filter(case_id=case_id).aggregate(
+            last_id=Max('id'),
+            count=Count('id'),
+            last_modified=Max('timestamp'),
+        )
+    return request._message_state
+
+
+def messages_etag(request, case_id):
+    state = message_state(request, case_id)
+    # Deleting a message lowers the count without touching last_id.
+    return f"{case_id}-{state['last_id'] or 0}-{state['count']}-{request.GET.get('since', '')}"
+
+
+def messages_last_modified(request, case_id):
+    return message_state(request, case_id)['last_modified']
+
+
+def participant_required(view):
+    """A 404 for anyone but the case's participants (cases.access), before ``view`` or its conditional GET runs."""
+    @wraps(view)
+    def check(request, case_id, *args, **kwargs):
+        case = Case.objects.filter(id=case_id).values('created_by_id', 'assigned_to_id').first()
+        if case is None or not is_participant(request.user, case['created_by_id'], case['assigned_to_id']):
+            raise Http404("No case found.")
+        return view(request, case_id, *args, **kwargs)
+    return check
+
+
 @login_required
+@participant_required
+@condition(etag_func=messages_etag, last_modified_func=messages_last_modified)
 def get_messages(request, case_id):
-    case = get_object_or_404(Case, id=case_id)
-    messages = case.messages.order_by('timestamp')
+    """
+    Messages of a case in chronological order. ``?since=`` takes a message id
+    or an ISO timestamp and limits the result to newer messages; the
+    returned ``last_id`` is the cursor for the next call. Unchanged
+    conversations are answered with a 304 before anything is serialized.
+    """
+    messages = CaseMessage.objects.filter(case_id=case_id).select_related('sender').order_by('timestamp', 'id')
+
+    since = request.GET.get('since')
+    if since:
+        if since.isdigit():
+            messages = messages.filter(id__gt=int(since))
+        else:
+            since_time = parse_datetime(since)
+            if since_time is None:
+                return HttpResponseBadRequest("'since' must be a message id or an ISO timestamp.")
+            messages = messages.filter(timestamp__gt=since_time)
 
     data = []
     for msg in messages:
         data.append({
+            'id': msg.id,
             'user': msg.sender.username,
             'text': msg.message,
             'timestamp': msg.timestamp.strftime("%Y-%m-%d %H:%M:%S")
         })
     
-    return JsonResponse({'messages': data})
+    response = JsonResponse({
+        'messages': data,
+        'last_id': message_state(request, case_id)['last_id'] or 0,
+    })
+    # Let browsers keep the body but revalidate it on every poll.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+def case_archive(request, case_id):
+    """The archived history and chat of a case, for the detail page to load on demand."""
+    case = get_object_or_404(Case.objects.select_related('archive'), id=case_id)
+    if not is_participant(request.user, case.created_by_id, case.assigned_to_id):
+        raise Http404("No case found.")
+    if not hasattr(case, 'archive'):
+        raise Http404("This case has nothing archived.")
+    archived = load_archive(case)
+    for message in archived['messages']:
+        message['file_url'] = default_storage.url(message['file']) if message['file'] else ''
+    response = JsonResponse(archived)
+    # The archive only grows when the case is closed again; let browsers keep it briefly.
+    patch_cache_control(response, private=True, max_age=300)
+    return response
 
 
+@login_required
+@require_safe
+def protected_media(request, name):
+    """An uploaded file, for the people allowed to see it; see cases.media."""
+    name = clean_name(name)
+    if name is None or not can_view(request.user, name):
+        raise Http404("No such file.")
+    response = serve(request, name)
+    if response is None:
+        raise Http404("No such file.")
+    return response
+
+
+def request_data(request):
+    """A JSON object body, or the form fields."""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            raise UploadError("Invalid JSON.")
+        if not isinstance(data, dict):
+            raise UploadError("Expected a JSON object.")
+        return data
+    return request.POST
+
+
+def upload_error(error):
+    return JsonResponse({'error': str(error)}, status=error.status)
+
+
+def upload_state(upload):
+    return {
+        'id': str(upload.pk),
+        'url': reverse('upload_chunk', args=[upload.pk]),
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': CHUNK_SIZE,
+    }
+
+
+class UploadStartView(LoginRequiredMixin, View):
+    """
+    Start a chunked upload of {'target', 'filename', 'size'} to a case; see
+    cases.uploads. Answers with the URL to send the chunks to.
+    """
+
+    def post(self, request, case_id):
+        case = get_object_or_404(Case, id=case_id)
+        try:
+            data = request_data(request)
+            try:
+                size = int(data.get('size'))
+            except (TypeError, ValueError):
+                raise UploadError("Give the file's size in bytes.")
+            upload = start_upload(request.user, case, data.get('target'), data.get('filename'), size)
+        except UploadError as error:
+            return upload_error(error)
+        return JsonResponse(upload_state(upload), status=201)
+
+
+class UploadChunkView(LoginRequiredMixin, View):
+    """
+    GET reports how much of the upload has arrived, PATCH appends the chunk
+    in the body at its Upload-Offset header (with an optional
+    Upload-Checksum: sha256 <hex>), DELETE abandons the upload.
+    """
+
+    def get(self, request, upload_id):
+        try:
+            upload = owned_upload(ChunkedUpload.objects.all(), upload_id, request.user)
+        except UploadError as error:
+            return upload_error(error)
+        response = JsonResponse(upload_state(upload))
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+    def patch(self, request, upload_id):
+        try:
+            offset = request.headers.get('Upload-Offset', '')
+            if not offset.isdigit():
+                raise UploadError("Send the chunk's Upload-Offset.")
+            length = request.headers.get('Content-Length', '')
+            checksum = request.headers.get('Upload-Checksum', '').split()
+            sha256 = checksum[1] if len(checksum) == 2 and checksum[0].lower() == 'sha256' else None
+            # Read from the request stream; request.body would hold the chunk in memory.
+            upload = write_chunk(
+                upload_id, request.user, int(offset), request,
+                int(length) if length.isdigit() else None, sha256,
+            )
+        except UploadError as error:
+            return upload_error(error)
+        return JsonResponse(upload_state(upload))
+
+    def delete(self, request, upload_id):
+        try:
+            abort_upload(upload_id, request.user)
+        except UploadError as error:
+            return upload_error(error)
+        return HttpResponse(status=204)
+
+
+class UploadCompleteView(LoginRequiredMixin, View):
+    """Attach a fully sent upload, with {'sha256', 'message'} for chat attachments."""
+
+    def post(self, request, upload_id):
+        try:
+            data = request_data(request)
+            attached = complete_upload(upload_id, request.user, data.get('sha256'), data.get('message') or '')
+        except UploadError as error:
+            return upload_error(error)
+        if isinstance(attached, CaseMessage):
+            return JsonResponse({'case': attached.case_id, 'message': attached.pk, 'file_url': attached.file.url})
+        return JsonResponse({'case': attached.pk})
+
 
 # User = get_user_model()
 
@@ -177,20 +427,8 @@ class AssignHandlerInlineView(LoginRequiredMixin, View):
             handler = get_object_or_404(User, id=handler_id)
             case.assigned_to = handler
             case.status = 'Assigned'  # optional custom status
-            case.save()
-
-            # Log in case history
-            CaseHistory.objects.create(
-                case=case,
-                action=f'Case assigned to {case.assigned_to}',
-                performed_by=request.user
-            )
-
-            # WhatsApp redirect
-            if handler.phone_number:
-                phone = handler.phone_number.replace("+", "")
-                message = f"Hello {handler.username}, a new case ({case.title}) has been assigned to you. Please check the portal."
-                whatsapp_url = f"https://wa.me/{phone}?text={message.replace(' ', '%20')}"
-                return redirect(whatsapp_url)
+            case.save(actor=request.user)  # logged as "Case assigned to ..."
+            # The handler hears about it in their next digest; see cases.notifications.
+            django_messages.success(request, f"Case assigned to {handler.username}; they'll be notified.")
 
         return redirect('approved_cases')
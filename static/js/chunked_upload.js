@@ -0,0 +1,165 @@
+// Chunked, resumable uploads to cases.uploads: a dropped connection resumes
+// where it stopped instead of starting over. Each chunk carries its SHA-256,
+// and the whole file's, hashed chunk by chunk as it goes up, is checked
+// when the upload is completed.
+(function () {
+    const K = Int32Array.from([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+    ]);
+
+    // SHA-256 fed a piece at a time; Web Crypto only hashes whole buffers.
+    class Sha256 {
+        constructor() {
+            this.h = Int32Array.from([
+                0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19,
+            ]);
+            this.w = new Int32Array(64);
+            this.buffer = new Uint8Array(64);
+            this.buffered = 0;
+            this.length = 0;
+        }
+
+        update(bytes) {
+            this.length += bytes.length;
+            let i = 0;
+            if (this.buffered) {
+                i = Math.min(64 - this.buffered, bytes.length);
+                this.buffer.set(bytes.subarray(0, i), this.buffered);
+                this.buffered += i;
+                if (this.buffered < 64) return this;
+                this.block(this.buffer, 0);
+                this.buffered = 0;
+            }
+            for (; i + 64 <= bytes.length; i += 64) this.block(bytes, i);
+            this.buffer.set(bytes.subarray(i));
+            this.buffered = bytes.length - i;
+            return this;
+        }
+
+        block(bytes, at) {
+            const w = this.w, h = this.h;
+            for (let t = 0; t < 16; t++, at += 4) {
+                w[t] = bytes[at] << 24 | bytes[at + 1] << 16 | bytes[at + 2] << 8 | bytes[at + 3];
+            }
+            for (let t = 16; t < 64; t++) {
+                const x = w[t - 15], y = w[t - 2];
+                const s0 = (x >>> 7 | x << 25) ^ (x >>> 18 | x << 14) ^ (x >>> 3);
+                const s1 = (y >>> 17 | y << 15) ^ (y >>> 19 | y << 13) ^ (y >>> 10);
+                w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+            }
+            let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+            for (let t = 0; t < 64; t++) {
+                const s1 = (e >>> 6 | e << 26) ^ (e >>> 11 | e << 21) ^ (e >>> 25 | e << 7);
+                const t1 = (k + s1 + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+                const s0 = (a >>> 2 | a << 30) ^ (a >>> 13 | a << 19) ^ (a >>> 22 | a << 10);
+                const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                k = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+            }
+            h[0] += a; h[1] += b; h[2] += c; h[3] += d; h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+        }
+
+        hex() {
+            const bits = this.length * 8;
+            const padding = new Uint8Array((this.buffered < 56 ? 56 : 120) - this.buffered + 8);
+            padding[0] = 0x80;
+            const view = new DataView(padding.buffer);
+            view.setUint32(padding.length - 8, Math.floor(bits / 0x100000000));
+            view.setUint32(padding.length - 4, bits % 0x100000000);
+            this.update(padding);
+            return Array.from(this.h, word => (word >>> 0).toString(16).padStart(8, '0')).join('');
+        }
+    }
+
+    function uploadRequest(url, csrfToken, options) {
+        options.headers = Object.assign({'X-CSRFToken': csrfToken}, options.headers || {});
+        return fetch(url, options).then(res => res.json().then(data => {
+            if (!res.ok && res.status !== 409) throw new Error(data.error || res.statusText);
+            return data;
+        }));
+    }
+
+    async function chunkChecksum(chunk) {
+        if (!window.crypto || !crypto.subtle) return new Sha256().update(chunk).hex();
+        const digest = await crypto.subtle.digest('SHA-256', chunk);
+        return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function readSlice(file, start, end) {
+        return new Uint8Array(await file.slice(start, end).arrayBuffer());
+    }
+
+    // Upload ``file`` to the case whose upload URL is ``startUrl``, as
+    // ``target`` ('evidence', 'report' or 'message', with ``message``).
+    async function uploadFile(startUrl, target, file, {csrfToken, message = '', onProgress = () => {}}) {
+        const request = (url, options) => uploadRequest(url, csrfToken, options);
+        const key = `upload:${startUrl}:${target}:${file.name}:${file.size}:${file.lastModified}`;
+        let state = null;
+        if (localStorage.getItem(key)) {
+            state = await request(localStorage.getItem(key), {}).catch(() => null);
+        }
+        if (!state) {
+            state = await request(startUrl, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({target, filename: file.name, size: file.size}),
+            });
+            localStorage.setItem(key, state.url);
+        }
+        let whole = new Sha256(), hashed = 0;
+        // Catch the whole-file hash up to ``offset``, e.g. the part a resumed upload already sent.
+        async function hashTo(offset) {
+            if (offset < hashed) {
+                whole = new Sha256();
+                hashed = 0;
+            }
+            for (; hashed < offset; hashed = Math.min(offset, hashed + state.chunk_size)) {
+                whole.update(await readSlice(file, hashed, Math.min(offset, hashed + state.chunk_size)));
+            }
+        }
+        let failures = 0;
+        while (state.offset < file.size) {
+            onProgress(`Uploading ${Math.floor(100 * state.offset / file.size)}%`);
+            const offset = state.offset;
+            await hashTo(offset);
+            const chunk = await readSlice(file, offset, offset + state.chunk_size);
+            const headers = {
+                'Upload-Offset': String(offset),
+                'Upload-Checksum': `sha256 ${await chunkChecksum(chunk)}`,
+                'Content-Type': 'application/offset+octet-stream',
+            };
+            try {
+                const next = await request(state.url, {method: 'PATCH', headers, body: chunk});
+                // A 409 means the server has a different offset; carry on from it.
+                state = next.offset !== undefined ? next : await request(state.url, {});
+                if (state.offset === offset + chunk.length) {
+                    whole.update(chunk);
+                    hashed = state.offset;
+                }
+                failures = 0;
+            } catch (error) {
+                if (++failures > 5) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+                state = await request(state.url, {}).catch(() => state);
+            }
+        }
+        await hashTo(file.size);
+        onProgress('Attaching…');
+        const attached = await request(`${state.url}complete/`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({message, sha256: whole.hex()}),
+        });
+        localStorage.removeItem(key);
+        return attached;
+    }
+
+    window.Sha256 = Sha256;
+    window.uploadFile = uploadFile;
+})();